@@ -0,0 +1,267 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains an asyncio version of the IrcCon connection. IrcCon starts
+a thread for every connection, this one runs as tasks on an event loop instead
+so one loop can drive as many connections as we like and sleeps while idle.
+'''
+import asyncio
+import concurrent.futures
+import time
+from irclib import IrcCon, LineFramer
+
+class AsyncIrcCon(IrcCon):
+    '''
+    IrcCon using asyncio streams as the transport. The on_* callbacks,
+    register_handler and all the parsing are the same as IrcCon so a
+    subclass of IrcCon written with plain synchronous callbacks can be mixed
+    in, for example:
+
+        class AsyncClient(AsyncIrcCon,Client):
+            pass
+
+    Methods:
+        connect(HOST,PORT,SSL=False)
+            coroutine, connects and starts receiving on the running loop
+        wait_closed()
+            coroutine, returns once the connection has gone away
+        async_reconnect(), async_disconnect()
+            coroutines doing the same as reconnect and disconnect in IrcCon
+        reconnect(), disconnect()
+            schedule those on the loop for the callers written for IrcCon,
+            eg. a ChatCore handler, and return an awaitable
+
+    join, part, privmsg, whois, quitC, listChan and nickserv return an
+    awaitable which completes once the line has been written out, which may
+    take a while as lines go through the same flood control as IrcCon. They
+    can be called from the loop (await them or not) or from another thread,
+    in which case they return a concurrent.futures.Future. Before connect
+    the lines wait in the queue until we're connected.
+
+    With SSL the server's certificate is checked like IrcCon does, set
+    verify to False for a server with a self-signed one.
+    '''
+    loop = None
+    reader = None
+    writer = None
+    task = None
+    writeTask = None
+    tickTask = None
+    wakeTicker = None
+    # Set whenever something is put in the send queue
+    wakeWriter = None
+
+    # asyncio opens its own connection, IrcCon's blocking socket would
+    # never be used
+    def new_socket(self):
+        return None
+
+    async def connect(self,HOST=None,PORT=None,SSL=False):
+        '''
+        Connects to the IRC server, if sucessful starts the receive loop as a
+        task on the running event loop. Returns True on success
+
+        Calls:
+        ------
+        self.on_connect() : func
+            Called upon sucessful connection to server
+        self.on_error("ConnectionRefusedError")
+            Called if cannot reach server
+        '''
+        if HOST is not None:
+            self.HOST = HOST
+        if PORT is not None:
+            self.PORT = PORT
+        self.SSL = SSL
+        self.loop = asyncio.get_running_loop()
+        try:
+            # asyncio does the TLS handshake itself, no wrapped socket needed
+            ctx = self.ssl_context() if SSL else None
+            self.reader,self.writer = await asyncio.open_connection(self.HOST,self.PORT,ssl=ctx)
+        except (OSError,asyncio.TimeoutError):
+            self.on_error("ConnectionRefusedError")
+            self.connected = False
+            return False
+        self.connected = True
+        self.registered = False
+        self.reset_caps()
+        self.lag.reset()
+        self.wakeWriter = asyncio.Event()
+        self.on_connect()
+        self.task = self.loop.create_task(self.recv_loop(self.reader))
+        self.writeTask = self.loop.create_task(self.write_loop(self.writer))
+        self.wakeTicker = asyncio.Event()
+        self.tickTask = self.loop.create_task(self.tick_loop(self.reader))
+        return True
+
+    async def recv_loop(self,reader):
+        '''
+        Receive loop, the task sleeps on the loop until data arrives
+        '''
+        framer = LineFramer()
+        while True:
+            try:
+                data = await reader.read(len(framer.buf))
+            except (OSError,asyncio.IncompleteReadError):
+                data = b""
+            # The server closed the connection
+            if not data:
+                if reader is self.reader and self.connected:
+                    self.connected = False
+                    self.on_connection_broken()
+                return
+            self.lag.lastHeard = time.monotonic()
+            if self.capture is not None:
+                self.capture.inbound(data)
+            lines = framer.feed(data)
+            if self.metrics is not None:
+                self.metrics.inbound(len(data),len(lines))
+            if lines:
+                self.dispatch(lines)
+
+    async def tick_loop(self,reader):
+        '''
+        Tick task, calls tick when it's due until the connection is gone
+        '''
+        while reader is self.reader and self.connected:
+            try:
+                await asyncio.wait_for(self.wakeTicker.wait(),self.tick())
+            except asyncio.TimeoutError:
+                pass
+            self.wakeTicker.clear()
+
+    # The handlers run on the loop so we may touch the event
+    def wake_tick(self):
+        self.wakeTicker.set()
+
+    def connection_broken(self):
+        if not self.connected:
+            return
+        self.connected = False
+        self.loop.create_task(self.close())
+        self.on_connection_broken()
+
+    def send_lines(self,lines,priority=False):
+        '''
+        Queue lines for the server, each a line of its own for the flood
+        control. Returns an awaitable completing once they're all written,
+        send_raw returns the one for its line
+        '''
+        data = [bytes(f"{line}\r\n","UTF-8") for line in lines]
+        if self.metrics is not None:
+            for line in lines:
+                self.metrics.sent_line()
+        # Not connected yet, the writer sends it once we are
+        if self.loop is None:
+            waiter = concurrent.futures.Future()
+            self.sendq.put_lines(data,priority,waiter)
+            return waiter
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            waiter = self.loop.create_future()
+            self.sendq.put_lines(data,priority,waiter)
+            self.wakeWriter.set()
+            return waiter
+        # Called from another thread such as a GUI, only the loop may touch
+        # the event
+        waiter = concurrent.futures.Future()
+        self.sendq.put_lines(data,priority,waiter)
+        self.loop.call_soon_threadsafe(self.wakeWriter.set)
+        return waiter
+
+    async def write_loop(self,writer):
+        '''
+        Writer task, sends whatever the flood control allows in one write
+        '''
+        sendq = self.sendq
+        while writer is self.writer:
+            self.wakeWriter.clear()
+            delay = sendq.delay()
+            if delay != 0:
+                try:
+                    await asyncio.wait_for(self.wakeWriter.wait(),delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            data = sendq.take()
+            if not data:
+                continue
+            writer.write(data)
+            if self.capture is not None:
+                self.capture.outbound(data)
+            if self.metrics is not None:
+                self.metrics.outbound(len(data))
+            done = sendq.sent(len(data))
+            try:
+                await writer.drain()
+            except OSError:
+                return
+            for waiter in done:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    async def wait_closed(self):
+        '''
+        Wait for the receive loop to finish, ie. the connection has gone away
+        '''
+        if self.task:
+            await self.task
+
+    async def close(self):
+        # First, so the receive task doesn't take it for a broken connection
+        self.connected = False
+        for waiter in self.sendq.reset():
+            waiter.cancel()
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+        # Let the writer task see it's done
+        if self.wakeWriter:
+            self.wakeWriter.set()
+        self.userDone = False
+        self.connected = False
+
+    # Reconnect to the IRC server
+    async def async_reconnect(self):
+        await self.close()
+        await self.connect(self.HOST,self.PORT,self.SSL)
+        self.login(self.NICK,self.USER,self.RNAME)
+
+    # Disconnect from the IRC server
+    async def async_disconnect(self):
+        await self.close()
+
+    def reconnect(self):
+        if self.loop is None:
+            raise RuntimeError("Never connected, await connect() first")
+        return self.schedule(self.async_reconnect())
+
+    def disconnect(self):
+        # Nothing to close
+        if self.loop is None:
+            done = concurrent.futures.Future()
+            done.set_result(None)
+            return done
+        return self.schedule(self.async_disconnect())
+
+    def schedule(self,coro):
+        '''
+        Run coro on our loop, returns a task from the loop and a
+        concurrent.futures.Future from another thread
+        '''
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            return self.loop.create_task(coro)
+        return asyncio.run_coroutine_threadsafe(coro,self.loop)
@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the BacklogReader which reads a tab's chat logs from the end
+backwards. Opening a tab only reads the last page of lines instead of the whole
+history, older pages are read when the user asks for them. Each file is mapped
+with mmap and searched backwards for line endings, the line start offsets found
+are kept so a page that was read once can be read again without searching.
+
+Where the tab is in the logs is counted in lines from their end: the lines the
+tab shows were all logged last, so the next page is whatever comes before them.
+The count grows as lines are shown or paged in and shrinks as the chat box is
+trimmed, which makes the trimmed lines the next page again. The files are looked
+at again before every page so lines logged since and new day files count too.
+'''
+import mmap
+import os
+
+# Lines shown when a tab is opened and per page after that
+PAGE = 200
+
+class LogIndex(object):
+    '''
+    Line start offsets of one log file, found from the end backwards
+
+    Attributes:
+        path : str
+            The log file
+        size : int
+            Size of the file when it was indexed, see stale
+        starts : list
+            Offsets of the line starts, starts[0] is the start of the last
+            line, starts[1] of the one before it etc.
+        done : bool
+            True once the first line of the file was found
+    '''
+    def __init__(self,path,size=None):
+        self.path = path
+        self.size = os.path.getsize(path) if size is None else size
+        self.starts = []
+        # Where the backwards search continues, the last line ending
+        # doesn't start a line
+        self.scanEnd = self.size
+        self.done = self.size == 0
+        self.trailing = False
+        if self.size:
+            with open(path,"rb") as f:
+                f.seek(self.size - 1)
+                self.trailing = f.read(1) == b"\n"
+            if self.trailing:
+                self.scanEnd -= 1
+
+    def stale(self,size):
+        '''
+        True if the file has changed size since it was indexed
+        '''
+        return size != self.size
+
+    def index(self,mm,count):
+        '''
+        Find line starts until there are count of them or the file is done
+        '''
+        while len(self.starts) < count and not self.done:
+            i = mm.rfind(b"\n",0,self.scanEnd)
+            self.starts.append(i + 1)
+            if i == -1:
+                self.done = True
+            else:
+                self.scanEnd = i
+
+    def lines(self,first,count):
+        '''
+        Read count lines going back from line first, counted from the end.
+        Returns the text, oldest line first, and how many lines it has
+        '''
+        if self.done and first >= len(self.starts):
+            return ("",0)
+        with open(self.path,"rb") as f:
+            with mmap.mmap(f.fileno(),self.size,access=mmap.ACCESS_READ) as mm:
+                self.index(mm,first + count)
+                last = min(first + count,len(self.starts))
+                if last <= first:
+                    return ("",0)
+                start = self.starts[last - 1]
+                end = self.starts[first - 1] if first else self.size
+                data = mm[start:end]
+        if not data.endswith(b"\n"):
+            data += b"\n"
+        return (data.decode("UTF-8",errors="replace"),last - first)
+
+class BacklogReader(object):
+    '''
+    Pages backwards through the log files of a tab, listPaths() gives them
+    oldest first
+
+    Methods:
+        older(count=PAGE)
+            the next count older lines as one string, empty when there
+            are none left
+        shown(lines)
+            lines were logged and shown at the bottom of the tab
+        trimmed(lines)
+            lines were deleted from the top of the tab
+        exhausted()
+            True once every line before the top of the tab was read
+    '''
+    def __init__(self,listPaths):
+        self.listPaths = listPaths
+        # Path -> LogIndex, an older day file never changes so its index
+        # is kept
+        self.files = dict()
+        # Lines at the end of the logs which the tab shows or has trimmed
+        # since, the next page ends just before them
+        self.below = 0
+        self.done = False
+
+    def exhausted(self):
+        return self.done
+
+    def shown(self,lines):
+        self.below += lines
+
+    def trimmed(self,lines):
+        self.below = max(0,self.below - lines)
+        if lines:
+            self.done = False
+
+    def logs(self):
+        '''
+        The LogIndex of every non-empty log file, oldest first, indexing the
+        ones which are new or grew
+        '''
+        logs = []
+        files = dict()
+        for path in self.listPaths():
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            if not size:
+                continue
+            log = self.files.get(path)
+            if log is None or log.stale(size):
+                log = LogIndex(path,size)
+            files[path] = log
+            logs.append(log)
+        self.files = files
+        return logs
+
+    def older(self,count=PAGE):
+        pages = []
+        # Lines from the end of the newest file still to skip
+        skip = self.below
+        wanted = count
+        for log in reversed(self.logs()):
+            if count <= 0:
+                break
+            try:
+                (text,lines) = log.lines(skip,count)
+            except (OSError,ValueError):
+                # The file went away or shrank, skip it
+                continue
+            if lines:
+                pages.append(text)
+                count -= lines
+                skip = 0
+            else:
+                # All of this file is below the top of the tab
+                skip -= len(log.starts)
+        got = wanted - count
+        self.below += got
+        if got < wanted:
+            self.done = True
+        return "".join(reversed(pages))
@@ -0,0 +1,322 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file runs the benchmarks against the fake IRC server in fakeserver.py, no
+real IRC server needed. Each case runs in its own process so the memory numbers
+aren't mixed up, and the results are written as JSON so two versions can be
+compared. From the top of the repo:
+
+    python3 benchmarks/bench.py
+    python3 benchmarks/bench.py -w privmsg -w names --tls no --scale 0.2
+    python3 benchmarks/bench.py --compare benchmarks/results/before.json
+
+A case is workload/client/transport/plain|tls:
+    workload    privmsg, names, netsplit or list, see workloads.py
+    client      irccon (only the protocol) or core (ChatCore with a sink that
+                drops everything, ie. roster, colours etc. but no GUI)
+    transport   thread (IrcCon's own receive thread) or session (SessionManager)
+
+Measured are the lines handled per second through recv_loop/incoming, the
+latency from the server sending a line to its handler returning, and how much
+the resident memory grew. With --render, and PySimpleGUI and a display, it also
+times appending to a chat box like the GUI does.
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0,ROOT)
+
+from irclib import IrcCon
+from core import ChatCore, Sink
+from session import SessionManager
+from workloads import WORKLOADS
+from fakeserver import FakeServer, DONE
+
+CLIENTS = ("irccon","core")
+TRANSPORTS = ("thread","session")
+# Max seconds for one case
+TIMEOUT = 600
+# A change of more than this much is reported by --compare
+THRESHOLD = 0.10
+
+def benchClass(base):
+    '''
+    Subclass base to count the lines, time them and notice the end
+    '''
+    class BenchCon(base):
+        def __init__(self,*args):
+            base.__init__(self,*args)
+            self.count = 0
+            self.latencies = []
+            self.started = None
+            self.finished = None
+            self.total = None
+            self.done = threading.Event()
+            self.register_handler("001",self.bench_welcome)
+            self.register_handler("PING",self.bench_ping)
+
+        def incoming(self,msg):
+            base.incoming(self,msg)
+            self.count += 1
+            stamp = msg.tags.get("t")
+            if stamp:
+                self.latencies.append(time.perf_counter_ns() - int(stamp))
+
+        def bench_welcome(self,msg):
+            self.started = time.perf_counter()
+            self.count = -1
+
+        def bench_ping(self,msg):
+            if msg.params[0] == DONE:
+                # A netsplit waits to be shown in one go, that's part of
+                # the work
+                self.flush_bursts()
+                self.finished = time.perf_counter()
+                # The workload lines, not the 001 or this PING
+                self.total = self.count
+                self.done.set()
+            else:
+                self.handle_ping(msg)
+
+    return BenchCon
+
+def rss():
+    '''
+    Resident memory of this process in bytes
+    '''
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def peakRss():
+    import resource
+    # Linux gives kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def percentile(values,p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1,int(len(values) * p))]
+
+def runCase(workload,client,transport,tls,scale):
+    '''
+    Run one case in this process, returns its metrics
+    '''
+    make = WORKLOADS[workload]
+    defaults = make.__defaults__
+    # Scale the sizes, the first argument is always the main one
+    lines = make(max(1,int(defaults[0] * scale)),*defaults[1:])
+    server = FakeServer(lines,tls)
+    server.start()
+    before = rss()
+    if client == "core":
+        con = benchClass(ChatCore)(Sink())
+    else:
+        con = benchClass(IrcCon)()
+    # The fake server's certificate is self-signed
+    con.verify = False
+    manager = None
+    if transport == "session":
+        manager = SessionManager()
+        manager.start()
+        manager.add("bench",con)
+    if not con.connect("127.0.0.1",server.port,tls):
+        raise RuntimeError("Could not connect to the fake server")
+    con.login("bench","bench","bench")
+    if not con.done.wait(TIMEOUT):
+        raise RuntimeError(f"Timed out after {con.count} lines")
+    after = rss()
+    seconds = con.finished - con.started
+    con.disconnect()
+    if manager:
+        manager.stop()
+    server.stop()
+    latencies = [ns / 1e6 for ns in con.latencies]
+    return {
+        "lines": con.total,
+        "seconds": seconds,
+        "lines_per_sec": con.total / seconds if seconds else None,
+        "latency_ms_p50": percentile(latencies,0.5),
+        "latency_ms_p99": percentile(latencies,0.99),
+        "latency_ms_max": max(latencies) if latencies else None,
+        "rss_growth_mb": (after - before) / 2**20,
+        "peak_rss_mb": peakRss() / 2**20,
+    }
+
+def runRender(scale,batch=100):
+    '''
+    Time appending messages to a Multiline like UiQueue.flush does, needs
+    PySimpleGUI and a display
+    '''
+    try:
+        import PySimpleGUI as sg
+        import client
+    except ImportError as e:
+        return {"skipped": f"{e}"}
+    try:
+        win = sg.Window("bench",[[sg.Multiline(size=(75,15),key="benchB",autoscroll=True,disabled=True)]],finalize=True)
+    except Exception as e:
+        return {"skipped": f"no display: {e}"}
+    count = max(batch,int(50000 * scale))
+    messages = [[("12:00:00 | ",None,None),(f"user{i % 50} ",f"#{i % 256:02x}8040",None),(f"> message number {i}\n",None,None)] for i in range(count)]
+    start = time.perf_counter()
+    for i in range(0,count,batch):
+        segments = [segment for message in messages[i:i + batch] for segment in message]
+        client.appendSegments(win,"bench",segments,2000)
+        win.refresh()
+    seconds = time.perf_counter() - start
+    win.close()
+    return {"lines": count,"seconds": seconds,"lines_per_sec": count / seconds}
+
+def caseName(workload,client,transport,tls):
+    return f"{workload}/{client}/{transport}/{'tls' if tls else 'plain'}"
+
+def runSubprocess(args,scale):
+    '''
+    Run a case in a new process, returns its metrics
+    '''
+    cmd = [sys.executable,os.path.abspath(__file__),"--case",args,"--scale",str(scale)]
+    out = subprocess.run(cmd,capture_output=True,text=True)
+    if out.returncode != 0:
+        return {"error": out.stderr.strip().splitlines()[-1] if out.stderr.strip() else f"exit {out.returncode}"}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def median(runs,key):
+    values = [run[key] for run in runs if run.get(key) is not None]
+    return statistics.median(values) if values else None
+
+def summarise(runs):
+    '''
+    Median of each metric over the repeats
+    '''
+    good = [run for run in runs if "error" not in run and "skipped" not in run]
+    if not good:
+        return runs[-1]
+    summary = {key: median(good,key) for key in good[0]}
+    summary["runs"] = len(good)
+    return summary
+
+def gitRevision():
+    try:
+        out = subprocess.run(["git","rev-parse","--short","HEAD"],cwd=ROOT,capture_output=True,text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+# Metric -> True if higher is better
+COMPARED = {"lines_per_sec": True,"latency_ms_p50": False,"rss_growth_mb": False}
+
+def compare(old,new,threshold=THRESHOLD):
+    '''
+    Returns the lines describing regressions of new against old
+    '''
+    regressions = []
+    for name,result in new["results"].items():
+        base = old.get("results",dict()).get(name)
+        if not base:
+            continue
+        for metric,higher in COMPARED.items():
+            (a,b) = (base.get(metric),result.get(metric))
+            if a is None or b is None or a == 0:
+                continue
+            change = (b - a) / abs(a)
+            worse = change < -threshold if higher else change > threshold
+            # Tiny memory changes are just noise
+            if metric == "rss_growth_mb" and abs(b - a) < 1:
+                worse = False
+            if worse:
+                regressions.append(f"{name} {metric}: {a:.4g} -> {b:.4g} ({change:+.0%})")
+    return regressions
+
+def table(results):
+    print(f"{'case':40} {'lines/s':>12} {'p50 ms':>9} {'p99 ms':>9} {'rss +MB':>9}")
+    for name,result in results.items():
+        if "error" in result or "skipped" in result:
+            print(f"{name:40} {result.get('error') or 'skipped: ' + result['skipped']}")
+            continue
+        cells = [result.get("lines_per_sec"),result.get("latency_ms_p50"),result.get("latency_ms_p99"),result.get("rss_growth_mb")]
+        cells = ["-" if value is None else f"{value:.1f}" for value in cells]
+        print(f"{name:40} {cells[0]:>12} {cells[1]:>9} {cells[2]:>9} {cells[3]:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Slick IRC benchmarks")
+    parser.add_argument("-w","--workload",action="append",choices=sorted(WORKLOADS),help="workloads to run, default all")
+    parser.add_argument("-c","--client",action="append",choices=CLIENTS,help="clients to run, default all")
+    parser.add_argument("-t","--transport",action="append",choices=TRANSPORTS,help="transports to run, default all")
+    parser.add_argument("--tls",choices=("no","yes","both"),default="both")
+    parser.add_argument("--scale",type=float,default=1.0,help="multiply the workload sizes")
+    parser.add_argument("--repeat",type=int,default=3,help="runs per case, the median is kept")
+    parser.add_argument("--render",action="store_true",help="also time the GUI chat box")
+    parser.add_argument("--out",help="results file, default benchmarks/results/<date>.json")
+    parser.add_argument("--compare",help="results file to check for regressions against")
+    parser.add_argument("--case",help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process running a single case
+    if args.case:
+        if args.case == "render":
+            result = runRender(args.scale)
+        else:
+            (workload,client,transport,tls) = args.case.split("/")
+            result = runCase(workload,client,transport,tls == "tls",args.scale)
+        print(json.dumps(result))
+        return 0
+
+    tlsModes = {"no": (False,),"yes": (True,),"both": (False,True)}[args.tls]
+    cases = []
+    for workload in args.workload or sorted(WORKLOADS):
+        for client in args.client or CLIENTS:
+            for transport in args.transport or TRANSPORTS:
+                for tls in tlsModes:
+                    cases.append(caseName(workload,client,transport,tls))
+    if args.render:
+        cases.append("render")
+    results = dict()
+    for name in cases:
+        runs = [runSubprocess(name,args.scale) for i in range(args.repeat)]
+        results[name] = summarise(runs)
+        print(f"{name} done",file=sys.stderr)
+    report = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "revision": gitRevision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scale": args.scale,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    table(results)
+    out = args.out
+    if out is None:
+        os.makedirs(os.path.join(HERE,"results"),exist_ok=True)
+        out = os.path.join(HERE,"results",datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(out,"w") as f:
+        json.dump(report,f,indent=1)
+    print(f"Results written to {out}")
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        regressions = compare(old,report)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print("No regressions")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the fake IRC server for the benchmarks. It runs on a thread
+in the benchmark process, waits for NICK and USER, sends 001 and then replays a
+workload as fast as the socket takes it, followed by PING :bench-done. Every
+chunk starts with a line tagged @t=<perf_counter_ns> so the client can measure
+the latency from sending to handling.
+'''
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+# Lines per sendall, the first of each is timestamped
+CHUNK = 64
+DONE = "bench-done"
+
+def selfSigned(directory):
+    '''
+    Make a self signed certificate with the openssl command, returns
+    (certfile,keyfile) or None if there's no openssl
+    '''
+    openssl = shutil.which("openssl")
+    if openssl is None:
+        return None
+    cert = os.path.join(directory,"cert.pem")
+    key = os.path.join(directory,"key.pem")
+    subprocess.run([openssl,"req","-x509","-newkey","rsa:2048","-nodes","-keyout",key,"-out",cert,
+        "-days","1","-subj","/CN=localhost"],check=True,capture_output=True)
+    return (cert,key)
+
+class FakeServer(object):
+    '''
+    Methods:
+        start()
+            listen on a free port, see self.port
+        stop()
+            stop listening
+    '''
+    def __init__(self,lines,tls=False,host="127.0.0.1"):
+        self.lines = lines
+        self.host = host
+        self.port = None
+        self.context = None
+        self.tempdir = None
+        if tls:
+            self.tempdir = tempfile.TemporaryDirectory()
+            pair = selfSigned(self.tempdir.name)
+            if pair is None:
+                raise RuntimeError("TLS needs the openssl command")
+            self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.context.load_cert_chain(*pair)
+        # Joined up front, the server shouldn't be what we measure
+        self.chunks = [b"".join(lines[i:i + CHUNK]) for i in range(0,len(lines),CHUNK)]
+        self.sock = None
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+        self.sock.bind((self.host,0))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self.accept,daemon=True).start()
+
+    def stop(self):
+        self.sock.close()
+        if self.tempdir:
+            self.tempdir.cleanup()
+
+    def accept(self):
+        while True:
+            try:
+                (con,addr) = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve,args=(con,),daemon=True).start()
+
+    def serve(self,con):
+        try:
+            if self.context:
+                con = self.context.wrap_socket(con,server_side=True)
+            f = con.makefile("rb")
+            for line in f:
+                if line.startswith(b"USER"):
+                    break
+            con.sendall(f":irc.example 001 bench :Welcome to the benchmark\r\n".encode())
+            for chunk in self.chunks:
+                con.sendall(b"@t=%d " % time.perf_counter_ns() + chunk)
+            con.sendall(f"PING :{DONE}\r\n".encode())
+            # Wait for the client to hang up
+            for line in f:
+                pass
+        except OSError:
+            pass
+        finally:
+            con.close()
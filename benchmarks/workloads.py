@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the benchmark workloads, what the fake server sends once we
+have registered. Each returns the lines as bytes, ending in \\r\\n and without
+tags as the server adds a timestamp tag to some of them.
+'''
+
+NICK = "bench"
+
+def privmsg(count=200000,users=500,channels=10):
+    '''
+    A flood of channel messages from many users
+    '''
+    lines = []
+    for i in range(count):
+        who = f"user{i % users}"
+        lines.append(f":{who}!~{who}@host{i % users}.example PRIVMSG #chan{i % channels} :message number {i} from {who} with a bit of text\r\n".encode())
+    return lines
+
+def names(members=10000,channels=20):
+    '''
+    Joining big channels, a NAMES reply of members for each
+    '''
+    lines = []
+    for c in range(channels):
+        chan = f"#big{c}"
+        lines.append(f":{NICK}!~{NICK}@me.example JOIN {chan}\r\n".encode())
+        lines.extend(namesReply(chan,[f"{'@' if i % 50 == 0 else ''}member{i}" for i in range(members)]))
+    return lines
+
+def namesReply(chan,nicks,width=400):
+    '''
+    353 lines of up to width bytes of names and the 366, like a server sends
+    '''
+    lines = []
+    batch = []
+    size = 0
+    for nick in nicks:
+        if batch and size + len(nick) + 1 > width:
+            lines.append(f":irc.example 353 {NICK} = {chan} :{' '.join(batch)}\r\n".encode())
+            batch = []
+            size = 0
+        batch.append(nick)
+        size += len(nick) + 1
+    if batch:
+        lines.append(f":irc.example 353 {NICK} = {chan} :{' '.join(batch)}\r\n".encode())
+    lines.append(f":irc.example 366 {NICK} {chan} :End of /NAMES list.\r\n".encode())
+    return lines
+
+def netsplit(users=20000,channels=5):
+    '''
+    Everyone on the other side of a split quits, after the NAMES to know them
+    '''
+    lines = []
+    nicks = [f"split{i}" for i in range(users)]
+    for c in range(channels):
+        chan = f"#split{c}"
+        lines.append(f":{NICK}!~{NICK}@me.example JOIN {chan}\r\n".encode())
+        lines.extend(namesReply(chan,nicks))
+    for nick in nicks:
+        lines.append(f":{nick}!~{nick}@far.example QUIT :hub.example leaf.example\r\n".encode())
+    return lines
+
+def listing(channels=50000):
+    '''
+    LIST on a big network
+    '''
+    lines = [f":irc.example 321 {NICK} Channel :Users  Name\r\n".encode()]
+    for i in range(channels):
+        lines.append(f":irc.example 322 {NICK} #channel{i} {i % 300 + 1} :Topic of channel {i}, welcome\r\n".encode())
+    lines.append(f":irc.example 323 {NICK} :End of /LIST\r\n".encode())
+    return lines
+
+WORKLOADS = {
+    "privmsg": privmsg,
+    "names": names,
+    "netsplit": netsplit,
+    "list": listing,
+}
@@ -0,0 +1,44 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the helpers for IRCv3 capability negotiation, see
+https://ircv3.net/specs/extensions/capability-negotiation
+
+IrcCon.login starts registration with CAP LS 302, requests whichever of its
+wantCaps the server offers and only then ends it with CAP END, so everything
+is on before the server sends 001. The capabilities we ask for by default:
+    message-tags    tags on any message, eg. msgid
+    server-time     a time tag with when the server got the message, shown
+                    instead of when we got it
+    batch           groups such as a netsplit come as one BATCH
+    multi-prefix    all the mode prefixes in NAMES, eg. @+nick
+    away-notify     AWAY when someone in our channels goes away or is back
+    extended-join   JOIN has the account and real name
+    echo-message    the server sends our own messages back, so we show
+                    them as the server saw them
+'''
+import datetime
+
+CAPS = ["message-tags","server-time","batch","multi-prefix","away-notify","extended-join","echo-message"]
+
+def parse_caps(text):
+    '''
+    "sasl=PLAIN,EXTERNAL batch" to {"sasl": "PLAIN,EXTERNAL", "batch": None}
+    '''
+    caps = dict()
+    for cap in text.split():
+        (name,equals,value) = cap.partition("=")
+        caps[name] = value if equals else None
+    return caps
+
+def server_time(value):
+    '''
+    Seconds since the epoch of a server-time tag such as
+    "2011-10-19T16:40:51.620Z", None if it doesn't parse
+    '''
+    try:
+        return datetime.datetime.fromisoformat(value.replace("Z","+00:00")).timestamp()
+    except ValueError:
+        return None
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the traffic capture and replay. With a capture started an
+IrcCon writes every chunk of bytes it receives and sends to a file, along with
+when it happened, so a problem seen on a real network can be replayed exactly
+as often as we like.
+
+A capture file starts with MAGIC and the wall clock time it was started, then
+one record per chunk:
+    direction (1 byte, IN or OUT), seconds since the start (double),
+    length (4 bytes) and the bytes themselves
+It is gzip or xz compressed if the file name ends in .gz or .xz.
+
+    python3 capture.py dump net.cap.gz
+    python3 capture.py replay net.cap.gz [--pace] [--speed 2] [--core]
+'''
+import argparse
+import gzip
+import lzma
+import struct
+import sys
+import threading
+import time
+from irclib import IrcCon, LineFramer
+
+MAGIC = b"SLKCAP1\n"
+HEADER = struct.Struct("<d")
+RECORD = struct.Struct("<BdI")
+IN = 0
+OUT = 1
+
+def openFile(path,mode):
+    if path.endswith(".gz"):
+        return gzip.open(path,mode)
+    if path.endswith(".xz"):
+        return lzma.open(path,mode)
+    return open(path,mode)
+
+class Capture(object):
+    '''
+    Writes a capture file, the receive and writer threads both write to it
+
+    Methods:
+        inbound(data), outbound(data)
+            record bytes received or sent
+        close()
+            finish the file
+    '''
+    def __init__(self,path):
+        self.path = path
+        self.file = openFile(path,"wb")
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+        self.file.write(MAGIC + HEADER.pack(time.time()))
+
+    def record(self,direction,data):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(RECORD.pack(direction,time.monotonic() - self.start,len(data)))
+            self.file.write(data)
+
+    def inbound(self,data):
+        self.record(IN,data)
+
+    def outbound(self,data):
+        self.record(OUT,data)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+def read_capture(path):
+    '''
+    Yields (direction, seconds, bytes) for each record of a capture file
+    '''
+    with openFile(path,"rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        f.read(HEADER.size)
+        while True:
+            head = f.read(RECORD.size)
+            # A capture cut short by a crash just ends early
+            if len(head) < RECORD.size:
+                return
+            (direction,seconds,length) = RECORD.unpack(head)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield (direction,seconds,data)
+
+def replay(path,con,pace=False,speed=1.0):
+    '''
+    Feed the received bytes of a capture to con as if they came from the
+    server, what con sends in return is dropped apart from the NICK we had.
+    As fast as possible, or with pace at the original timing divided by
+    speed. Returns (lines, seconds)
+    '''
+    framer = LineFramer()
+    lines = 0
+    start = time.perf_counter()
+    for (direction,seconds,data) in read_capture(path):
+        if direction != IN:
+            # Handlers check for our own nick
+            for line in data.decode("UTF-8",errors="replace").splitlines():
+                if line.startswith("NICK "):
+                    con.NICK = line[5:].strip()
+            continue
+        if pace:
+            wait = start + seconds / speed - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        batch = framer.feed(data)
+        if batch:
+            lines += len(batch)
+            con.dispatch(batch)
+            # Nobody writes the replies out
+            con.sendq.reset()
+    # Nothing calls con.tick, show what it still holds back
+    con.flush_bursts()
+    return (lines,time.perf_counter() - start)
+
+def dump(path,out=sys.stdout):
+    arrows = {IN: "<<",OUT: ">>"}
+    for (direction,seconds,data) in read_capture(path):
+        for line in data.decode("UTF-8",errors="replace").splitlines():
+            out.write(f"{seconds:12.6f} {arrows[direction]} {line}\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Dump or replay a traffic capture")
+    parser.add_argument("action",choices=("dump","replay"))
+    parser.add_argument("path")
+    parser.add_argument("--pace",action="store_true",help="replay at the original timing")
+    parser.add_argument("--speed",type=float,default=1.0,help="with --pace, this many times faster")
+    parser.add_argument("--core",action="store_true",help="replay into ChatCore instead of a bare IrcCon")
+    args = parser.parse_args()
+    if args.action == "dump":
+        dump(args.path)
+        return
+    if args.core:
+        from core import ChatCore, Sink
+        con = ChatCore(Sink())
+    else:
+        con = IrcCon()
+    (lines,seconds) = replay(args.path,con,args.pace,args.speed)
+    rate = lines / seconds if seconds else 0
+    print(f"{lines} lines in {seconds:.3f} s, {rate:.0f} lines/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the ChatLogger which writes every message shown in a tab to
+disk as it comes in. The GUI only puts the line on a queue, a background thread
+appends it to chatlog/<network>/<tab>/<YYYY-MM-DD>.txt through a buffered file
+and flushes every few seconds. A new file is started each day.
+'''
+import datetime
+import os
+import queue
+import threading
+import time
+
+# Seconds between flushes of the log files
+FLUSH_INTERVAL = 2
+# Files kept open at once, the least recently written one is closed first
+MAXOPEN = 64
+
+def logName(name):
+    '''
+    Channel names may contain a slash, keep them to a single path component
+    '''
+    return name.replace(os.sep,"%2F")
+
+def logDir(root,network,tab):
+    return os.path.join(root,logName(network),logName(tab))
+
+class ChatLogger(object):
+    '''
+    Methods:
+        start()
+            start the writer thread
+        write(network,tab,text)
+            append text to the log of tab, text includes the line ending
+        flush(timeout=None)
+            wait until everything written so far is on disk
+        close()
+            flush, close the files and stop the thread
+    '''
+    def __init__(self,root="chatlog",interval=FLUSH_INTERVAL,today=datetime.date.today):
+        self.root = root
+        self.interval = interval
+        # Returns the date a line is logged under
+        self.today = today
+        self.queue = queue.SimpleQueue()
+        # (network, tab) -> (date, file), only touched by the writer thread
+        self.files = dict()
+        self.dirty = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run,daemon=True)
+        self.thread.start()
+
+    def write(self,network,tab,text):
+        self.queue.put(("write",network,tab,text,self.today()))
+
+    def flush(self,timeout=None):
+        done = threading.Event()
+        self.queue.put(("flush",done))
+        return done.wait(timeout)
+
+    def close(self,timeout=None):
+        done = threading.Event()
+        self.queue.put(("close",done))
+        return done.wait(timeout)
+
+    def run(self):
+        lastFlush = time.monotonic()
+        while True:
+            timeout = None
+            if self.dirty:
+                timeout = max(0,lastFlush + self.interval - time.monotonic())
+            try:
+                event = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                event = None
+            if event is not None and event[0] == "write":
+                try:
+                    self.append(*event[1:])
+                # A full disk or bad permissions shouldn't take the client
+                # down, the line just isn't logged
+                except OSError:
+                    pass
+            elif event is not None:
+                self.flush_files()
+                lastFlush = time.monotonic()
+                if event[0] == "close":
+                    self.close_files()
+                    event[1].set()
+                    return
+                event[1].set()
+                continue
+            if self.dirty and time.monotonic() - lastFlush >= self.interval:
+                self.flush_files()
+                lastFlush = time.monotonic()
+
+    def append(self,network,tab,text,date):
+        key = (network,tab)
+        entry = self.files.pop(key,None)
+        # Rotate at midnight
+        if entry is not None and entry[0] != date:
+            entry[1].close()
+            entry = None
+        if entry is None:
+            entry = (date,self.open(network,tab,date))
+            if len(self.files) >= MAXOPEN:
+                oldest = next(iter(self.files))
+                self.files.pop(oldest)[1].close()
+        # Reinserting keeps the dict ordered by last use
+        self.files[key] = entry
+        entry[1].write(text)
+        self.dirty = True
+
+    def open(self,network,tab,date):
+        path = logDir(self.root,network,tab)
+        os.makedirs(path,exist_ok=True)
+        return open(os.path.join(path,f"{date.isoformat()}.txt"),"a",encoding="UTF-8")
+
+    def flush_files(self):
+        for (date,f) in self.files.values():
+            try:
+                f.flush()
+            except OSError:
+                pass
+        self.dirty = False
+
+    def close_files(self):
+        for (date,f) in self.files.values():
+            f.close()
+        self.files = dict()
+        self.dirty = False
+
+def logFiles(root,network,tab):
+    '''
+    The day files of a tab, oldest first
+    '''
+    path = logDir(root,network,tab)
+    if not os.path.isdir(path):
+        return []
+    return [os.path.join(path,name) for name in sorted(os.listdir(path)) if name.endswith(".txt")]
@@ -8,21 +8,29 @@ I made to abstract the IRC protocol wheras this program deals with the GUI and p
 it all together. I'm going to try to break it into more files but at the moment
 this is it.
 '''
-from irclib import IrcCon
+# First so the startup trace starts counting before the other imports
+import startup
+from core import ChatCore, Sink, BOLD, timestamp
+from session import SessionManager
+from filters import FilterEngine
+from tabs import TabRegistry
+from scrollback import trimWidget
+from chatlog import ChatLogger, logFiles
+from backlog import BacklogReader, PAGE
+from store import MessageStore, parse_search
+from metrics import Exporter, export
 # PySimpleGUI is a wrapper for tkinter and some other frameworks
 import PySimpleGUI as sg
 import time
-from colorhash import ColorHash as chash
-from windows import loginWin,errorWin,commandsWin,aboutWin,filterWin
+import queue
+import collections
+from windows import loginWin,errorWin
+from settings import load_profile, save_profile, load_auth, load_flood, save_flood
 from sys import platform
 import os
-import datetime
+import threading
+startup.mark("imports")
 
-if platform == "darwin" or platform == "win32":
-    print("\033[93mUnsupported Operating System, this program only works on Linux\033[0m")
-    raise OSError
-
-sg.theme("SystemDefault")
 #### CUSTOM EXCEPTIONS ####
 class EmptyValue(Exception):
     def __init__(self):
@@ -34,202 +42,218 @@ class InvalidCommand(Exception):
         self.message = "User gave an invalid command"
         super().__init__(self.message)
 
-class Client(IrcCon):
+class UiQueue(Sink):
     '''
-    Extend the IrcCon class which abstracts the IRC protocol so that we can 
-    handle events and appropriately update the GUI
+    Sink for the GUI. Tk must only be touched from the main thread, so the
+    events from the receive thread are queued here and the main loop applies
+    them all in one go, see drain.
     '''
-    def __init__(self,window):
+    # Max events waiting, the receive thread blocks when we're this far
+    # behind which is better than eating all the memory. The main thread
+    # must never block on it, it's the one emptying it, so what it puts
+    # itself goes in local instead, eg. our own messages
+    MAXSIZE = 10000
+    # Max events applied per frame, so the window still gets to redraw and
+    # handle the user when a flood comes in
+    BATCH = 2000
+
+    def __init__(self,window=None):
+        self.window = window
+        self.queue = queue.Queue(self.MAXSIZE)
+        self.local = collections.deque()
+
+    # The window is built while we connect, events just wait until then
+    def attach(self,window):
+        self.window = window
+        if not self.queue.empty() or self.local:
+            window.write_event_value("IRC",None)
+
+    def put(self,event):
+        if threading.current_thread() is threading.main_thread():
+            self.local.append(event)
+            if self.window is not None:
+                self.window.write_event_value("IRC",None)
+            return
+        self.queue.put(event)
+        # Only the first event of a frame needs to wake the main loop
+        if self.queue.qsize() == 1 and self.window is not None:
+            self.window.write_event_value("IRC",None)
+
+    def append(self,tab,segments):
+        self.put(("append",tab,segments))
+
+    def names(self,channel):
+        self.put(("names",channel))
+
+    def topic(self,channel,topic):
+        self.put(("topic",channel,topic))
+
+    def open(self,tab):
+        self.put(("open",tab))
+
+    def wake(self):
+        self.put(("wake",))
+
+    def drain(self,win,irc):
         '''
-        Initialise the socket and pass the GUI window to object
+        Apply waiting events, all lines for a tab are merged into a single
+        widget update and a names list is only refreshed once per frame
         '''
-        IrcCon.__init__(self)
+        metrics = irc.metrics
+        if metrics is not None:
+            start = time.perf_counter()
+        lines = dict()
+        names = set()
+        for i in range(self.BATCH):
+            if self.local:
+                event = self.local.popleft()
+            else:
+                try:
+                    event = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            kind = event[0]
+            if kind == "append":
+                lines.setdefault(event[1],[]).append(event[2])
+                continue
+            # Anything else could depend on the lines before it
+            self.flush(win,lines)
+            lines = dict()
+            if kind == "names":
+                names.add(event[1])
+            elif kind == "topic":
+                ensureTab(win,event[1])
+                win[f"{event[1]}T"].update(event[2])
+            elif kind == "open":
+                if not tabs.is_open(event[1]):
+                    create_tab(win,event[1])
+        self.flush(win,lines)
+        for channel in names:
+            ensureTab(win,channel)
+            win[f"{channel}L"].update(values=irc.roster.view(channel))
+        if metrics is not None:
+            metrics.observe("gui_drain",time.perf_counter() - start)
+        # Still more to do, come back after the window had a turn
+        if not self.queue.empty() or self.local:
+            win.write_event_value("IRC",None)
+
+    def flush(self,win,lines):
+        if lines:
+            startup.mark("first line shown")
+        for tab,messages in lines.items():
+            ensureTab(win,tab)
+            showMessages(win,tab,messages)
+            tabs.mark_unread(tab,len(messages))
+
+class Client(ChatCore):
+    '''
+    The ChatCore with the GUI as its sink. The handlers run on the receive
+    thread so they only keep our state and queue the GUI updates, see UiQueue
+    '''
+    def __init__(self,window=None,filters=None,store=None):
+        '''
+        Initialise the socket and pass the GUI window to object, the window
+        can be attached later
+        '''
+        ChatCore.__init__(self,UiQueue(window),filters,store)
+        self.window = window
+        # Set when the connection went away by itself, the main loop then
+        # reconnects
+        self.lost = False
+
+    def attach(self,window):
         self.window = window
-    
-    def on_error(self,errorType):
-        if errorType == "ConnectionRefusedError":
-            pass
-
-        if errorType == "NickInUse":
-            self.failedLogin = True
-            pass
-    
-    def on_message(self,who,channel,msg):
-        #msg = f"{current_time} | {who} > {msg}"
-        check = msg.lower()
-        check = set(check.split())
-        # Filter out messages
-        for item in fList:
-            if item in check:
-                return
-        if channel == self.NICK:
-            channel = who
-        if channel not in self.channels:
-            create_tab(self.window,channel)
-            openTabs.append(channel)
-            self.channels.add(channel)
-        ms = f"{current_time} | "
-        self.window[f"{channel}B"].update(ms,append=True)
-        ms = f"{who} "
-        color = chash(f"{who}").hex
-        self.window[f"{channel}B"].update(ms,text_color_for_value=color,append=True)
-        msg = f"> {msg}"
-        self.window[f"{channel}B"].update(msg + "\n",append=True)
-        markUnread(channel)
-
-    def on_user_join(self,who,channel,hostname):
-        msg = f"{current_time} | ---> {who} ({hostname}) has joined {channel}\n"
-        self.window[f"{channel}B"].update(msg,text_color_for_value="green",append=True)
-        markUnread(channel)
-        # Add user to the names list
-        namesList = names[channel]
-        namesList.append(who)
-        namesList.sort()
-        names[channel] = namesList
-        self.window[f"{channel}L"].update(values=names[channel])
-    
-    def on_user_part(self,who,channel,hostname):
-        msg = f"{current_time} | <--- {who} ({hostname}) has parted {channel}\n"
-        self.window[f"{channel}B"].update(msg,text_color_for_value="orange",append=True)        
-        markUnread(channel)
-        # Remove the user from the names list
-        namesList = names[channel]
-        if who in namesList:
-            namesList.remove(who)
-        elif f"@{who}" in namesList:
-            namesList.remove(f"@{who}")
-        elif f"~{who}" in namesList:
-            namesList.remove(f"~{who}")
-        elif f"+{who}" in namesList:
-            namesList.remove(f"+{who}")
-        names[channel] = namesList
-        self.window[f"{channel}L"].update(values=names[channel])
-    
-    def on_user_nick_change(self,who,newNick):
-        msg = f"{current_time} | {who} is now known as {newNick}\n"
-        for chan in names:
-            if who in names[chan]:
-                self.window[f"{chan}B"].update(msg,text_color_for_value="blue",append=True)
-                # Update the users name in the name list
-                namesList = names[chan]
-                # handle nick changes when +,~ @ in front of name, we need to preserve
-                # the leading inidicator
-                if who in namesList:
-                    namesList.remove(who)
-                elif f"@{who}" in namesList:
-                    namesList.remove(f"@{who}")
-                    newNick = "@" + newNick
-                elif f"~{who}" in namesList:
-                    namesList.remove(f"~{who}")
-                    newNick = "~" + newNick
-                elif f"+{who}" in namesList:
-                    namesList.remove(f"+{who}")
-                    newNick = "+" + newNick
-                namesList.append(newNick)
-                namesList.sort()
-                names[chan] = namesList
-                markUnread(chan)
-                self.window[f"{chan}L"].update(values=names[chan])
-    
-    def on_user_quit(self,who,hostname,msg):
-        msg = f"{current_time} | {who} ({hostname}) quit: {msg}\n"
-        for chan in names:
-            inChan = False
-            # Update the users name in the name list
-            namesList = names[chan]
-            # A name may have a leading +,~ @ so we need to appropriately remove
-            # user from the names list
-            if who in namesList:
-                namesList.remove(who)
-                inChan = True
-            elif f"@{who}" in namesList:
-                namesList.remove(f"@{who}")
-                inChan = True
-            elif f"~{who}" in namesList:
-                namesList.remove(f"~{who}")
-                inChan = True
-            elif f"+{who}" in namesList:
-                namesList.remove(f"+{who}")
-                inChan = True
-            if inChan:
-                self.window[f"{chan}B"].update(msg,text_color_for_value="red",append=True)
-                names[chan] = namesList
-                markUnread(chan)
-                self.window[f"{chan}L"].update(values=names[chan])
-
-    def on_topic(self,chan,topic):
-        self.window[f"{chan}T"].update(topic)
-
-    def on_whois(self,line):
-        line = line[3:]
-        line = ' '.join(line)
-        msg = f"{current_time} | {line}\n"
-        self.window["infoB"].update(msg,append=True)
-        markUnread("info")
-
-    def unknown_message(self,line):
-        # This used to "print" to infoB box which had all console output rerouted to it
-        # that would apparently lead to a race condition when printing too fast? 
-        # and lead to a seg fault error, fixed now so hooray I guess!
-        # It is important to note that pysimplegui was overriding the builtin print
-        # so I'm talking about that "print" function. It wasn't transparent that it was
-        # overriding the default one and the bug may lie therein or it's some sort of 
-        # limitation. TODO Make a PR or github issue one day to fix this
-        line = f"{current_time} | " + line + "\n"
-        self.window["infoB"].update(line,append=True)
-        markUnread("info")
-    
-    def on_nickserv(self,msg):
-        msg = f"{current_time} | " + "NickServ " + msg + "\n"
-        self.window["infoB"].update(msg,text_color_for_value="dark red",font_for_value="Helvetica 10 bold",append=True)
-        markUnread("info")
-        
-    def on_names(self,channel,namesChan):
-        namesChan[0] = namesChan[0].lstrip(":")
-        if channel not in names:
-            names[channel] = []
-        names[channel] = names[channel] + namesChan
-
-    def end_names(self,channel):
-        nameslist = names[channel]
-        nameslist.sort()
-        names[channel] = nameslist
-        time.sleep(1)
-        self.window[f"{channel}L"].update(values=names[channel])
-    
-    def on_list(self,channel,members):
-        msg = f"{current_time} | Chan: {channel} Members: {members}\n"
-        self.window["infoB"].update(msg,append=True,text_color_for_value="dark green",font_for_value=("Helvetica",10,"bold"))
-    def on_notice(self,chan,msg):
-        if chan not in openTabs:
-            create_tab(self.window,chan)
-            self.channels.add(chan)
-            openTabs.append(chan)
-        msg = f"{current_time} | " + "Notice " + msg + "\n"
-        font = ("Helvetica",10,"bold")
-        if msg == "Server is shutting down":
-            self.disconnect()
-        self.window[f"{chan}B"].update(msg,text_color_for_value="dark red",font_for_value=font,append=True)
-        markUnread(chan)
+        self.sink.attach(window)
+
+    def handle_welcome(self,msg):
+        startup.mark("registered")
+        ChatCore.handle_welcome(self,msg)
+
+    def on_connection_broken(self):
+        self.lost = True
+        ChatCore.on_connection_broken(self)
+
+# Connect and log in, run on a thread at startup so the TLS handshake and
+# registration happen while the window is built
+def connectAndLogin(irc,server,port,ssl,nick,user,rname):
+    if irc.connect(server,port,ssl):
+        startup.mark("connected")
+        irc.login(nick,user,rname)
+
+# Tk text tags configured so far as (widget name, tag)
+madeTags = set()
+
+# Show messages in a tab, each is a list of (text,color,font) segments. They are
+# kept in the tab's scrollback and the chat box is trimmed to the same size
+def showMessages(win,tab,messages):
+    history = tabs.history(tab)
+    segments = []
+    for message in messages:
+        history.append(message)
+        segments.extend(message)
+        logger.write(irc.HOST,tab,"".join(text for (text,color,font) in message))
+    dropped = appendSegments(win,tab,segments,history.keep())
+    # Where the tab is in its logs, see backlog.py
+    reader = backlogs.get(tab)
+    if reader is not None:
+        reader.shown(len(messages))
+        reader.trimmed(dropped)
+
+# Append a batch of (text,color,font) segments to a tab's chat box with a single
+# Tk call rather than one Multiline.update per segment. If keep is given the
+# oldest lines over it are deleted, returns how many
+def appendSegments(win,tab,segments,keep=None):
+    element = win[f"{tab}B"]
+    widget = element.Widget
+    args = []
+    for (text,color,font) in segments:
+        args.append(text)
+        args.append(textTag(widget,color,font))
+    widget.configure(state="normal")
+    widget.insert("end",*args)
+    dropped = 0
+    if keep is not None:
+        dropped = trimWidget(widget,keep)
+    widget.configure(state="disabled")
+    if element.Autoscroll:
+        widget.see("end")
+    return dropped
+
+# Tk text tags for the colours and fonts, configured once per widget
+def textTag(widget,color,font):
+    if not color and not font:
+        return ()
+    tag = f"{color}|{font}"
+    if (str(widget),tag) not in madeTags:
+        madeTags.add((str(widget),tag))
+        options = dict()
+        if color:
+            options["foreground"] = color
+        if font:
+            options["font"] = font
+        widget.tag_configure(tag,**options)
+    return (tag,)
 
 # Returns the main window layout
 def mainLayout():
     # Box to display server info and other information non-specific to channels
     info = [[sg.Multiline(size=(93,19),font=('Helvetica 10'),key="infoB",reroute_stdout=False,autoscroll=True,disabled=True)]]
-    menu = ['SlickIRC', ['&Exit']],['&Server',['Server settings']],["&Filters",['Filter settings']],['&Help', ['&Commands', '---', '&About'],]
+    menu = ['SlickIRC', ['&Exit']],['&Server',['Server settings','Flood control']],["&Filters",['Filter settings']],['&Help', ['&Commands', '---', '&About'],]
     layout = [[sg.Menu(menu)],
-        [sg.TabGroup([[sg.Tab("info",info)]],key="chats",selected_background_color="grey")],
+        [sg.TabGroup([[sg.Tab("info",info)]],key="chats",selected_background_color="grey",enable_events=True)],
         [sg.Multiline(size=(59, 2), enter_submits=True, key='msgbox', do_not_clear=True),
         sg.Button('SEND', bind_return_key=True,visible=True),
+        sg.Text("Lag -",key="lag",size=(10,1)),
         sg.Button('EXIT',visible=False)
         ]]
     return layout
 
 # Creates a new tab, we keep a record of tabs created, so if a this tab exists 
-# in hist then we just unhide it 
+# in the registry then we just unhide it 
 def create_tab(win,channel):
-    if channel in tabHist:
+    if channel in tabs:
         win[f"{channel}"].update(visible=True)
+        tabs.add(channel)
     else:
         leftCol = [[sg.Multiline("No channel topic",size=(75, 3), font=('Helvetica 10'),key=f"{channel}T",autoscroll=False,disabled=True)],
         [sg.Multiline(size=(75, 15), font=('Helvetica 10'),key=f"{channel}B",autoscroll=True,disabled=True)]]
@@ -237,94 +261,134 @@ def create_tab(win,channel):
         element = [[sg.Column(leftCol),sg.Column(rightCol)]]
         tab = sg.Tab(f"{channel}",element,key=channel)
         win["chats"].add_tab(tab)
+        tabs.add(channel)
+        # Scrolling up at the top of the chat box loads older backlog
+        win[f"{channel}B"].bind("<Button-4>","+BACKLOG")
         load_tab(channel)
-        tabHist.append(channel)
+
+# Make sure a tab exists before showing anything in it, eg. for a channel the
+# server forwarded us to. We never asked to join it so nothing opened its tab
+def ensureTab(win,tab):
+    if tab not in tabs:
+        create_tab(win,tab)
 
 # Deletes a tab, we don't truly delete it but just hide it. I can delete a tab
 # but unable to delete the contents related to it and we have issues if we need to
 # recreate this tab. Hiding it isn't too bad of a tradeoff and history is preserved
 def delete_tab(win,channel):
     win[f"{channel}"].update(visible=False)
+    tabs.close(channel)
 
-def save_tab(tab):
-    if not os.path.exists("chatlog"):
-        os.mkdir("chatlog")
-    if not os.path.exists(f"chatlog/{irc.HOST}"):
-        os.mkdir(f"chatlog/{irc.HOST}")
-    f = open(f"chatlog/{irc.HOST}/{tab}.txt","w+")
-    tabLog = mainWin[f"{tab}B"].get()
-    tabLog = tabLog.splitlines(True)
-    try:
-        index = len(tabLog)-tabLog[::-1].index("======= End of backlog =======\n")-1
-    except ValueError:
-        index = 0
-    today = datetime.date.today()
-    date = today.strftime("%B %d, %Y")
-    tabLog.insert(index,f"======= {date} =======\n")
-    tabLog = ' '.join(tabLog)
-    f.write(tabLog)
-    f.close()
+# The logs of a tab, oldest first. chatlog/<host>/<tab>.txt is where older
+# versions saved it
+def tabLogs(tab):
+    paths = logFiles("chatlog",irc.HOST,tab)
+    if os.path.exists(f"chatlog/{irc.HOST}/{tab}.txt"):
+        paths.insert(0,f"chatlog/{irc.HOST}/{tab}.txt")
+    return paths
 
+# Show the end of what the logger wrote for this tab before, the rest is read
+# a page at a time when the user scrolls up, see load_older
 def load_tab(tab):
-    if os.path.exists(f"chatlog/{irc.HOST}/{tab}.txt"):
-        f = open(f"chatlog/{irc.HOST}/{tab}.txt","r")
-        hist = f.read()
-        hist = hist + "\n" + "======= End of backlog =======\n"
+    backlogs[tab] = BacklogReader(lambda: tabLogs(tab))
+    # The reader counts from the end of the logs, they must have everything
+    # shown so far
+    logger.flush(1)
+    hist = backlogs[tab].older(PAGE)
+    if hist:
+        hist = hist + "======= End of backlog =======\n"
         mainWin[f"{tab}B"].update(hist,append=True)
-        f.close()
-
-# Add an asterisk infront of a tabs name to indicate there is an unread message
-def markUnread(tab):
-    tabgroup = mainWin["chats"].Widget
-    # Get the index of the tab, we add to openTabs elsewhere so we can get index
-    # over here
-    for i in range(len(openTabs)):
-        if openTabs[i] == tab:
-            break
-    # Get the tab object
-    tab = mainWin[f"{tab}"]
-    title = tab.Title
-    # Only if it isn't already unread append an asterisk
-    if not title.startswith("*"):
-        title = "*" + title
-    tabgroup.tab(i,text=title)
-
-# Mark a tab as read by removing the asterisk at the start of its name
-def markRead(tab):
-    temp = tab.lstrip("*")
-    tabgroup = mainWin["chats"].Widget
-    for i in range(len(openTabs)):
-        if openTabs[i] == temp:
-            break
-    title = openTabs[i]
-    tabgroup.tab(i,text=title)
+
+# Put the next page of older backlog at the top of a tab
+def load_older(win,tab,count=PAGE):
+    reader = backlogs.get(tab)
+    if reader is None or reader.exhausted():
+        return
+    logger.flush(1)
+    hist = reader.older(count)
+    if not hist:
+        return
+    lines = hist.count("\n")
+    widget = win[f"{tab}B"].Widget
+    widget.configure(state="normal")
+    widget.insert("1.0",hist)
+    widget.configure(state="disabled")
+    # Keep the line the user was looking at in place
+    widget.yview(f"{lines + 1}.0")
+    tabs.history(tab).add_backlog(lines)
+
+# Turn on the metrics, with the depths of the GUI, log and history queues
+def enableMetrics(irc):
+    metrics = irc.enable_metrics()
+    metrics.gauge("gui",irc.sink.queue.qsize)
+    metrics.gauge("chatlog",logger.queue.qsize)
+    metrics.gauge("history",msgStore.queue.qsize)
+    return metrics
+
+# /stats shows the metrics in the info tab, /stats on|off turns them on or off
+# and /stats export FILE [seconds] writes them to FILE, every so many seconds
+# if given. See metrics.py
+def stats(win,irc,words):
+    global exporter
+    if words == ["on"]:
+        if irc.metrics is None:
+            enableMetrics(irc)
+        lines = ["Metrics on"]
+    elif words == ["off"]:
+        irc.disable_metrics()
+        if exporter:
+            exporter.stop()
+            exporter = None
+        lines = ["Metrics off"]
+    elif len(words) in (2,3) and words[0] == "export":
+        metrics = irc.metrics or enableMetrics(irc)
+        if len(words) == 2:
+            export(words[1],[metrics])
+            lines = [f"Metrics written to {words[1]}"]
+        else:
+            try:
+                interval = float(words[2])
+            except ValueError:
+                raise InvalidCommand
+            if exporter:
+                exporter.stop()
+            exporter = Exporter(words[1],[metrics],interval)
+            exporter.start()
+            lines = [f"Writing metrics to {words[1]} every {interval:g} s"]
+    elif not words:
+        if irc.metrics is None:
+            lines = ["Metrics are off, turn them on with /stats on"]
+        else:
+            lines = irc.metrics.report()
+    else:
+        raise InvalidCommand
+    showMessages(win,"info",[[(f"{timestamp()} | {line}\n",None,None)] for line in lines])
 
 # Process IRC commands such as /join etc.
 def processCommand(win,irc,query):
     global nick
     global loggedIn
+    global connecting
     query = query.lstrip("/")
     try:
         if query == "":
             raise InvalidCommand
         query = query.split()
-        currentTab = vals1["chats"]
+        currentTab = tabs.lookup(vals1["chats"])
         command = query[0].lower()
         if command == "join":
             channels = query[1:]
             for chan in channels:
                 if chan not in irc.channels:
-                    openTabs.append(chan)
                     irc.join(chan)
                     create_tab(win,chan)
         elif command == "part":
             channels = query[1:]
             for chan in channels:
                 if chan in irc.channels:
-                    openTabs.remove(chan)
                     delete_tab(win,chan)
                     irc.part(chan)
-                    names[chan] = []
+                    irc.roster.clear(chan)
                 else:
                     win[f"{currentTab}B"].update("Need to be in channel",append=True)
         elif command == "whois":
@@ -334,7 +398,7 @@ def processCommand(win,irc,query):
             channels = query[1:]
             for chan in channels:
                 if chan in irc.channels:
-                    markUnread(chan)
+                    tabs.mark_unread(chan)
         elif command == "nick":
             if len(query) == 2:
                 nick = query[1]
@@ -343,12 +407,17 @@ def processCommand(win,irc,query):
             msg = None
             if len(query) >= 2:
                 msg = ' '.join(query[1:])
+            filters.save()
             irc.quitC(msg)
+            # Give the writer a moment to get the QUIT out
+            irc.flush()
+            logger.close()
+            msgStore.close()
             quit()
         elif command == "reconnect":
-            irc.reconnect()
-            for tab in openTabs[1:]:
-                irc.join(tab)
+            connecting = startReconnect(irc)
+        elif command == "lag":
+            showMessages(win,"info",[[(f"{timestamp()} | {line}\n",None,None)] for line in irc.lag.report()])
         elif command == "query" or command == "msg":
             nick = query[1]
             if nick == "NickServ":
@@ -358,26 +427,40 @@ def processCommand(win,irc,query):
                 else:
                     raise InvalidCommand
             else:
-                openTabs.append(nick)
                 irc.join(nick)
                 create_tab(win,nick)
                 if len(query) > 2:
                     msg = ' '.join(query[2:])
                     sendMsg(win,irc,nick,msg)
         elif command == "save":
-            channels = query[1:]
-            if len(channels) >= 1:
-                for tab in channels:
-                    if tab in tabHist:
-                        save_tab(tab)
-            else:
-                for tab in tabHist:
-                    save_tab(tab)
+            # Everything is logged as it comes in, just make sure it's on disk
+            logger.flush()
             msg = "Sucessfully saved chat(s) in folder chatlog\n"
             font = ("Helvetica",10,"bold")
             mainWin[f"{currentTab}B"].update(msg,text_color_for_value="dark red",font_for_value=font,append=True) 
         elif command == "list":
             irc.listChan()
+        elif command == "capture":
+            # /capture file.cap.gz records the raw traffic, /capture stop
+            if len(query) != 2:
+                raise InvalidCommand
+            if query[1] == "stop":
+                irc.stop_capture()
+                msg = "Capture stopped\n"
+            else:
+                irc.start_capture(query[1])
+                msg = f"Capturing traffic to {query[1]}\n"
+            win["infoB"].update(msg,append=True)
+        elif command == "search":
+            search(win,query[1:])
+        elif command == "stats":
+            stats(win,irc,query[1:])
+        elif command == "backlog":
+            try:
+                count = int(query[1]) if len(query) > 1 else PAGE
+            except ValueError:
+                raise InvalidCommand
+            load_older(win,currentTab,count)
         else:
             raise InvalidCommand       
     except InvalidCommand:
@@ -385,85 +468,220 @@ def processCommand(win,irc,query):
     finally:
         win["msgbox"].update("")
 
-# Send a message to a channel or private message
-# We break the string down to color the users own nick for better readability
+# Reconnect and join the channels again, run on a thread as connecting can
+# take a while. If it fails the main loop tries again after the backoff
+def reconnect(irc,channels):
+    irc.reconnect()
+    if not irc.connected:
+        irc.lost = True
+        return
+    for chan in channels:
+        irc.join(chan)
+
+# Start reconnecting with the open tabs, returns the thread
+def startReconnect(irc):
+    channels = [tab for tab in tabs.open_tabs() if tab != "info"]
+    thread = threading.Thread(target=reconnect,args=(irc,channels),daemon=True)
+    thread.start()
+    return thread
+
+# Text for the lag label, it keeps growing while a PONG is overdue
+def lagText(irc):
+    lag = irc.lag.current() if irc.connected else None
+    if lag is None:
+        return "Lag -"
+    if lag < 1:
+        return f"Lag {lag * 1000:.0f} ms"
+    return f"Lag {lag:.1f} s"
+
+# Search the history, /search [#chan] [nick:who] terms. The results are shown
+# in the info tab, best match first
+def search(win,words):
+    (channel,nick,terms) = parse_search(words)
+    if not terms:
+        raise InvalidCommand
+    start = time.perf_counter()
+    results = msgStore.search(terms,channel,nick)
+    took = (time.perf_counter() - start) * 1000
+    messages = [[(f"{timestamp()} | Search for {terms}: {len(results)} results in {took:.1f} ms\n","dark green",BOLD)]]
+    for (when,chan,who,kind,text,host) in results:
+        when = time.strftime("%Y-%m-%d %H:%M:%S",time.localtime(when))
+        if kind == "PRIVMSG":
+            line = f"{who} > {text}"
+        elif kind == "NOTICE":
+            line = f"Notice {text}"
+        elif kind == "QUIT":
+            line = f"{who} ({host}) quit: {text}"
+        elif kind == "JOIN":
+            line = f"{who} ({host}) has joined"
+        else:
+            line = f"{who} ({host}) has parted"
+        messages.append([(f"{when} {chan} | ",None,None),(f"{line}\n",None,None)])
+    showMessages(win,"info",messages)
+
+# Send a message to a channel or private message, ChatCore.say also shows it
 def sendMsg(win,irc,chan,msg):
     # We don't send messages in the info channel
     if chan != "info":
-        irc.privmsg(f"{chan}",msg)
-        ms = f"{current_time} | "
-        win[f"{chan}B"].update(ms,append=True)
-        ms = f"{irc.NICK} "
-        win[f"{chan}B"].update(ms,text_color_for_value="purple",append=True)
-        msg = "> " + msg + "\n"
-        win[f"{chan}B"].update(msg,append=True)
+        irc.say(chan,msg)
     # Clear message box
     win["msgbox"].update("")
 
-t = time.localtime()
-# Initial login window
-(server,port,nick,user,rname,ssl) = loginWin("irc.tilde.chat","6697")
-# Initialize main window thereafter
-mainWin = sg.Window("Slick IRC",mainLayout(),font=("Helvetica","13"),default_button_element_size=(8,2),finalize=True)
-# Initialize irc client and connect
-irc = Client(mainWin)
-irc.connect(server,port,ssl)
-loggedIn = False
-failedLogin = False
-fList = []
-
-# All the tabs seen so far
-tabHist = ["info"]
-openTabs = ["info"]
-names = dict()
-while True:
-    # Event and values
-    ev1, vals1 = mainWin.read(timeout=1)
-    t = time.localtime()
-    current_time = time.strftime("%H:%M:%S", t)
-    # We haven't sucessfully logged in yet
-    if not loggedIn:
-        irc.login(nick,user,rname)
-        loggedIn = True
-    # We failed login, darn it, try again and display error
-    if irc.failedLogin:
-        errorWin("Nickname in use, try a different one!")
-        (server,port,nick,user,rname,ssl) = loginWin(server,port,nick,user,rname)
-        loggedIn = False
-    if not irc.connected:
-        errorWin("Cannot connect to server")
-        (server,port,nick,user,rname,ssl) = loginWin(server,port,nick,user,rname)
-        irc.connect(server,port,ssl)
-        irc.login(nick,user,rname)
-    if ev1 == "SEND":
-        query = vals1["msgbox"].rstrip()
-        # Ignore bogus empty messages
-        if query != "":
-            # An IRC command
-            if query.startswith("/"):
-                processCommand(mainWin,irc,query)
-            else:
-                sendMsg(mainWin,irc,vals1["chats"],query)
-    # Mark a channel as read:
-    if vals1["chats"].startswith("*"):
-        markRead(vals1["chats"])
-    if ev1 == "Server settings":
-        (oldServ,oldPort) = (server,port)
-        (server,port,nick,user,rname,ssl) = loginWin(server,port,nick,user,rname)
-        if oldServ != server or oldPort != port:
-            irc.disconnect()
+# The GUI, see slickirc.py for running without one
+if __name__ == "__main__":
+    if platform == "darwin" or platform == "win32":
+        print("\033[93mUnsupported Operating System, this program only works on Linux\033[0m")
+        raise OSError
+
+    sg.theme("SystemDefault")
+    # Initial login window, unless we have logged in before
+    profile = load_profile()
+    if profile is None:
+        profile = loginWin("irc.tilde.chat","6697")
+        save_profile(profile)
+    (server,port,nick,user,rname,ssl) = profile
+    startup.mark("profile")
+    # Initialize irc client, the session manager receives for all our
+    # connections on one thread
+    sessions = SessionManager()
+    sessions.start()
+    # Filter rules, compiled once whenever they change
+    filters = FilterEngine("filters.json")
+    # Writes everything shown in the tabs to chatlog/ in the background
+    logger = ChatLogger("chatlog")
+    logger.start()
+    # Searchable history, see /search
+    msgStore = MessageStore("history.db")
+    msgStore.start()
+    irc = sessions.add(server,Client(None,filters,msgStore))
+    # Lines at once and per second the server takes from us
+    irc.sendq.configure(*load_flood())
+    # SASL login, certificate checks and client certificate, see settings.py
+    auth = load_auth()
+    irc.verify = auth.get("verify",True)
+    irc.certfile = auth.get("certfile")
+    irc.keyfile = auth.get("keyfile")
+    if auth.get("sasl"):
+        try:
+            irc.set_sasl(auth["sasl"],auth.get("account"),auth.get("password"),auth.get("nickserv_fallback",True))
+        except ValueError as e:
+            errorWin(f"{e}, check profile.json")
+    # SLICKIRC_METRICS=1 turns the metrics on from the start, a file name
+    # also exports them there, see /stats
+    exporter = None
+    if os.environ.get("SLICKIRC_METRICS"):
+        metrics = enableMetrics(irc)
+        if os.environ["SLICKIRC_METRICS"] != "1":
+            exporter = Exporter(os.environ["SLICKIRC_METRICS"],[metrics])
+            exporter.start()
+    # Connect and log in while the window is built, whatever the server sends
+    # meanwhile waits in the UiQueue
+    connecting = threading.Thread(target=connectAndLogin,args=(irc,server,port,ssl,nick,user,rname),daemon=True)
+    connecting.start()
+    loggedIn = True
+    failedLogin = False
+    # Initialize main window
+    mainWin = sg.Window("Slick IRC",mainLayout(),font=("Helvetica","13"),default_button_element_size=(8,2),finalize=True)
+
+    # All the tabs seen so far
+    tabs = TabRegistry(mainWin["chats"].Widget)
+    tabs.add("info")
+    # Tab -> BacklogReader of its chat logs
+    backlogs = dict()
+    shownLag = "Lag -"
+    # When to reconnect after the connection was lost
+    retryAt = None
+    irc.attach(mainWin)
+    startup.mark("window")
+    while True:
+        # Event and values, the receive thread wakes us with an IRC event when it
+        # has something to show. The timeout is only there so we notice a dropped
+        # connection
+        ev1, vals1 = mainWin.read(timeout=1000)
+        if ev1 == "IRC":
+            irc.sink.drain(mainWin,irc)
+        # Scrolled up in a chat box, load more backlog once at the top
+        if isinstance(ev1,str) and ev1.endswith("B+BACKLOG"):
+            tab = ev1[:-len("B+BACKLOG")]
+            if mainWin[f"{tab}B"].Widget.yview()[0] == 0:
+                load_older(mainWin,tab)
+        # We haven't sucessfully logged in yet
+        if not loggedIn:
+            irc.login(nick,user,rname)
+            loggedIn = True
+        # We failed login, darn it, try again and display error
+        if irc.failedLogin:
+            errorWin("Nickname in use, try a different one!")
+            (server,port,nick,user,rname,ssl) = loginWin(server,port,nick,user,rname)
+            save_profile((server,port,nick,user,rname,ssl))
+            loggedIn = False
+        # The connection died by itself, try to get it back before bothering
+        # the user. Waiting longer every time, see lag.Backoff
+        if irc.lost:
+            irc.lost = False
+            delay = irc.backoff.next()
+            retryAt = time.monotonic() + delay
+            showMessages(mainWin,"info",[[(f"{timestamp()} | Reconnecting in {delay:.0f} s\n","dark red",BOLD)]])
+        if retryAt is not None and time.monotonic() >= retryAt:
+            retryAt = None
+            if not irc.connected and not connecting.is_alive():
+                connecting = startReconnect(irc)
+        # Still connecting in the background isn't an error, nor is waiting
+        # to reconnect
+        if not irc.connected and not connecting.is_alive() and retryAt is None and not irc.lost:
+            errorWin("Cannot connect to server")
+            (server,port,nick,user,rname,ssl) = loginWin(server,port,nick,user,rname)
+            save_profile((server,port,nick,user,rname,ssl))
             irc.connect(server,port,ssl)
-        irc.login(nick,user,rname)
-    if ev1 == "Commands":
-        commandsWin() 
-    if ev1 == "Filter settings":
-        fList = filterWin(fList)
-    if ev1 == "About":
-        aboutWin()
-    # User wants to exit :(
-    if ev1 == sg.WIN_CLOSED or ev1 == "EXIT" or ev1 == "Exit":
-        irc.quitC()
-        break
-    
-
-mainWin.close()
\ No newline at end of file
+            irc.login(nick,user,rname)
+        if ev1 == "SEND":
+            query = vals1["msgbox"].rstrip()
+            # Ignore bogus empty messages
+            if query != "":
+                # An IRC command
+                if query.startswith("/"):
+                    processCommand(mainWin,irc,query)
+                else:
+                    sendMsg(mainWin,irc,tabs.lookup(vals1["chats"]),query)
+        # At least once a second thanks to the read timeout
+        text = lagText(irc)
+        if text != shownLag:
+            mainWin["lag"].update(text)
+            shownLag = text
+        # Mark a channel as read, the registry only touches Tk if it was unread
+        tabs.mark_read(tabs.lookup(vals1["chats"]))
+        if ev1 == "Server settings":
+            (oldServ,oldPort) = (server,port)
+            (server,port,nick,user,rname,ssl) = loginWin(server,port,nick,user,rname)
+            save_profile((server,port,nick,user,rname,ssl))
+            if oldServ != server or oldPort != port:
+                irc.disconnect()
+                irc.connect(server,port,ssl)
+            irc.login(nick,user,rname)
+        # The dialogs are only imported the first time they're opened
+        if ev1 == "Flood control":
+            from dialogs import floodWin
+            (burst,rate) = floodWin(*load_flood())
+            irc.sendq.configure(burst,rate)
+            save_flood(burst,rate)
+        if ev1 == "Commands":
+            from dialogs import commandsWin
+            commandsWin() 
+        if ev1 == "Filter settings":
+            from dialogs import filterWin
+            filters.set_rules(filterWin(filters.rules()))
+        if ev1 == "About":
+            from dialogs import aboutWin
+            aboutWin()
+        # User wants to exit :(
+        if ev1 == sg.WIN_CLOSED or ev1 == "EXIT" or ev1 == "Exit":
+            # Keep the match counts
+            filters.save()
+            irc.quitC()
+            irc.flush()
+            logger.close()
+            msgStore.close()
+            break
+
+
+    mainWin.close()
@@ -14,11 +14,20 @@ Quick start:
 (45, 210, 75)
 >>> c.hex
 '#2dd24b'
+>>> ColorHash.cached_hex('Hello World')
+'#2dd24b'
 """
 
 from binascii import crc32
+from functools import lru_cache
 from numbers import Number
 
+DEFAULT_LIGHTNESS = (0.35, 0.5, 0.65)
+DEFAULT_SATURATION = (0.35, 0.5, 0.65)
+
+# How many distinct names cached_hex remembers
+CACHE_SIZE = 4096
+
 
 def crc32_hash(obj):
     """Generate a hash for ``obj``.
@@ -81,8 +90,8 @@ def rgb2hex(rgb):
 def color_hash(
     obj,
     hashfunc=crc32_hash,
-    lightness=(0.35, 0.5, 0.65),
-    saturation=(0.35, 0.5, 0.65),
+    lightness=DEFAULT_LIGHTNESS,
+    saturation=DEFAULT_SATURATION,
     min_h=None,
     max_h=None,
 ):
@@ -124,6 +133,49 @@ def color_hash(
     return (h, s, l)
 
 
+# Hex color for every (h, s, l) the default settings of color_hash can give,
+# indexed by (h * len(saturation) + s) * len(lightness) + l. Built on first use.
+_hex_table = None
+
+
+def _build_hex_table():
+    global _hex_table
+    table = []
+    for h in range(359):
+        for s in DEFAULT_SATURATION:
+            for l in DEFAULT_LIGHTNESS:
+                table.append(rgb2hex(hsl2rgb((h, s, l))))
+    _hex_table = table
+    return table
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _cached_hex(name):
+    table = _hex_table or _build_hex_table()
+    # Same steps as color_hash with the default arguments
+    hash = crc32_hash(name)
+    h = hash % 359
+    hash //= 360
+    s = hash % len(DEFAULT_SATURATION)
+    hash //= len(DEFAULT_SATURATION)
+    l = hash % len(DEFAULT_LIGHTNESS)
+    return table[(h * len(DEFAULT_SATURATION) + s) * len(DEFAULT_LIGHTNESS) + l]
+
+
+def cached_hex(obj):
+    """Return ``ColorHash(obj).hex`` using a lookup table and an LRU cache.
+    Only covers the default arguments of ``color_hash``.
+    >>> cached_hex('Hello World')
+    '#2dd24b'
+    """
+    return _cached_hex(str(obj))
+
+
+def hex_many(objs):
+    """Return a dict mapping each of ``objs`` to its ``cached_hex`` color."""
+    return {obj: _cached_hex(str(obj)) for obj in objs}
+
+
 class ColorHash:
     """Generate a color value and provide it in several format.
     This class takes the same arguments as the ``color_hash`` function.
@@ -142,4 +194,8 @@ class ColorHash:
 
     @property
     def hex(self):
-        return rgb2hex(self.rgb)
\ No newline at end of file
+        return rgb2hex(self.rgb)
+
+    # Fast paths for the default arguments, for coloring nicks on every message
+    cached_hex = staticmethod(cached_hex)
+    hex_many = staticmethod(hex_many)
\ No newline at end of file
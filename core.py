@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the ChatCore which handles the IRC events for a frontend.
+It keeps the client state (roster, history, filters) and turns each event into
+lines for a Sink, which is what a frontend implements to show them. The GUI
+sink is the UiQueue in client.py, the headless one writes them to the chat
+logs. Nothing in here needs a display.
+'''
+import time
+from irclib import IrcCon
+from caps import server_time
+from roster import Roster
+from colorhash import ColorHash as chash
+
+# Font for notices and other highlighted lines
+BOLD = ("Helvetica",10,"bold")
+# Max nicks listed in a netsplit or netjoin line
+SHOWN = 100
+
+# Time shown in front of every line, now or when in seconds since the epoch
+def timestamp(when=None):
+    return time.strftime("%H:%M:%S",time.localtime(when))
+
+# Nicks for a netsplit or netjoin line, the first SHOWN of them
+def nickList(nicks):
+    if len(nicks) <= SHOWN:
+        return ", ".join(nicks)
+    return ", ".join(nicks[:SHOWN]) + f" and {len(nicks) - SHOWN} more"
+
+class Sink(object):
+    '''
+    Where the ChatCore puts what should be shown. The methods are called on
+    the receive thread, a sink for a GUI should hand them over to its own
+    thread, see client.UiQueue
+
+    Methods:
+        append(tab,segments)
+            add a line to a tab, segments is a list of (text,color,font)
+        names(channel)
+            the names list of channel changed, see ChatCore.roster
+        topic(channel,topic)
+            set the topic of channel
+        open(tab)
+            make sure a tab exists
+        wake()
+            look at the client state, eg. failedLogin
+    '''
+    def append(self,tab,segments):
+        pass
+
+    def names(self,channel):
+        pass
+
+    def topic(self,channel,topic):
+        pass
+
+    def open(self,tab):
+        pass
+
+    def wake(self):
+        pass
+
+class ChatCore(IrcCon):
+    '''
+    Extend the IrcCon class with the client side handling of the events
+
+    Parameters:
+    -----------
+    sink : Sink
+        Gets the lines to show
+    filters : FilterEngine
+        Hides matching messages, optional
+    store : MessageStore
+        Records the history for /search, optional
+    '''
+    def __init__(self,sink,filters=None,store=None):
+        IrcCon.__init__(self)
+        self.sink = sink
+        self.filters = filters
+        self.store = store
+        # Who is in which channel
+        self.roster = Roster()
+        # Nick -> away reason, from away-notify
+        self.away = dict()
+        # The last server-time tag and its seconds, a message needs it twice
+        self.lastTime = (None,None)
+
+    def record(self,channel,nick,kind,text,when=None,host=None):
+        if self.store:
+            self.store.record(self.HOST,channel,nick,kind,text,when,host)
+
+    # When the server got the message being handled, from its server-time
+    # tag. None if it has none, ie. now
+    def when(self):
+        msg = self.message
+        if msg is None or not msg.tags:
+            return None
+        value = msg.tags.get("time")
+        if not value:
+            return None
+        if value != self.lastTime[0]:
+            self.lastTime = (value,server_time(value))
+        return self.lastTime[1]
+
+    # Time shown in front of a line from the message being handled, only
+    # call it from a handler
+    def stamp(self):
+        return timestamp(self.when())
+
+    # Message a channel or user and show it as our own line. With
+    # echo-message the server sends it back and on_echo shows it
+    def say(self,target,msg):
+        done = self.privmsg(target,msg)
+        if "echo-message" not in self.caps:
+            self.own(target,msg,timestamp(),None)
+        return done
+
+    def on_echo(self,target,msg):
+        self.own(target,msg,self.stamp(),self.when())
+
+    def own(self,target,msg,stamp,when):
+        self.record(target,self.NICK,"PRIVMSG",msg,when)
+        self.sink.append(target,[(f"{stamp} | ",None,None),(f"{self.NICK} ","purple",None),(f"> {msg}\n",None,None)])
+
+    def on_error(self,errorType):
+        if errorType == "NickInUse":
+            self.failedLogin = True
+            self.sink.wake()
+
+    def on_sasl_success(self,account):
+        self.sink.append("info",[(f"{self.stamp()} | Logged in as {account}\n","dark green",BOLD)])
+
+    def on_sasl_failure(self,reason):
+        fallback = ", trying NickServ" if self.identify else ""
+        self.sink.append("info",[(f"{self.stamp()} | SASL login failed: {reason}{fallback}\n","dark red",BOLD)])
+
+    def on_connection_broken(self):
+        self.sink.append("info",[(f"{timestamp()} | Lost the connection to {self.HOST}\n","dark red",BOLD)])
+        self.sink.wake()
+
+    def on_message(self,who,channel,msg):
+        # Filter out messages
+        if self.filters and self.filters.match(channel,who,msg):
+            return
+        if channel == self.NICK:
+            channel = who
+        if channel not in self.channels:
+            self.sink.open(channel)
+            self.channels.add(channel)
+        self.record(channel,who,"PRIVMSG",msg,self.when())
+        color = chash.cached_hex(who)
+        self.sink.append(channel,[(f"{self.stamp()} | ",None,None),(f"{who} ",color,None),(f"> {msg}\n",None,None)])
+
+    def on_user_join(self,who,channel,hostname):
+        msg = f"{self.stamp()} | ---> {who} ({hostname}) has joined {channel}\n"
+        self.sink.append(channel,[(msg,"green",None)])
+        self.record(channel,who,"JOIN","",self.when(),hostname)
+        # Add user to the names list
+        self.roster.add(channel,who)
+        self.sink.names(channel)
+
+    def on_user_part(self,who,channel,hostname):
+        msg = f"{self.stamp()} | <--- {who} ({hostname}) has parted {channel}\n"
+        self.sink.append(channel,[(msg,"orange",None)])
+        self.record(channel,who,"PART","",self.when(),hostname)
+        # Remove the user from the names list
+        self.roster.remove(channel,who)
+        self.sink.names(channel)
+
+    def on_user_nick_change(self,who,newNick):
+        msg = f"{self.stamp()} | {who} is now known as {newNick}\n"
+        if who in self.away:
+            self.away[newNick] = self.away.pop(who)
+        # The roster keeps any leading +,~ @ for us
+        for chan in self.roster.rename(who,newNick):
+            self.sink.append(chan,[(msg,"blue",None)])
+            self.sink.names(chan)
+
+    def on_user_away(self,who,reason):
+        if reason is None:
+            self.away.pop(who,None)
+        else:
+            self.away[who] = reason
+
+    def on_user_quit(self,who,hostname,msg):
+        self.away.pop(who,None)
+        reason = msg
+        msg = f"{self.stamp()} | {who} ({hostname}) quit: {msg}\n"
+        for chan in self.roster.quit(who):
+            self.record(chan,who,"QUIT",reason,self.when(),hostname)
+            self.sink.append(chan,[(msg,"red",None)])
+            self.sink.names(chan)
+
+    # One line and one names list update per channel for a whole netsplit
+    def on_netsplit(self,servers,quits):
+        reason = ' '.join(servers)
+        left = self.roster.quit_many([who for (who,hostname) in quits])
+        # The roster gives the nicks back as it knows them
+        hostnames = {self.roster.fold(who): hostname for (who,hostname) in quits}
+        for (chan,nicks) in left.items():
+            for who in nicks:
+                self.record(chan,who,"QUIT",reason,host=hostnames.get(self.roster.fold(who)))
+            msg = f"{timestamp()} | Netsplit {servers[0]} <-> {servers[1]}, {len(nicks)} quit: {nickList(nicks)}\n"
+            self.sink.append(chan,[(msg,"red",None)])
+            self.sink.names(chan)
+
+    def on_netjoin(self,servers,joins):
+        channels = dict()
+        hostnames = dict()
+        for (who,chan,hostname) in joins:
+            channels.setdefault(chan,[]).append(who)
+            hostnames[who] = hostname
+        for (chan,nicks) in channels.items():
+            nicks = self.roster.add_many(chan,nicks)
+            for who in nicks:
+                self.record(chan,who,"JOIN","",host=hostnames[who])
+            msg = f"{timestamp()} | Netjoin {servers[0]} <-> {servers[1]}, {len(nicks)} joined: {nickList(nicks)}\n"
+            self.sink.append(chan,[(msg,"green",None)])
+            self.sink.names(chan)
+
+    def on_topic(self,chan,topic):
+        self.sink.topic(chan,topic)
+
+    def on_whois(self,line):
+        line = ' '.join(line.params[1:])
+        msg = f"{self.stamp()} | {line}\n"
+        self.sink.append("info",[(msg,None,None)])
+
+    def unknown_message(self,line):
+        line = f"{self.stamp()} | " + line + "\n"
+        self.sink.append("info",[(line,None,None)])
+
+    def on_nickserv(self,msg):
+        msg = f"{self.stamp()} | " + "NickServ " + msg + "\n"
+        self.sink.append("info",[(msg,"dark red",BOLD)])
+
+    def end_names(self,channel,names):
+        self.roster.set_names(channel,names)
+        self.sink.names(channel)
+
+    def on_isupport(self,features):
+        if "CASEMAPPING" in features or "PREFIX" in features:
+            # PREFIX=(ov)@+ we only need the symbols
+            prefixes = features.get("PREFIX","").partition(")")[2]
+            self.roster.configure(features.get("CASEMAPPING"),prefixes)
+
+    def on_list(self,channel,members):
+        msg = f"{self.stamp()} | Chan: {channel} Members: {members}\n"
+        self.sink.append("info",[(msg,"dark green",BOLD)])
+
+    def on_notice(self,chan,msg):
+        if chan not in self.channels:
+            self.sink.open(chan)
+            self.channels.add(chan)
+        self.record(chan,None,"NOTICE",msg,self.when())
+        msg = f"{self.stamp()} | " + "Notice " + msg + "\n"
+        if msg == "Server is shutting down":
+            self.disconnect()
+        self.sink.append(chan,[(msg,"dark red",BOLD)])
@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the message filters. All the rules are compiled into one
+regular expression per scope whenever the list changes, so checking a message
+is a single scan however many rules there are.
+
+A rule is written the same way as in the filter window:
+    [#chan] [nick:who] pattern
+
+    pattern         matches the words or phrase, case doesn't matter
+    *pattern*       matches anywhere, even inside a word
+    #chan           only filter in this channel
+    nick:who        only filter messages from who
+
+For example "#linux nick:bot *http*" hides links posted by bot in #linux.
+'''
+import json
+import os
+import re
+
+class FilterRule(object):
+    '''
+    A single parsed filter rule, see parse_rule
+    '''
+    __slots__ = ("text","channel","sender","pattern","substring")
+
+    def __init__(self,text,channel,sender,pattern,substring):
+        self.text = text
+        self.channel = channel
+        self.sender = sender
+        self.pattern = pattern
+        self.substring = substring
+
+    def regex(self):
+        if self.substring:
+            return re.escape(self.pattern)
+        # Any run of spaces in a phrase matches any run of whitespace
+        words = [re.escape(word) for word in self.pattern.split()]
+        return r"(?<!\w)" + r"\s+".join(words) + r"(?!\w)"
+
+def parse_rule(text):
+    '''
+    Parse a rule, returns a FilterRule or None if there is no pattern
+    '''
+    channel = sender = None
+    words = text.split()
+    # Scopes come first, the rest is the pattern
+    while words:
+        if words[0][0] in "#&" and channel is None and len(words) > 1:
+            channel = words.pop(0).lower()
+        elif words[0].lower().startswith("nick:") and sender is None and len(words) > 1:
+            sender = words.pop(0)[5:].lower()
+        else:
+            break
+    pattern = " ".join(words)
+    substring = False
+    if len(pattern) > 2 and pattern.startswith("*") and pattern.endswith("*"):
+        pattern = pattern[1:-1]
+        substring = True
+    if not pattern:
+        return None
+    return FilterRule(text,channel,sender,pattern,substring)
+
+class FilterEngine(object):
+    '''
+    Holds the filter rules, compiles them and counts how often each matched.
+    The rules and counts are saved to path so they survive a restart.
+
+    Methods:
+        set_rules(rules)
+            replace the rules with a list of rule strings and save them
+        rules()
+            the rule strings
+        match(channel,sender,msg)
+            the rule string that matches the message or None
+        hits(rule)
+            how many messages rule has filtered
+        load(), save()
+            read or write the rules and counts
+    '''
+    def __init__(self,path=None):
+        self.path = path
+        self.ruleList = []
+        self.counts = dict()
+        # Scope (channel, sender) -> (compiled regex, group name -> rule).
+        # Replaced as a whole so the receive thread never sees half of it
+        self.compiled = dict()
+        if path:
+            self.load()
+
+    def rules(self):
+        return list(self.ruleList)
+
+    def hits(self,rule):
+        return self.counts.get(rule,0)
+
+    def set_rules(self,rules):
+        rules = [rule.strip() for rule in rules]
+        self.ruleList = [rule for rule in dict.fromkeys(rules) if rule]
+        self.counts = {rule: self.counts.get(rule,0) for rule in self.ruleList}
+        self.compile()
+        self.save()
+
+    def compile(self):
+        scopes = dict()
+        for text in self.ruleList:
+            rule = parse_rule(text)
+            if rule:
+                scopes.setdefault((rule.channel,rule.sender),[]).append(rule)
+        compiled = dict()
+        for scope,rules in scopes.items():
+            # Longest first so a phrase wins over a word inside it
+            rules.sort(key=lambda rule: len(rule.pattern),reverse=True)
+            groups = dict()
+            parts = []
+            for i,rule in enumerate(rules):
+                groups[f"r{i}"] = rule.text
+                parts.append(f"(?P<r{i}>{rule.regex()})")
+            compiled[scope] = (re.compile("|".join(parts),re.IGNORECASE),groups)
+        self.compiled = compiled
+
+    def match(self,channel,sender,msg):
+        compiled = self.compiled
+        if not compiled:
+            return None
+        channel = channel.lower()
+        sender = sender.lower()
+        for scope in ((None,None),(channel,None),(None,sender),(channel,sender)):
+            entry = compiled.get(scope)
+            if entry is None:
+                continue
+            found = entry[0].search(msg)
+            if found:
+                rule = entry[1][found.lastgroup]
+                self.counts[rule] = self.counts.get(rule,0) + 1
+                return rule
+        return None
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path,"r") as f:
+                saved = json.load(f)
+        # A broken file shouldn't stop the client from starting
+        except (OSError,ValueError):
+            return
+        self.ruleList = [entry["rule"] for entry in saved]
+        self.counts = {entry["rule"]: entry.get("hits",0) for entry in saved}
+        self.compile()
+
+    def save(self):
+        if not self.path:
+            return
+        saved = [{"rule": rule, "hits": self.counts.get(rule,0)} for rule in self.ruleList]
+        with open(self.path,"w") as f:
+            json.dump(saved,f,indent=1)
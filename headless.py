@@ -0,0 +1,364 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the headless client, the ChatCore without a GUI. It stays
+connected to the networks in a config file, logs everything to disk like the
+GUI does and takes commands on a local unix socket. Run it with:
+    python3 -m slickirc --headless --config net.toml
+
+The config is read with tomllib from Python 3.11, older versions need tomli
+from requirements.txt.
+
+The config looks like:
+    [log]
+    dir = "chatlog"             # chat logs, the same layout as the GUI's
+    history = "history.db"      # searchable history, "" to turn it off
+    filters = "filters.json"    # optional filter rules
+
+    [control]
+    socket = "slickirc.sock"
+
+    [metrics]                   # optional, count traffic and time handlers
+    export = "slickirc.prom"    # .prom for Prometheus text, otherwise JSON
+    interval = 15               # seconds between exports
+
+    [[network]]
+    name = "tilde"
+    host = "irc.tilde.chat"
+    port = 6697
+    ssl = true
+    verify = true               # optional, false accepts a self-signed
+                                # certificate
+    nick = "slick"
+    user = "slick"
+    realname = "Slick IRC"
+    channels = ["#meta"]
+    capture = "tilde.cap.gz"    # optional, record the raw traffic
+    ping_interval = 30          # optional, seconds between lag probes
+    ping_timeout = 120          # optional, reconnect after this much silence
+    caps = ["server-time"]      # optional, IRCv3 capabilities to ask for,
+                                # default all of caps.CAPS
+    flood_burst = 5             # optional, lines sent at once and lines per
+    flood_rate = 0.5            # second after that, 0 turns it off
+    sasl = "PLAIN"              # optional, log in while registering, PLAIN
+    account = "slick"           # with account (default nick) and password
+    password = "secret"         # or EXTERNAL with certfile and keyfile
+    certfile = "slick.pem"      # optional, TLS client certificate
+    keyfile = "slick.key"
+    nickserv_fallback = true    # IDENTIFY with the password if SASL fails
+
+Commands are sent as a line each, eg. with "nc -U slickirc.sock", and answered
+with any output followed by OK or ERR and the reason. A command goes to the
+first network unless it starts with @name:
+    status
+    join #chan [#chan ...]
+    part #chan [#chan ...]
+    msg target text
+    nick newnick
+    raw LINE
+    search [#chan] [nick:who] terms
+    capture file|stop
+    stats
+    lag
+    quit [message]
+'''
+import os
+import socketserver
+import threading
+import time
+try:
+    import tomllib
+# Before Python 3.11 the same parser is the tomli package
+except ImportError:
+    import tomli as tomllib
+from core import ChatCore, Sink, timestamp
+from session import SessionManager
+from chatlog import ChatLogger
+from store import MessageStore, parse_search
+from filters import FilterEngine
+from metrics import Exporter
+
+# Seconds between checks for dropped connections, a connection which notices
+# it went dead gets us going straight away. The reconnect itself waits for the
+# connection's backoff, see lag.Backoff
+RETRY = 30
+
+class LogSink(Sink):
+    '''
+    Writes what the GUI would show to the chat logs
+    '''
+    def __init__(self,logger,network):
+        self.logger = logger
+        self.network = network
+
+    def append(self,tab,segments):
+        self.logger.write(self.network,tab,"".join(text for (text,color,font) in segments))
+
+    def topic(self,channel,topic):
+        self.append(channel,[(f"{timestamp()} | Topic: {topic}\n",None,None)])
+
+class HeadlessCore(ChatCore):
+    '''
+    ChatCore which joins its channels by itself once registered and picks
+    another nick if its own is taken, there is nobody to ask
+    '''
+    def __init__(self,sink,filters=None,store=None,autojoin=()):
+        ChatCore.__init__(self,sink,filters,store)
+        self.autojoin = list(autojoin)
+        # Called when the connection went away by itself
+        self.broken = None
+
+    # Registration is done, join the channels including the ones we were in
+    # before a reconnect
+    def handle_welcome(self,msg):
+        ChatCore.handle_welcome(self,msg)
+        for chan in self.autojoin:
+            self.channels.add(chan)
+        for chan in sorted(self.channels):
+            if chan[:1] in "#&":
+                self.send_raw(f"JOIN {chan}")
+
+    def on_error(self,errorType):
+        if errorType == "NickInUse":
+            self.login(self.NICK + "_",self.USER,self.RNAME)
+
+    def on_connection_broken(self):
+        ChatCore.on_connection_broken(self)
+        if self.broken:
+            self.broken()
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            line = line.decode("UTF-8",errors="replace").strip()
+            if not line:
+                continue
+            try:
+                reply = self.server.daemon.command(line)
+                reply.append("OK")
+            except ValueError as e:
+                reply = [f"ERR {e}"]
+            self.wfile.write("".join(f"{text}\n" for text in reply).encode("UTF-8"))
+            if not self.server.daemon.running:
+                return
+
+class ControlServer(socketserver.ThreadingMixIn,socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class Daemon(object):
+    '''
+    The headless client
+
+    Methods:
+        start()
+            connect to the networks and open the control socket
+        run()
+            reconnect dropped networks until a quit command
+        command(line)
+            run a control command, returns the output lines, raises
+            ValueError for a bad command
+        stop(msg=None)
+            quit all networks and close everything
+    '''
+    def __init__(self,config):
+        self.config = config
+        log = config.get("log",dict())
+        self.logger = ChatLogger(log.get("dir","chatlog"))
+        history = log.get("history","history.db")
+        self.store = MessageStore(history) if history else None
+        self.filters = FilterEngine(log["filters"]) if log.get("filters") else None
+        self.networks = config.get("network",[])
+        if not self.networks:
+            raise ValueError("No [[network]] in the config")
+        self.sessions = SessionManager()
+        self.control = None
+        self.metrics = config.get("metrics")
+        self.exporter = None
+        self.running = False
+        self.stopped = threading.Event()
+        self.retry = threading.Event()
+
+    def start(self):
+        self.logger.start()
+        if self.store:
+            self.store.start()
+        self.sessions.start()
+        for net in self.networks:
+            name = net.get("name",net["host"])
+            con = HeadlessCore(LogSink(self.logger,net["host"]),self.filters,self.store,net.get("channels",()))
+            con.broken = self.retry.set
+            if "caps" in net:
+                con.wantCaps = list(net["caps"])
+            con.verify = net.get("verify",True)
+            con.certfile = net.get("certfile")
+            con.keyfile = net.get("keyfile")
+            if net.get("sasl"):
+                con.set_sasl(net["sasl"],net.get("account"),net.get("password"),net.get("nickserv_fallback",True))
+            con.sendq.configure(net.get("flood_burst"),net.get("flood_rate"))
+            con.lag.interval = net.get("ping_interval",con.lag.interval)
+            con.lag.timeout = net.get("ping_timeout",con.lag.timeout)
+            self.sessions.add(name,con)
+            if net.get("capture"):
+                con.start_capture(net["capture"])
+            if self.metrics is not None:
+                metrics = con.enable_metrics()
+                metrics.network = name
+                metrics.gauge("chatlog",self.logger.queue.qsize)
+                if self.store:
+                    metrics.gauge("history",self.store.queue.qsize)
+            self.connect(con,net)
+        if self.metrics and self.metrics.get("export"):
+            cons = [self.sessions[name].metrics for name in self.sessions]
+            self.exporter = Exporter(self.metrics["export"],cons,self.metrics.get("interval",15))
+            self.exporter.start()
+        path = self.config.get("control",dict()).get("socket")
+        if path:
+            # Left over from a previous run
+            if os.path.exists(path):
+                os.unlink(path)
+            self.control = ControlServer(path,ControlHandler)
+            self.control.daemon = self
+            os.chmod(path,0o600)
+            threading.Thread(target=self.control.serve_forever,daemon=True).start()
+        self.running = True
+
+    def connect(self,con,net):
+        if con.connect(net["host"],net.get("port",6667),net.get("ssl",False)):
+            con.login(net["nick"],net.get("user",net["nick"]),net.get("realname"))
+
+    def run(self):
+        # Network name -> when to reconnect it
+        due = dict()
+        while True:
+            wait = RETRY
+            if due:
+                wait = max(0,min(min(due.values()) - time.monotonic(),RETRY))
+            self.retry.wait(wait)
+            self.retry.clear()
+            # Quitting, stop sets stopped once everything is closed
+            if not self.running:
+                self.stopped.wait()
+                return
+            for net in self.networks:
+                name = net.get("name",net["host"])
+                con = self.sessions[name]
+                if con.connected:
+                    due.pop(name,None)
+                elif name not in due:
+                    due[name] = time.monotonic() + con.backoff.next()
+                elif time.monotonic() >= due[name]:
+                    con.disconnect()
+                    self.connect(con,net)
+                    if con.connected:
+                        del due[name]
+                    else:
+                        due[name] = time.monotonic() + con.backoff.next()
+
+    def network(self,words):
+        if words and words[0].startswith("@"):
+            name = words.pop(0)[1:]
+            if name not in self.sessions:
+                raise ValueError(f"No network {name}")
+            return self.sessions[name]
+        return self.sessions[self.networks[0].get("name",self.networks[0]["host"])]
+
+    def command(self,line):
+        words = line.split()
+        con = self.network(words)
+        if not words:
+            raise ValueError("No command")
+        command = words.pop(0).lower()
+        if command == "status" or command == "lag":
+            reply = []
+            for name in self.sessions:
+                net = self.sessions[name]
+                state = "connected" if net.connected else "disconnected"
+                lag = net.lag.current() if net.connected else None
+                lag = "-" if lag is None else f"{lag * 1000:.0f}ms"
+                chans = " ".join(sorted(chan for chan in net.channels if chan[:1] in "#&"))
+                reply.append(f"{name} {net.HOST}:{net.PORT} {state} lag {lag} {net.NICK} {chans}".rstrip())
+                if command == "lag":
+                    reply.extend(net.lag.report())
+            return reply
+        elif command == "join" and words:
+            for chan in words:
+                con.join(chan)
+        elif command == "part" and words:
+            for chan in words:
+                if chan in con.channels:
+                    con.part(chan)
+                    con.roster.clear(chan)
+        elif command == "msg" and len(words) >= 2:
+            con.say(words[0],' '.join(words[1:]))
+        elif command == "nick" and len(words) == 1:
+            con.login(words[0],con.USER,con.RNAME)
+        elif command == "raw" and words:
+            con.send_raw(' '.join(words))
+        elif command == "capture" and len(words) == 1:
+            if words[0] == "stop":
+                con.stop_capture()
+            else:
+                con.start_capture(words[0])
+        elif command == "search" and words and self.store:
+            return self.search(words)
+        elif command == "stats":
+            reply = []
+            for name in self.sessions:
+                metrics = self.sessions[name].metrics
+                if metrics is None:
+                    raise ValueError("Metrics are off, add [metrics] to the config")
+                reply.append(f"{name}:")
+                reply.extend(metrics.report())
+            return reply
+        elif command == "quit":
+            self.stop(' '.join(words) or None)
+        else:
+            raise ValueError(f"Bad command {line}")
+        return []
+
+    def search(self,words):
+        (channel,nick,terms) = parse_search(words)
+        reply = []
+        for (when,chan,who,kind,text,host) in self.store.search(terms,channel,nick):
+            when = time.strftime("%Y-%m-%d %H:%M:%S",time.localtime(when))
+            reply.append(f"{when} {chan} {kind} {who or ''} {text or host or ''}")
+        return reply
+
+    def stop(self,msg=None):
+        if not self.running:
+            return
+        self.running = False
+        for name in self.sessions:
+            con = self.sessions[name]
+            if con.connected:
+                con.quitC(msg)
+                con.flush()
+            con.stop_capture()
+        self.sessions.stop()
+        if self.exporter:
+            self.exporter.stop()
+        if self.control:
+            self.control.shutdown()
+            self.control.server_close()
+            os.unlink(self.control.server_address)
+        if self.filters:
+            self.filters.save()
+        self.logger.close()
+        if self.store:
+            self.store.close()
+        self.stopped.set()
+        self.retry.set()
+
+def load_config(path):
+    with open(path,"rb") as f:
+        return tomllib.load(f)
+
+def main(path):
+    daemon = Daemon(load_config(path))
+    daemon.start()
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
@@ -1,10 +1,177 @@
 #!/usr/bin/python3
 # Author: Talhah Peerbhai
 # Email: hello@talhah.tech
+import base64
 import socket
+import sys
 import threading
-from select import select
 import ssl
+import time
+import traceback
+from sendqueue import SendQueue
+from lag import LagMeter, Backoff, PREFIX
+from netsplit import SplitTracker
+from caps import CAPS, parse_caps
+
+class LineFramer(object):
+    '''
+    Split a stream of bytes from the socket into IRC lines. TCP doesn't care
+    about our line boundaries so a read can end halfway through a line, or
+    halfway through a multi-byte UTF-8 character. We keep that partial tail
+    around until the rest of it arrives.
+
+    Methods:
+        read_from(con)
+            receive once from a socket and return the complete lines
+        feed(data)
+            add bytes and return the complete lines
+    '''
+    def __init__(self,size=4096):
+        # Preallocated receive buffer which recv_into fills, saves allocating
+        # a new bytes object on every read
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        # Bytes after the last \n, waiting for the rest of their line
+        self.tail = bytearray()
+        # Bytes fed in so far
+        self.received = 0
+
+    def read_from(self,con,capture=None):
+        '''
+        Receive once from con, returns a list of decoded lines or None if the
+        connection was closed. The raw bytes also go to capture if given
+        '''
+        n = con.recv_into(self.buf)
+        if n == 0:
+            return None
+        if capture is not None:
+            capture.inbound(bytes(self.view[:n]))
+        return self.feed(self.view[:n])
+
+    def feed(self,data):
+        '''
+        Add received bytes, returns a list of all the lines completed by them
+        '''
+        tail = self.tail
+        tail += data
+        self.received += len(data)
+        end = tail.rfind(b"\n")
+        if end == -1:
+            return []
+        chunk = bytes(tail[:end])
+        del tail[:end+1]
+        lines = []
+        # \n can't appear inside a multi-byte character so every line is
+        # whole and can be decoded on its own
+        for line in chunk.split(b"\n"):
+            try:
+                line = line.decode("UTF-8")
+            except UnicodeDecodeError:
+                # Plenty of old clients and bridges still send latin-1
+                line = line.decode("latin-1")
+            lines.append(line.rstrip("\r"))
+        return lines
+
+# Escaped characters in message tag values, see
+# https://ircv3.net/specs/extensions/message-tags
+TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+class IrcMessage(object):
+    '''
+    A single parsed IRC line, see parse_message
+
+    Attributes:
+        tags : dict
+            IRCv3 message tags, empty if there were none
+        prefix : str
+            The raw prefix without the leading colon, empty if there was none
+        nick : str
+            Nick in the prefix, or the server name for server messages
+        user : str
+            Username in the prefix, empty if not given
+        host : str
+            Hostname in the prefix, empty if not given
+        command : str
+            The command or numeric, always upper case
+        params : list
+            The parameters, the trailing one is kept whole including spaces
+    '''
+    __slots__ = ("tags","prefix","nick","user","host","command","params")
+
+    def __init__(self,tags,prefix,nick,user,host,command,params):
+        self.tags = tags
+        self.prefix = prefix
+        self.nick = nick
+        self.user = user
+        self.host = host
+        self.command = command
+        self.params = params
+
+    # user@host, which is what the GUI shows on joins and quits
+    @property
+    def hostname(self):
+        return f"{self.user}@{self.host}"
+
+    def __repr__(self):
+        return f"IrcMessage({self.prefix!r}, {self.command!r}, {self.params!r})"
+
+def unescape_tag(value):
+    '''
+    Undo the escaping of a message tag value
+    '''
+    if "\\" not in value:
+        return value
+    out = []
+    i = 0
+    while i < len(value):
+        c = value[i]
+        if c == "\\":
+            i += 1
+            # A lone trailing backslash is dropped
+            if i < len(value):
+                out.append(TAG_ESCAPES.get(value[i],value[i]))
+        else:
+            out.append(c)
+        i += 1
+    return "".join(out)
+
+def parse_message(line):
+    '''
+    Parse a line as specified in RFC 1459 and the IRCv3 message-tags
+    extension:
+        [@tags] [:prefix] command [params] [:trailing]
+
+    Returns an IrcMessage, raises ValueError if there is no command
+    '''
+    tags = {}
+    if line.startswith("@"):
+        raw, _, line = line[1:].partition(" ")
+        for tag in raw.split(";"):
+            key, _, value = tag.partition("=")
+            if key:
+                tags[key] = unescape_tag(value)
+        line = line.lstrip(" ")
+    prefix = nick = user = host = ""
+    if line.startswith(":"):
+        prefix, _, line = line[1:].partition(" ")
+        # nick!user@host, server messages just have a name
+        nick, _, host = prefix.partition("@")
+        nick, _, user = nick.partition("!")
+        line = line.lstrip(" ")
+    # Everything after " :" is the trailing parameter, spaces and all
+    if line.startswith(":"):
+        line, trailing = "", line[1:]
+    else:
+        line, sep, trailing = line.partition(" :")
+        if not sep:
+            trailing = None
+    params = line.split()
+    if not params:
+        raise ValueError(f"No command in line {line!r}")
+    command = params.pop(0).upper()
+    if trailing is not None:
+        params.append(trailing)
+    return IrcMessage(tags,prefix,nick,user,host,command,params)
 
 class IrcCon(object):
     '''
@@ -28,6 +195,26 @@ class IrcCon(object):
             send a message to a channel or individual
         quitC(msg=None)
             quit and send a message
+        register_handler(command,handler)
+            handle a command or numeric with handler(msg)
+        start_capture(path), stop_capture()
+            record the raw traffic to a file, see capture.py
+        enable_metrics(metrics=None), disable_metrics()
+            count the traffic and time the handlers, see metrics.py
+        tick(now=None)
+            the timed work, see check_lag and the netsplit bursts, returns
+            the seconds until it needs calling again
+        check_lag(now=None)
+            PING the server when it's time and notice a dead connection
+        flush_bursts()
+            hand over the netsplits and netjoins still being gathered
+        release(nick)
+            hand over what is held back of nick, before anything else
+            about them
+
+    The IRCv3 capabilities in wantCaps are negotiated at login, the ones the
+    server enabled are in caps, see caps.py. With set_sasl we also log in to
+    our account during that negotiation, before 001
         
         TODO Complete documentation
     '''
@@ -38,22 +225,101 @@ class IrcCon(object):
         Constructor for IrcCon class, initializes the socket, default host,
         port, nick, user and realname. Sets connected to False
         '''
-        # https://docs.python.org/3/library/socket.html
-        # AF_INET is for ipv4 IPS and domains, SOCK_STREAM is socket type,
-        # in this case a constant two way TCP socket.
-        self.sckt = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.sckt = self.new_socket()
         self.HOST = "127.0.0.1" # default irc server
         self.PORT = 6667 # default plaintext port
+        self.SSL = False
         self.NICK = ""
         self.USER = ""
         self.RNAME = ""
         self.connected = False
         self.channels = set()
         self.startWhoList = False
-        self.startNames = False
-        self.names = dict()
+        # Server features from RPL_ISUPPORT (005), eg. CASEMAPPING and PREFIX
+        self.isupport = dict()
+        # Channel -> names received so far, NAMES replies for several channels
+        # can be interleaved so we collect each separately until its 366
+        self.pendingNames = dict()
         self.userDone = False
         self.failedLogin = False
+        # Set once the server welcomed us with 001
+        self.registered = False
+        # Our PINGs to the server and their PONGs, see check_lag
+        self.lag = LagMeter()
+        # Delays for whatever reconnects us after on_connection_broken,
+        # reset by 001
+        self.backoff = Backoff()
+        # Netsplit QUITs and netjoin JOINs gathered for on_netsplit and
+        # on_netjoin
+        self.splits = SplitTracker()
+        # Wakes the tick_loop thread early
+        self.tickWake = threading.Event()
+        # IRCv3 capabilities to ask for at login, change before logging in
+        self.wantCaps = list(CAPS)
+        # (mechanism,account,password) to log in with, see set_sasl
+        self.sasl = None
+        self.saslFallback = True
+        # Client certificate for TLS, SASL EXTERNAL logs in with it
+        self.certfile = None
+        self.keyfile = None
+        self.reset_caps()
+        # The message being handled, eg. for its server-time tag
+        self.message = None
+        # Outgoing lines wait here for the writer, see send_raw
+        self.sendq = SendQueue()
+        # Set by SessionManager.add when a manager receives for us
+        self.manager = None
+        self.network = None
+        # Check the server's TLS certificate, turn off for a test server with
+        # a self-signed one
+        self.verify = True
+        # Records the raw traffic when set, see start_capture
+        self.capture = None
+        # Counts the traffic when set, see enable_metrics
+        self.metrics = None
+        # Command or numeric -> function taking the IrcMessage, anything not
+        # in here goes to handle_unknown. See register_handler
+        self.handlers = {
+            "PING": self.handle_ping,
+            "PONG": self.handle_pong,
+            "BATCH": self.handle_batch,
+            "CAP": self.handle_cap,
+            "AWAY": self.handle_away,
+            "001": self.handle_welcome,
+            "PRIVMSG": self.handle_privmsg,
+            "NOTICE": self.handle_notice,
+            "JOIN": self.handle_join,
+            "PART": self.handle_part,
+            "NICK": self.handle_nick,
+            "QUIT": self.handle_quit,
+            "401": self.handle_invalid_nick,
+            # TODO Invalid channel
+            "403": self.handle_ignore,
+            "433": self.handle_nick_in_use,
+            "005": self.handle_isupport,
+            "311": self.handle_whois_start,
+            "318": self.handle_whois_end,
+            "322": self.handle_list,
+            "331": self.handle_no_topic,
+            "332": self.handle_topic,
+            # Ignore RPL_TOPICTIME
+            "333": self.handle_ignore,
+            "353": self.handle_names,
+            "366": self.handle_end_names,
+            "AUTHENTICATE": self.handle_authenticate,
+            # RPL_LOGGEDIN and RPL_SASLSUCCESS
+            "900": self.handle_logged_in,
+            "903": self.handle_sasl_success,
+            # ERR_NICKLOCKED, ERR_SASLFAIL, ERR_SASLTOOLONG, ERR_SASLABORTED,
+            # ERR_SASLALREADY
+            "902": self.handle_sasl_fail,
+            "904": self.handle_sasl_fail,
+            "905": self.handle_sasl_fail,
+            "906": self.handle_sasl_fail,
+            "907": self.handle_sasl_fail,
+            # RPL_SASLMECHS comes before the 904
+            "908": self.handle_ignore,
+        }
 
     def connect(self,HOST=None,PORT=None,SSL=False):
         '''
@@ -80,22 +346,58 @@ class IrcCon(object):
             self.HOST = HOST
         if PORT != self.PORT:
             self.PORT = PORT
+        self.SSL = SSL
         try:
             if SSL:
-                self.ctx = ssl.create_default_context(purpose=ssl.Purpose.CLIENT_AUTH)
-                self.sckt = self.ctx.wrap_socket(self.sckt)
+                self.ctx = self.ssl_context()
+                self.sckt = self.ctx.wrap_socket(self.sckt,server_hostname=self.HOST)
             self.sckt.connect((self.HOST,self.PORT))
             self.connected = True
+            self.registered = False
+            self.reset_caps()
+            self.lag.reset()
             self.on_connect()
-            self.thread = threading.Thread(target=self.recv_loop,args=[self.sckt]) 
-            self.thread.daemon = True
-            self.thread.start() 
+            # A SessionManager receives for us, otherwise we need a thread
+            if self.manager:
+                self.manager.watch(self)
+            else:
+                self.thread = threading.Thread(target=self.recv_loop,args=[self.sckt]) 
+                self.thread.daemon = True
+                self.thread.start() 
+                self.writer = threading.Thread(target=self.write_loop,args=[self.sckt])
+                self.writer.daemon = True
+                self.writer.start()
+                self.ticker = threading.Thread(target=self.tick_loop,args=[self.sckt])
+                self.ticker.daemon = True
+                self.ticker.start()
             return True
         except:
             self.on_error("ConnectionRefusedError")
             self.connected = False
             return False
 
+    def new_socket(self):
+        '''
+        The socket connect uses, a fresh one for every connection
+        '''
+        # https://docs.python.org/3/library/socket.html
+        # AF_INET is for ipv4 IPS and domains, SOCK_STREAM is socket type,
+        # in this case a constant two way TCP socket.
+        return socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+
+    def ssl_context(self):
+        '''
+        Returns the SSL context used for secure connections, it checks the
+        server's certificate and hostname unless verify is off
+        '''
+        ctx = ssl.create_default_context()
+        if not self.verify:
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+        if self.certfile:
+            ctx.load_cert_chain(self.certfile,self.keyfile)
+        return ctx
+
     def recv_loop(self,con):
         '''
         Receive loop to receive incoming messages
@@ -105,23 +407,274 @@ class IrcCon(object):
         con : socket
             The socket which is receiving incoming messages
         '''
+        framer = LineFramer()
+        # Block until there is data, the thread sleeps while idle
+        while self.handle_read(con,framer):
+            pass
+
+    def handle_read(self,con,framer):
+        '''
+        Receive once from con and dispatch the complete lines
+
+        Parameters:
+        -----------
+        con : socket
+            The socket to receive from, it must be readable
+        framer : LineFramer
+            Holds the partial line left over from the previous read on con
+
+        Returns:
+        --------
+        False once the connection has gone away, otherwise True
+        '''
+        received = framer.received
+        try:
+            lines = framer.read_from(con,self.capture)
+        # Non-blocking socket with nothing to read yet, SSL needs the rest
+        # of a record before it can give us anything
+        except (BlockingIOError,ssl.SSLWantReadError,ssl.SSLWantWriteError):
+            return True
+        # The socket was closed under us by disconnect or reconnect
+        except OSError:
+            lines = None
+        # The server closed the connection
+        if lines is None:
+            # Don't clobber the state of a newer connection, and we closed
+            # it ourselves if we're no longer connected
+            if con is self.sckt and self.connected:
+                self.connected = False
+                self.on_connection_broken()
+            return False
+        self.lag.lastHeard = time.monotonic()
+        if self.metrics is not None:
+            self.metrics.inbound(framer.received - received,len(lines))
+        if lines:
+            self.dispatch(lines)
+        return True
+
+    def send_raw(self,line,priority=False):
+        '''
+        Queue a single line for the server, the line ending is added here.
+        Priority lines such as PONG skip the flood control
+        '''
+        return self.send_lines([line],priority)
+
+    def send_lines(self,lines,priority=False):
+        '''
+        Queue several lines to go out together in one write, each line still
+        counts on its own for the flood control
+        '''
+        self.sendq.put_lines([bytes(f"{line}\r\n","UTF-8") for line in lines],priority)
+        if self.metrics is not None:
+            for line in lines:
+                self.metrics.sent_line()
+        if self.manager:
+            self.manager.want_write(self)
+
+    def write_loop(self,con):
+        '''
+        Writer thread, sends whatever the flood control allows. Everything
+        that's ready goes out in a single write
+
+        Parameters:
+        -----------
+        con : socket
+            The socket to write to, we stop once it's replaced
+        '''
+        sendq = self.sendq
+        while con is self.sckt:
+            if not sendq.wait():
+                continue
+            data = sendq.take()
+            if data:
+                try:
+                    con.sendall(data)
+                except OSError:
+                    return
+                if self.capture is not None:
+                    self.capture.outbound(data)
+                if self.metrics is not None:
+                    self.metrics.outbound(len(data))
+                sendq.sent(len(data))
+
+    def handle_write(self,con):
+        '''
+        Write what the flood control allows to the non-blocking socket con
+
+        Returns:
+        --------
+        Seconds until there is more to write, 0 if the socket is full and
+        we should wait until it's writable, None if the queue is empty
+        '''
+        data = self.sendq.take()
+        if data:
+            try:
+                n = con.send(data)
+            except (BlockingIOError,ssl.SSLWantReadError,ssl.SSLWantWriteError):
+                n = 0
+            # Dead socket, the read side notices and cleans up
+            except OSError:
+                return None
+            if n and self.capture is not None:
+                self.capture.outbound(data[:n])
+            if self.metrics is not None:
+                self.metrics.outbound(n)
+            self.sendq.sent(n)
+        return self.sendq.delay()
+
+    def tick_loop(self,con):
+        '''
+        Thread calling tick when it's due, until con is replaced
+        '''
+        delay = 0
         while True:
-            # Check if there is any data on socket, timeout after 0.1s
-            # prevent unecessary socket.recv
-            (r,wx,error) = select([con], [], [con], 0.1)
-            # Data to read
-            if r:
-                buffer = ""
-                buffer += buffer+self.sckt.recv(4096).decode("UTF-8")
-                temp = buffer.split("\n")
-                # We need to pop last element as when we receive data it has
-                # \r\n and we are splitting by \n, so we'd go from "hello\r\n"
-                # to ["hello\r",""] and that last element needs to be ignored
-                temp.pop(-1)
-                for line in temp:
-                    line = line.rstrip()
-                    line = line.split()
-                    self.incoming(line)
+            self.tickWake.wait(delay)
+            self.tickWake.clear()
+            if con is not self.sckt:
+                return
+            delay = self.tick()
+
+    def wake_tick(self):
+        '''
+        Something needs tick sooner than it said last time
+        '''
+        if self.manager:
+            self.manager.wake_tick()
+        else:
+            self.tickWake.set()
+
+    def tick(self,now=None):
+        '''
+        Do what is due, the SessionManager or our tick_loop call this
+
+        Returns:
+        --------
+        Seconds until it should be called again
+        '''
+        if now is None:
+            now = time.monotonic()
+        delay = self.check_lag(now)
+        for burst in self.splits.due(now):
+            self.burst(burst)
+        wait = self.splits.next(now)
+        if wait is not None and wait < delay:
+            delay = wait
+        return delay
+
+    def flush_bursts(self):
+        for burst in self.splits.flush():
+            self.burst(burst)
+
+    def release(self,nick):
+        '''
+        Hand over the netsplit QUIT or netjoin JOINs of nick still held back,
+        before anything else about nick is
+        '''
+        for burst in self.splits.release(nick):
+            self.burst(burst)
+
+    def burst(self,burst):
+        # Everything in it was released already
+        if not burst.events:
+            return
+        if burst.kind == "netsplit":
+            self.on_netsplit(burst.servers,burst.events)
+        else:
+            self.on_netjoin(burst.servers,burst.events)
+
+    def check_lag(self,now=None):
+        '''
+        PING the server if it's time to measure the lag, and drop the
+        connection if the server has been silent for longer than the lag
+        timeout
+
+        Returns:
+        --------
+        Seconds until it should be called again
+        '''
+        lag = self.lag
+        if now is None:
+            now = time.monotonic()
+        if not self.connected:
+            return lag.interval
+        if lag.dead(now):
+            self.connection_broken()
+            return lag.interval
+        # Before 001 the server may not answer a PING, look again soon
+        if not self.registered:
+            return min(1,lag.due(now,False))
+        token = lag.probe(now)
+        if token:
+            self.send_raw(f"PING :{token}",priority=True)
+        return lag.due(now)
+
+    def connection_broken(self):
+        '''
+        The connection went dead without being closed, close it and tell
+        on_connection_broken
+        '''
+        if not self.connected:
+            return
+        self.connected = False
+        self.shutdown()
+        self.on_connection_broken()
+
+    def start_capture(self,path):
+        '''
+        Record everything received and sent to path, compressed if it ends in
+        .gz or .xz. See capture.py for the format and for replaying it
+        '''
+        from capture import Capture
+        self.stop_capture()
+        self.capture = Capture(path)
+
+    def stop_capture(self):
+        capture = self.capture
+        self.capture = None
+        if capture is not None:
+            capture.close()
+
+    def enable_metrics(self,metrics=None):
+        '''
+        Count the traffic and time every handler into metrics, a new
+        metrics.Metrics if not given. Returns it
+        '''
+        if metrics is None:
+            from metrics import Metrics
+            metrics = Metrics(self.network or self.HOST)
+        metrics.gauge("sendq",self.sendq.__len__)
+        self.metrics = metrics
+        return metrics
+
+    def disable_metrics(self):
+        self.metrics = None
+
+    def flush(self,timeout=2):
+        '''
+        Wait until everything queued has been sent, for example a QUIT
+        before we exit. Returns False if it timed out
+        '''
+        return self.sendq.join(timeout)
+
+    def dispatch(self,lines):
+        '''
+        Parse a batch of complete lines, as received in one read, and hand
+        them to incoming. A line which makes a handler raise is printed and
+        skipped
+        '''
+        for line in lines:
+            try:
+                msg = parse_message(line)
+            # Blank keep-alive lines from some servers
+            except ValueError:
+                continue
+            try:
+                self.incoming(msg)
+            # Dropping the connection wouldn't help, the server would likely
+            # send the same line again after the reconnect
+            except Exception:
+                print(f"Error handling {line!r}",file=sys.stderr)
+                traceback.print_exc()
  
     def login(self,NICK,USER,RNAME=None):
         '''
@@ -145,216 +698,491 @@ class IrcCon(object):
         else:
             self.RNAME = NICK
         if self.connected:
-            self.sckt.send(bytes(f"NICK {self.NICK}\r\n","UTF-8"))
             # We haven't already submitted a username of client
             if not self.userDone:
-                self.sckt.send(bytes(f"USER {self.USER} {self.USER} {self.USER}: {self.RNAME}\r\n","UTF-8"))
+                lines = [f"NICK {self.NICK}",f"USER {self.USER} {self.USER} {self.USER}: {self.RNAME}"]
+                # The capabilities are negotiated first so they're on, and
+                # we're logged in, before 001
+                if self.wantCaps or self.sasl:
+                    self.negotiating = True
+                    lines.insert(0,"CAP LS 302")
+                # All in one write, the server answers them in one go
+                self.send_lines(lines,priority=True)
                 self.userDone = True
+            else:
+                self.send_raw(f"NICK {self.NICK}")
             self.failedLogin = False
         else:
             self.on_error("ConnectionRefusedError")
     
-    def incoming(self,line):
+    def register_handler(self,command,handler):
+        '''
+        Handle a command or numeric with handler, replacing any existing one
+
+        Parameters:
+        -----------
+        command : str
+            The command such as "PRIVMSG" or numeric such as "001"
+        handler : func
+            Called as handler(msg) with the IrcMessage
+
+        Returns:
+        --------
+        The previous handler or None, so a subclass can wrap it
         '''
-        Process incoming messages
+        command = command.upper()
+        old = self.handlers.get(command)
+        self.handlers[command] = handler
+        return old
+
+    def unregister_handler(self,command):
+        '''
+        Stop handling command, it will go to handle_unknown instead
+        '''
+        self.handlers.pop(command.upper(),None)
+
+    def incoming(self,msg):
         '''
+        Process an incoming message, msg is an IrcMessage
+        '''
+        handler = self.handlers.get(msg.command,self.handle_unknown)
+        self.message = msg
+        metrics = self.metrics
+        # Without metrics all this costs is the check above
+        if metrics is not None:
+            start = time.perf_counter()
         try:
-            # Handle pinging
-            if line[0] == "PING":
-                self.sckt.send(bytes(f"PONG {line[1]}\r\n","UTF-8"))
-            # Ignore things such as 
-            # :test3!~u@szawf88ssv98q.irc JOIN #test
-            elif self.NICK + "!" in line[0]:
-                pass
-            # Nick non existent in format:
-            # :host 401 NICK ATTEMPTEDNICK :No such nick
-            elif line[1] == "401":
-                self.on_invalid_nick()
-            # TODO Invalid channel
-            # Channel non existent in format:
-            # :host 403 NICK CHAN :No such channel
-            elif line[1] == "403":
-                pass
-            # Nickname in use, format:
-            # :host 443 * AttemptedNICK :Nickname is already in use
-            elif line[1] == "433":
-                self.on_error("NickInUse")
-            # Private and channel message in format:
-            # :nick!~username@hostname PRIVMSG NICK/CHAN :msg
-            elif line[1] == "PRIVMSG":
-                who = line[0].split("!")
-                who = who[0].lstrip(":")
-                channel = line[2]
-                msg = ' '.join(line[3:])
-                #msg = msg.lstrip(":")
-                msg = msg[1:]
-                self.on_message(who,channel,msg)
-            elif "NickServ" in line[0]:
-                line = line[3:]
-                line = ' '.join(line)
-                line = line[1:]
-                self.on_nickserv(line)
-            # Notice message in format:
-            # :host NOTICE nick/chan :msg
-            elif line[1] == "NOTICE":
-                notice = ' '.join(line[3:])
-                #notice.lstrip(":")
-                notice = notice[1:]
-                who = line[2]
-                if who == self.NICK or who == "*":
-                    self.on_notice("info",notice)
-                else:
-                    self.on_notice(who,notice)
-            # Join message in format:
-            # :nick!user@hostname JOIN chan
-            # Note: it can also be :chan
-            elif line[1] == "JOIN":
-                who = line[0].split("!")
-                hostname = who[1]
-                who = who[0].lstrip(":")
-                channel = line[2]
-                channel = channel.lstrip(":")
-                self.on_user_join(who,channel,hostname)
-            # Part message in format:
-            # :nick!user@hostname PART chan
-            elif line[1] == "PART":
-                who = line[0].split("!")
-                hostname = who[1]
-                who = who[0].lstrip(":")
-                channel = line[2]
-                channel = channel.lstrip(":")
-                self.on_user_part(who,channel,hostname)
-            # Nick message in format:
-            # :nick!user@hostname NICK newnick
-            elif line[1] == "NICK":
-                #:talhah!~u@szawf88ssv98q.irc NICK test1
-                who = line[0].split("!")
-                hostname = who[1]
-                who = who[0].lstrip(":")
-                newNick = line[2]
-                # Ignore our own name change
-                if newNick != self.NICK:
-                    self.on_user_nick_change(who,newNick)
-            # Quit message in format:
-            #:nick!user@hostname QUIT :Quit: Message
-            elif line[1] == "QUIT":
-                who = line[0].split("!")
-                hostname = who[1]
-                who = who[0].lstrip(":")
-                if line[2] == ":Quit:":
-                    msg = ' '.join(line[3:])
-                else:
-                    msg = ' '.join(line[2:])
-                    msg.lstrip(":")
-                self.on_user_quit(who,hostname,msg)
-            # End of whois list message in format:
-            # :host 318
-            elif line[1] == "318":
-                self.startWhoList = False
-            elif line[1] == "311":
-                self.startWhoList = True
-                self.on_whois(line)
-            elif self.startWhoList:
-                self.on_whois(line)
-            # End of names list message in format:
-            # :host 366 nick chan :End of /NAMES list.
-            elif "366" in line:
-                self.startNames = False
-                self.end_names(self.namesChan)
-            # Names list message for a channel in format:
-            # :host 353 nick = #chan :names
-            # It's important to note the list may come as multiple 353 messages
-            # so we need to build list and only stop once we get 366
-            elif line[1] == "353" or self.startNames:
-                if not self.startNames:
-                    self.namesChan = line[4]
-                self.startNames = True
-                names = line[5:]
-                if line[1] != "353":
-                    names = line
-                self.on_names(self.namesChan, names)
-            # Topic message for a channel without topic:
-            # :host 331 nick chan :No topic is set
-            elif line[1] == "331":
-                chan = line[3]
-                self.on_topic(chan,"No topic is set")
-            # Topic message for a channel in format:
-            # :host 332 nick chan :topic
-            elif line[1] == "332":
-                chan = line[3]
-                topic = ' '.join(line[4:])
-                topic = topic[1:]
-                self.on_topic(chan,topic)
-            # Ignore RPL_TOPICTIME
-            elif line[1] == "333":
-                pass
-            elif line[1] == "322":
-                channel = line[3]
-                member = line[4]
-                self.on_list(channel,member)
-            else:
-                line = line[3:]
-                line = ' '.join(line)
-                if line.startswith(":"):
-                    # Strip leading colon
-                    line = line[1:]
-                self.unknown_message(line) 
+            handler(msg)
         # Sometimes we get IndexError
         except IndexError:
-            line = line[3:]
-            line = ' '.join(line)
-            line = line[1:]
-            self.unknown_message(line)
+            self.unknown_message(' '.join(msg.params[1:]))
+        if metrics is not None:
+            metrics.handled(msg.command,getattr(handler,"__name__","handler"),time.perf_counter() - start)
+
+    # Handle pinging
+    def handle_ping(self,msg):
+        self.send_raw(f"PONG {msg.params[0]}",priority=True)
+
+    # The answer to one of our lag probes, see check_lag
+    def handle_pong(self,msg):
+        token = msg.params[-1]
+        if not token.startswith(PREFIX):
+            self.handle_unknown(msg)
+            return
+        lag = self.lag.pong(token,time.monotonic())
+        if lag is not None and self.metrics is not None:
+            self.metrics.observe("lag",lag)
+
+    # RPL_WELCOME, registration is done
+    def handle_welcome(self,msg):
+        self.registered = True
+        self.backoff.reset()
+        # Servers without CAP just ignore it
+        if self.negotiating:
+            self.negotiating = False
+            if self.sasl:
+                self.sasl_failed("The server doesn't support CAP")
+        self.handle_unknown(msg)
+        # SASL didn't work out, try NickServ
+        if self.identify:
+            (account,password) = self.identify
+            self.nickserv("IDENTIFY",[account or self.NICK,password])
+            self.identify = None
+
+    def set_sasl(self,mechanism,account=None,password=None,fallback=True):
+        '''
+        Log in to our account with SASL while registering, see
+        https://ircv3.net/specs/extensions/sasl-3.1
+
+        Parameters:
+        -----------
+        mechanism : str
+            PLAIN with account and password, or EXTERNAL with the TLS client
+            certificate in certfile and keyfile
+        account : str
+            Account name, defaults to the nick
+        password : str
+            Account password for PLAIN, also used for the NickServ fallback
+        fallback : bool
+            If SASL fails, IDENTIFY to NickServ with the password after 001
+
+        Calls:
+        ------
+        self.on_sasl_success(account) or self.on_sasl_failure(reason)
+        '''
+        mechanism = mechanism.upper()
+        if mechanism not in ("PLAIN","EXTERNAL"):
+            raise ValueError(f"Unsupported SASL mechanism {mechanism}")
+        if mechanism == "PLAIN" and not password:
+            raise ValueError("SASL PLAIN needs a password")
+        self.sasl = (mechanism,account,password)
+        self.saslFallback = fallback
+
+    def reset_caps(self):
+        # Capabilities the server enabled
+        self.caps = set()
+        # Name -> value of what the server offers, from CAP LS
+        self.capsOffered = dict()
+        # CAP REQs not answered yet
+        self.capPending = 0
+        # Between CAP LS and CAP END
+        self.negotiating = False
+        # None, "started" or "done" for this connection's SASL login
+        self.saslState = None
+        # The account we're logged in as, from RPL_LOGGEDIN
+        self.account = None
+        # (account,password) to IDENTIFY with after 001 when SASL failed
+        self.identify = None
+
+    # Capability negotiation in format:
+    # :host CAP nick LS * :multi-prefix sasl=PLAIN,EXTERNAL (* if more follow)
+    # :host CAP nick ACK :multi-prefix
+    # also NAK, and NEW and DEL when the server's capabilities change. The CAP
+    # lines skip the flood control, they'd use up the tokens the JOINs after
+    # registration need
+    def handle_cap(self,msg):
+        sub = msg.params[1].upper()
+        caps = parse_caps(msg.params[-1])
+        if sub == "LS" or sub == "NEW":
+            self.capsOffered.update(caps)
+            # More LS lines follow
+            if sub == "LS" and len(msg.params) > 3 and msg.params[2] == "*":
+                return
+            offered = self.capsOffered if sub == "LS" else caps
+            wantCaps = self.wantCaps + ["sasl"] if self.sasl else self.wantCaps
+            wanted = [cap for cap in wantCaps if cap in offered and cap not in self.caps]
+            if wanted:
+                self.capPending += 1
+                self.send_raw(f"CAP REQ :{' '.join(wanted)}",priority=True)
+            elif sub == "LS":
+                self.caps_done()
+        elif sub == "ACK":
+            for cap in caps:
+                if cap.startswith("-"):
+                    self.caps.discard(cap[1:])
+                else:
+                    self.caps.add(cap)
+            self.cap_answered()
+        elif sub == "NAK":
+            self.cap_answered()
+        elif sub == "DEL":
+            for cap in caps:
+                self.caps.discard(cap)
+                self.capsOffered.pop(cap,None)
+
+    def cap_answered(self):
+        self.capPending -= 1
+        if self.capPending <= 0 and self.negotiating:
+            self.caps_done()
+
+    def caps_done(self):
+        '''
+        Everything asked for was answered, log in with SASL if we should
+        and finish the negotiation
+        '''
+        if self.sasl and self.saslState is None:
+            mechanism = self.sasl[0]
+            # sasl=PLAIN,EXTERNAL lists the mechanisms, older servers don't
+            offered = self.capsOffered.get("sasl")
+            if "sasl" not in self.caps:
+                self.sasl_failed("The server doesn't support SASL")
+            elif offered and mechanism not in offered.split(","):
+                self.sasl_failed(f"The server doesn't support SASL {mechanism}, only {offered}")
+            else:
+                self.saslState = "started"
+                self.send_raw(f"AUTHENTICATE {mechanism}",priority=True)
+                # CAP END once it succeeded or failed
+                return
+        self.end_caps()
+
+    def end_caps(self):
+        self.negotiating = False
+        self.send_raw("CAP END",priority=True)
+        self.on_caps(self.caps)
+
+    # SASL in format:
+    # AUTHENTICATE PLAIN from us, the server answers AUTHENTICATE + and we send
+    # the base64 of account\0account\0password in lines of at most 400 bytes
+    def handle_authenticate(self,msg):
+        if self.saslState != "started" or msg.params[0] != "+":
+            return
+        (mechanism,account,password) = self.sasl
+        if mechanism == "EXTERNAL":
+            # The certificate says who we are
+            self.send_raw("AUTHENTICATE +",priority=True)
+            return
+        account = account or self.NICK
+        payload = base64.b64encode(f"{account}\0{account}\0{password}".encode("UTF-8")).decode("ascii")
+        lines = [f"AUTHENTICATE {payload[i:i + 400]}" for i in range(0,len(payload),400)]
+        # A last line of exactly 400 needs an empty one after it
+        if len(payload) % 400 == 0:
+            lines.append("AUTHENTICATE +")
+        self.send_lines(lines,priority=True)
+
+    # :host 900 nick nick!user@host account :You are now logged in as account
+    def handle_logged_in(self,msg):
+        self.account = msg.params[2]
+        self.handle_unknown(msg)
+
+    def handle_sasl_success(self,msg):
+        if self.saslState != "started":
+            return
+        self.saslState = "done"
+        self.on_sasl_success(self.account or self.sasl[1] or self.NICK)
+        self.end_caps()
+
+    def handle_sasl_fail(self,msg):
+        if self.saslState != "started":
+            return
+        self.sasl_failed(msg.params[-1])
+        self.end_caps()
+
+    def sasl_failed(self,reason):
+        self.saslState = "done"
+        (mechanism,account,password) = self.sasl
+        if self.saslFallback and password:
+            self.identify = (account,password)
+        self.on_sasl_failure(reason)
+
+    # away-notify in format:
+    # :nick!user@host AWAY :reason and without a reason when they're back
+    def handle_away(self,msg):
+        self.on_user_away(msg.nick,msg.params[0] if msg.params else None)
+
+    def handle_ignore(self,msg):
+        pass
+
+    # Nick non existent in format:
+    # :host 401 NICK ATTEMPTEDNICK :No such nick
+    def handle_invalid_nick(self,msg):
+        self.on_invalid_nick()
+
+    # Nickname in use, format:
+    # :host 443 * AttemptedNICK :Nickname is already in use
+    def handle_nick_in_use(self,msg):
+        self.on_error("NickInUse")
+
+    # Private and channel message in format:
+    # :nick!~username@hostname PRIVMSG NICK/CHAN :msg
+    def handle_privmsg(self,msg):
+        if msg.nick == self.NICK:
+            # Our own message sent back with echo-message
+            if "echo-message" in self.caps:
+                self.on_echo(msg.params[0],msg.params[1])
+            return
+        self.on_message(msg.nick,msg.params[0],msg.params[1])
+
+    # Notice message in format:
+    # :host NOTICE nick/chan :msg
+    def handle_notice(self,msg):
+        if msg.nick == self.NICK:
+            return
+        if msg.nick == "NickServ":
+            self.on_nickserv(msg.params[-1])
+            return
+        who = msg.params[0]
+        if who == self.NICK or who == "*":
+            self.on_notice("info",msg.params[1])
+        else:
+            self.on_notice(who,msg.params[1])
+
+    # Join message in format:
+    # :nick!user@hostname JOIN chan
+    # Note: it can also be :chan
+    # We ignore our own joins such as 
+    # :test3!~u@szawf88ssv98q.irc JOIN #test
+    def handle_join(self,msg):
+        if msg.nick == self.NICK:
+            return
+        burst = self.splits.join(msg.nick,msg.params[0],msg.hostname,msg.tags.get("batch"),time.monotonic())
+        if burst is not None:
+            # Part of a netjoin, shown all at once by on_netjoin
+            if len(burst.events) == 1:
+                self.wake_tick()
+            return
+        self.on_user_join(msg.nick,msg.params[0],msg.hostname)
+
+    # Part message in format:
+    # :nick!user@hostname PART chan
+    def handle_part(self,msg):
+        if msg.nick == self.NICK:
+            return
+        self.release(msg.nick)
+        self.on_user_part(msg.nick,msg.params[0],msg.hostname)
+
+    # Nick message in format:
+    # :nick!user@hostname NICK newnick
+    def handle_nick(self,msg):
+        newNick = msg.params[0]
+        # Ignore our own name change
+        if msg.nick == self.NICK or newNick == self.NICK:
+            return
+        self.release(msg.nick)
+        self.on_user_nick_change(msg.nick,newNick)
+
+    # Quit message in format:
+    #:nick!user@hostname QUIT :Quit: Message
+    def handle_quit(self,msg):
+        if msg.nick == self.NICK:
+            return
+        self.release(msg.nick)
+        reason = msg.params[0] if msg.params else ""
+        if reason.startswith("Quit: "):
+            reason = reason[6:]
+        else:
+            burst = self.splits.quit(msg.nick,msg.hostname,reason,msg.tags.get("batch"),time.monotonic())
+            # Part of a netsplit, shown all at once by on_netsplit. The first
+            # of a burst needs tick to look at it soon
+            if burst is not None:
+                if len(burst.events) == 1:
+                    self.wake_tick()
+                return
+        self.on_user_quit(msg.nick,msg.hostname,reason)
+
+    # IRCv3 batches in format:
+    # :host BATCH +ref netsplit server1 server2 and later :host BATCH -ref
+    # Only netsplit and netjoin are gathered, the lines of any other batch
+    # are handled as usual
+    def handle_batch(self,msg):
+        ref = msg.params[0]
+        if ref.startswith("+") and len(msg.params) >= 4 and msg.params[1].lower() in ("netsplit","netjoin"):
+            self.splits.batch_start(ref[1:],msg.params[1].lower(),(msg.params[2],msg.params[3]),time.monotonic())
+        elif ref.startswith("-"):
+            burst = self.splits.batch_end(ref[1:])
+            if burst is not None:
+                self.burst(burst)
+
+    # Server features in format:
+    # :host 005 nick CASEMAPPING=rfc1459 PREFIX=(ov)@+ :are supported by this server
+    def handle_isupport(self,msg):
+        features = dict()
+        for token in msg.params[1:-1]:
+            (key,_,value) = token.partition("=")
+            # -KEY means the server no longer supports it
+            if key.startswith("-"):
+                self.isupport.pop(key[1:],None)
+                continue
+            features[key] = value
+        self.isupport.update(features)
+        if "CASEMAPPING" in features:
+            self.splits.configure(features["CASEMAPPING"])
+        self.on_isupport(features)
+        # Still show them like before
+        self.handle_unknown(msg)
+
+    # Start of whois list, everything up to the 318 belongs to it
+    def handle_whois_start(self,msg):
+        self.startWhoList = True
+        self.on_whois(msg)
+
+    # End of whois list message in format:
+    # :host 318
+    def handle_whois_end(self,msg):
+        self.startWhoList = False
+
+    # Names list message for a channel in format:
+    # :host 353 nick = #chan :names
+    # It's important to note the list may come as multiple 353 messages
+    # so we need to build list and only stop once we get 366
+    def handle_names(self,msg):
+        channel = msg.params[2]
+        names = msg.params[3].split()
+        pending = self.pendingNames.get(channel)
+        if pending is None:
+            self.pendingNames[channel] = names
+        else:
+            pending.extend(names)
+        self.on_names(channel,names)
+
+    # End of names list message in format:
+    # :host 366 nick chan :End of /NAMES list.
+    def handle_end_names(self,msg):
+        channel = msg.params[1]
+        self.end_names(channel,self.pendingNames.pop(channel,[]))
+
+    # Topic message for a channel without topic:
+    # :host 331 nick chan :No topic is set
+    def handle_no_topic(self,msg):
+        self.on_topic(msg.params[1],"No topic is set")
+
+    # Topic message for a channel in format:
+    # :host 332 nick chan :topic
+    def handle_topic(self,msg):
+        self.on_topic(msg.params[1],msg.params[2])
+
+    # Channel list entry in format:
+    # :host 322 nick chan members :topic
+    def handle_list(self,msg):
+        self.on_list(msg.params[1],msg.params[2])
+
+    def handle_unknown(self,msg):
+        # Whois replies come as many different numerics, catch them all
+        if self.startWhoList:
+            self.on_whois(msg)
+        # Ignore anything else we caused ourselves, like our own MODE
+        elif msg.nick != self.NICK:
+            self.unknown_message(' '.join(msg.params[1:]))
 
     # Join a channel 
     def join(self,channel,key=None):
         if key:
-            self.sckt.send(bytes(f"JOIN {channel} {key}\r\n","UTF-8"))
+            self.send_raw(f"JOIN {channel} {key}")
         if channel in self.channels:
             self.on_error("AlreadyInChan")
         else:
             self.channels.add(channel)
-        self.sckt.send(bytes(f"JOIN {channel}\r\n","UTF-8"))
+        return self.send_raw(f"JOIN {channel}")
 
     # Part a channel
     def part(self,channel):
         self.channels.remove(channel)
-        self.sckt.send(bytes(f"PART {channel}\r\n","UTF-8"))
+        return self.send_raw(f"PART {channel}")
 
     # Message an individual or channel
     def privmsg(self,who,msg):
-        self.sckt.send(bytes(f"PRIVMSG {who} :{msg}\r\n","UTF-8"))
+        return self.send_raw(f"PRIVMSG {who} :{msg}")
     
     # Whois info for a user
     def whois(self,who):
-        self.sckt.send(bytes(f"WHOIS {who}\r\n","UTF-8"))
+        return self.send_raw(f"WHOIS {who}")
     
     # Indicate to server that client is quitting
     def quitC(self,msg=None):
         if not msg:
             msg = self.NICK
-        self.sckt.send(bytes(f"QUIT :{msg}\r\n","UTF-8"))
+        return self.send_raw(f"QUIT :{msg}",priority=True)
 
     # Reconnect to the IRC server
     def reconnect(self):
-        self.sckt.shutdown(socket.SHUT_RDWR)
-        self.sckt.close()
-        self.sckt = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        # First, so the receive thread doesn't take it for a broken one
         self.connected = False
+        self.shutdown()
+        self.sckt = self.new_socket()
+        # Drop what was meant for the old connection, also lets its writer
+        # thread finish
+        self.sendq.reset()
         self.userDone = False
-        self.connect(self.HOST,self.PORT)
+        self.connect(self.HOST,self.PORT,self.SSL)
         self.login(self.NICK,self.USER,self.RNAME)
 
     # Disconnect from the IRC server, TODO ensure this works
     def disconnect(self):
-        self.sckt.shutdown(socket.SHUT_RDWR)
-        self.sckt.close()
-        self.sckt = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
-        self.userDone = False
         self.connected = False
+        self.shutdown()
+        self.sckt = self.new_socket()
+        self.sendq.reset()
+        self.userDone = False
+
+    # Close the socket, the server may have already dropped it
+    def shutdown(self):
+        try:
+            self.sckt.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sckt.close()
 
     def listChan(self):
-        self.sckt.send(bytes("LIST\r\n","UTF-8"))
+        return self.send_raw("LIST")
 
     # Nickserv handling
     def nickserv(self,action,data):
@@ -362,19 +1190,24 @@ class IrcCon(object):
             if action == "REGISTER":
                 password = data[0]
                 email = data[1]
-                msg = f"NICKSERV REGISTER {password} {email}\r\n"
+                msg = f"NICKSERV REGISTER {password} {email}"
             if action == "IDENTIFY":
-                password = data[0]
-                msg = f"NICKSERV IDENTIFY {self.NICK} {password}\r\n"
+                # IDENTIFY password for the account of our nick, or
+                # IDENTIFY account password
+                if len(data) >= 2:
+                    (account,password) = data[:2]
+                else:
+                    (account,password) = (self.NICK,data[0])
+                msg = f"NICKSERV IDENTIFY {account} {password}"
             if action == "LOGOUT":
-                msg = f"NICKSERV LOGOUT\r\n"
+                msg = f"NICKSERV LOGOUT"
             if action == "DROP":
                 nick = data[0]
-                msg = f"NICKSERV DROP {nick}\r\n"
+                msg = f"NICKSERV DROP {nick}"
             if action == "VERIFY":
                 pin = data[1]
-                msg = f"NICKSERV VERIFY REGISTER {pin}\r\n"
-            self.sckt.send(bytes(msg,"UTF-8"))
+                msg = f"NICKSERV VERIFY REGISTER {pin}"
+            return self.send_raw(msg)
         # Fail silently for any errors
         except:
             pass
@@ -382,6 +1215,7 @@ class IrcCon(object):
     def on_connect(self):
         pass
 
+    # The server closed the connection or went silent, see check_lag
     def on_connection_broken(self):
         pass
 
@@ -396,6 +1230,39 @@ class IrcCon(object):
 
     def on_user_quit(self,who,hostname,msg):
         pass
+
+    # Called with the set of enabled capabilities once negotiated
+    def on_caps(self,caps):
+        pass
+
+    # Logged in to account with SASL, see set_sasl
+    def on_sasl_success(self,account):
+        pass
+
+    # SASL login failed, NickServ is tried after 001 if set_sasl said so
+    def on_sasl_failure(self,reason):
+        pass
+
+    # Someone went away with a reason, or is back if it's None. Needs
+    # away-notify
+    def on_user_away(self,who,reason):
+        pass
+
+    # A message of ours as the server saw it, needs echo-message
+    def on_echo(self,target,msg):
+        pass
+
+    # Everyone who quit in a netsplit between the two servers, quits is a list
+    # of (nick,hostname)
+    def on_netsplit(self,servers,quits):
+        for (who,hostname) in quits:
+            self.on_user_quit(who,hostname,' '.join(servers))
+
+    # Everyone who came back after a netsplit, joins is a list of
+    # (nick,channel,hostname)
+    def on_netjoin(self,servers,joins):
+        for (who,channel,hostname) in joins:
+            self.on_user_join(who,channel,hostname)
     
     def on_nickserv(self,msg):
         pass
@@ -412,8 +1279,13 @@ class IrcCon(object):
 
     def on_names(self,channel,namesChan):
         pass
+
+    # Called with the features from each 005, self.isupport has all of them
+    def on_isupport(self,features):
+        pass
     
-    def end_names(self,channel):
+    # Called once the whole names list of a channel is in
+    def end_names(self,channel,names):
         pass
 
     def on_invalid_nick(self):
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the LagMeter which measures the lag to the server. Every so
+often we PING the server with a token of our own and time how long the PONG
+with that token takes. A server which doesn't say anything at all for TIMEOUT
+seconds, not even the PONG, is taken to be gone so we can reconnect straight
+away instead of waiting minutes for TCP to give up.
+
+The Backoff spaces out the reconnects, a server which takes the connection and
+drops it again (a K-line, throttling) shouldn't be hammered.
+'''
+import itertools
+import random
+import time
+from metrics import Histogram
+
+# Seconds between probes
+INTERVAL = 30
+# Seconds of silence before the connection is taken to be dead
+TIMEOUT = 120
+# Weight of the newest measurement in the moving average
+ALPHA = 0.25
+# Tokens we PING with start with this, a PONG without it isn't ours
+PREFIX = "slick-"
+# Upper bounds of the lag histogram buckets in seconds
+BUCKETS = [0.01,0.02,0.05,0.1,0.2,0.5,1.0,2.0,5.0,10.0,30.0]
+# Seconds before the first reconnect, doubled for every one after it until we
+# get as far as 001, up to RECONNECT_MAX
+RECONNECT_FIRST = 2
+RECONNECT_MAX = 300
+
+class LagMeter(object):
+    '''
+    Lag of one connection, the IrcCon tells it when it heard from the server
+    and asks it when to probe, see IrcCon.check_lag
+
+    Methods:
+        probe(now)
+            a token to PING the server with, or None if it's not time yet
+        pong(token,now)
+            the server answered, returns the lag or None if it's not ours
+        due(now,probing=True)
+            seconds until something needs checking, without probing only
+            the timeout counts
+        dead(now)
+            True if we haven't heard from the server for timeout seconds
+        current(now)
+            the lag to show, it grows while a PONG is overdue
+        reset(now)
+            start over on a new connection
+    '''
+    def __init__(self,interval=INTERVAL,timeout=TIMEOUT):
+        self.interval = interval
+        self.timeout = timeout
+        self.tokens = itertools.count(1)
+        self.histogram = Histogram(BUCKETS)
+        self.reset()
+
+    def reset(self,now=None):
+        now = time.monotonic() if now is None else now
+        # Set by the IrcCon on every read, anything shows the link is alive
+        self.lastHeard = now
+        self.token = None
+        self.sentAt = None
+        self.nextProbe = now + self.interval
+        self.last = None
+        self.average = None
+
+    def probe(self,now):
+        if now < self.nextProbe:
+            return None
+        self.nextProbe = now + self.interval
+        # One at a time, an overdue PONG already shows up as lag. Unless it
+        # never came, then the server lost it
+        if self.token is not None and now - self.sentAt < self.timeout:
+            return None
+        self.token = f"{PREFIX}{next(self.tokens)}"
+        self.sentAt = now
+        return self.token
+
+    def pong(self,token,now):
+        if token != self.token:
+            return None
+        lag = now - self.sentAt
+        self.token = None
+        self.sentAt = None
+        self.last = lag
+        if self.average is None:
+            self.average = lag
+        else:
+            self.average += ALPHA * (lag - self.average)
+        self.histogram.observe(lag)
+        return lag
+
+    def due(self,now,probing=True):
+        deadline = self.lastHeard + self.timeout
+        if probing:
+            deadline = min(deadline,self.nextProbe)
+        return max(0,deadline - now)
+
+    def dead(self,now):
+        return now - self.lastHeard >= self.timeout
+
+    def current(self,now=None):
+        now = time.monotonic() if now is None else now
+        if self.sentAt is not None and (self.last is None or now - self.sentAt > self.last):
+            return now - self.sentAt
+        return self.last
+
+    def report(self):
+        '''
+        Lines of text describing the lag so far
+        '''
+        if self.last is None:
+            return ["No lag measured yet"]
+        h = self.histogram
+        return [f"Lag {self.last * 1000:.0f} ms, average {self.average * 1000:.0f} ms over {h.count} probes, "
+            + f"p50 <= {h.percentile(0.5) * 1000:.0f} ms, p99 <= {h.percentile(0.99) * 1000:.0f} ms"]
+
+class Backoff(object):
+    '''
+    Delays between reconnects, reset once the server welcomed us
+
+    Methods:
+        next()
+            seconds to wait before the next reconnect, half to all of the
+            current delay so many clients dropped at once don't come back at
+            once
+        reset()
+            the next reconnect waits RECONNECT_FIRST again
+    '''
+    def __init__(self,first=RECONNECT_FIRST,most=RECONNECT_MAX):
+        self.first = first
+        self.most = most
+        self.reset()
+
+    def reset(self):
+        self.delay = None
+
+    def next(self):
+        if self.delay is None:
+            self.delay = self.first
+        else:
+            self.delay = min(self.delay * 2,self.most)
+        return random.uniform(self.delay / 2,self.delay)
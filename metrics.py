@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the metrics of a connection: bytes and lines in and out,
+how often each command came in, how long each handler took and the depth of
+the queues. An IrcCon only collects them once metrics are enabled, otherwise
+the cost is checking an attribute for None. They can be shown with /stats or
+written out every so often as JSON or, for a file name ending in .prom, in the
+Prometheus text format for node_exporter's textfile collector.
+
+The counters are updated from the receive thread without a lock, a read may
+be off by the odd line which is fine for what they're for.
+'''
+import bisect
+import json
+import os
+import threading
+import time
+
+# Upper bounds of the latency buckets in seconds, 1us to 1s
+BUCKETS = [float(f"{m}e{e}") for e in range(-6,0) for m in (1,2,5)] + [1.0]
+
+class Histogram(object):
+    '''
+    Counts of observed durations per bucket, bounds are the upper bounds of
+    the buckets and default to BUCKETS
+    '''
+    __slots__ = ("bounds","counts","sum","count")
+
+    def __init__(self,bounds=BUCKETS):
+        self.bounds = bounds
+        # One more for anything over the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self,seconds):
+        self.counts[bisect.bisect_left(self.bounds,seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def percentile(self,p):
+        '''
+        Upper bound of the bucket holding the p'th observation, None if
+        nothing was observed, inf if it's past the last bucket
+        '''
+        if not self.count:
+            return None
+        target = p * self.count
+        seen = 0
+        for (i,n) in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return self.bounds[i] if i < len(self.bounds) else float("inf")
+        return float("inf")
+
+    def snapshot(self):
+        return {"count": self.count,"sum": self.sum,"buckets": list(self.counts)}
+
+class Metrics(object):
+    '''
+    Methods:
+        inbound(nbytes,nlines), outbound(nbytes), sent_line()
+            count traffic
+        handled(command,handler,seconds)
+            a line was handled
+        observe(name,seconds)
+            add a duration to the histogram name, eg. the GUI updates
+        inc(name,n=1)
+            add to a counter
+        gauge(name,func)
+            func() gives the current value of name, eg. a queue depth
+        snapshot()
+            everything as a dict
+        report()
+            lines of text for /stats
+    '''
+    def __init__(self,network=None):
+        self.network = network
+        self.started = time.monotonic()
+        self.counters = {"bytes_in": 0,"lines_in": 0,"bytes_out": 0,"lines_out": 0}
+        self.commands = dict()
+        self.handlers = dict()
+        self.histograms = dict()
+        self.gauges = dict()
+
+    def inbound(self,nbytes,nlines):
+        counters = self.counters
+        counters["bytes_in"] += nbytes
+        counters["lines_in"] += nlines
+
+    def outbound(self,nbytes):
+        self.counters["bytes_out"] += nbytes
+
+    def sent_line(self):
+        self.counters["lines_out"] += 1
+
+    def handled(self,command,handler,seconds):
+        self.commands[command] = self.commands.get(command,0) + 1
+        histogram = self.handlers.get(handler)
+        if histogram is None:
+            histogram = self.handlers[handler] = Histogram()
+        histogram.observe(seconds)
+
+    def observe(self,name,seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def inc(self,name,n=1):
+        self.counters[name] = self.counters.get(name,0) + n
+
+    def gauge(self,name,func):
+        self.gauges[name] = func
+
+    def gauge_values(self):
+        values = dict()
+        for (name,func) in list(self.gauges.items()):
+            try:
+                values[name] = func()
+            # Whatever it measured is gone, eg. a closed window
+            except Exception:
+                values[name] = None
+        return values
+
+    def snapshot(self):
+        return {
+            "network": self.network,
+            "uptime": time.monotonic() - self.started,
+            "counters": dict(self.counters),
+            "commands": dict(self.commands),
+            "handlers": {name: h.snapshot() for (name,h) in list(self.handlers.items())},
+            "histograms": {name: h.snapshot() for (name,h) in list(self.histograms.items())},
+            "gauges": self.gauge_values(),
+            "buckets": BUCKETS,
+        }
+
+    def report(self):
+        uptime = max(time.monotonic() - self.started,1e-9)
+        c = self.counters
+        lines = [f"Up {uptime:.0f} s, in {c['lines_in']} lines {c['bytes_in']} bytes ({c['lines_in'] / uptime:.1f} lines/s), "
+            + f"out {c['lines_out']} lines {c['bytes_out']} bytes"]
+        top = sorted(self.commands.items(),key=lambda item: item[1],reverse=True)[:10]
+        if top:
+            lines.append("Commands: " + ", ".join(f"{command} {n}" for (command,n) in top))
+        for (kind,histograms) in (("Handler",self.handlers),("Timing",self.histograms)):
+            for (name,h) in sorted(list(histograms.items()),key=lambda item: item[1].sum,reverse=True):
+                lines.append(f"{kind} {name}: {h.count} calls, mean {h.sum / h.count * 1e6:.0f} us, "
+                    + f"p50 <= {usec(h.percentile(0.5))}, p99 <= {usec(h.percentile(0.99))}")
+        gauges = self.gauge_values()
+        if gauges:
+            lines.append("Queues: " + ", ".join(f"{name} {value}" for (name,value) in gauges.items()))
+        return lines
+
+def usec(seconds):
+    if seconds is None:
+        return "-"
+    if seconds == float("inf"):
+        return "> 1 s"
+    return f"{seconds * 1e6:.0f} us"
+
+def labelValue(value):
+    '''
+    Escape a label value for the Prometheus text format, a network or
+    command name could hold a quote or a backslash
+    '''
+    return str(value).replace("\\","\\\\").replace('"','\\"').replace("\n","\\n")
+
+def labels(**pairs):
+    pairs = {key: value for (key,value) in pairs.items() if value is not None}
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{labelValue(value)}"' for (key,value) in pairs.items()) + "}"
+
+def prometheus(metricsList):
+    '''
+    The metrics of several connections in the Prometheus text format
+    '''
+    out = []
+    snapshots = [m.snapshot() for m in metricsList]
+    for counter in ("bytes_in","lines_in","bytes_out","lines_out"):
+        out.append(f"# TYPE slickirc_{counter}_total counter")
+        for s in snapshots:
+            out.append(f"slickirc_{counter}_total{labels(network=s['network'])} {s['counters'].get(counter,0)}")
+    out.append("# TYPE slickirc_commands_total counter")
+    for s in snapshots:
+        for (command,n) in s["commands"].items():
+            out.append(f"slickirc_commands_total{labels(network=s['network'],command=command)} {n}")
+    for (metric,key,label) in (("slickirc_handler_seconds","handlers","handler"),("slickirc_timing_seconds","histograms","name")):
+        out.append(f"# TYPE {metric} histogram")
+        for s in snapshots:
+            for (name,h) in s[key].items():
+                total = 0
+                for (bound,n) in zip(BUCKETS + ["+Inf"],h["buckets"]):
+                    total += n
+                    out.append(f"{metric}_bucket{labels(network=s['network'],**{label: name},le=bound)} {total}")
+                out.append(f"{metric}_sum{labels(network=s['network'],**{label: name})} {h['sum']}")
+                out.append(f"{metric}_count{labels(network=s['network'],**{label: name})} {h['count']}")
+    out.append("# TYPE slickirc_queue_depth gauge")
+    for s in snapshots:
+        for (name,value) in s["gauges"].items():
+            if value is not None:
+                out.append(f"slickirc_queue_depth{labels(network=s['network'],queue=name)} {value}")
+    return "\n".join(out) + "\n"
+
+def export(path,metricsList):
+    '''
+    Write the metrics to path, Prometheus text if it ends in .prom otherwise
+    JSON. The file is replaced in one go so a reader never sees half of it
+    '''
+    if path.endswith(".prom"):
+        text = prometheus(metricsList)
+    else:
+        text = json.dumps([m.snapshot() for m in metricsList],indent=1)
+    tmp = path + ".tmp"
+    with open(tmp,"w") as f:
+        f.write(text)
+    os.replace(tmp,path)
+
+class Exporter(object):
+    '''
+    Exports the metrics every interval seconds on a thread until stop()
+    '''
+    def __init__(self,path,metricsList,interval=15):
+        self.path = path
+        self.metricsList = metricsList
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run,daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                export(self.path,self.metricsList)
+            except OSError:
+                pass
@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the SplitTracker which gathers the QUITs of a netsplit and
+the JOINs of the netjoin that follows into bursts, so they can be applied and
+shown all at once instead of a line and a names list update per user.
+
+A netsplit QUIT has the two servers which lost each other as its reason, eg.
+"hub.example.net leaf.example.net". Those QUITs are collected until none came
+for QUIET seconds, or at most MAXWAIT. The nicks are remembered for a while,
+when they JOIN again it's the netjoin. Servers with the IRCv3 batch capability
+put both in a BATCH netsplit or netjoin, which ends the burst exactly, see
+https://ircv3.net/specs/batches/netsplit
+
+Anything else about a nick with a QUIT or JOIN still held back, say a PART, has
+to wait for it, release hands those over first.
+'''
+import re
+import threading
+from roster import CASEMAPS
+
+# Two server names with at least one dot each, * for hidden ones
+SPLIT = re.compile(r"^([\w*-]+(?:\.[\w*-]+)+) ([\w*-]+(?:\.[\w*-]+)+)$")
+# Seconds without another QUIT or JOIN of the burst before it's done
+QUIET = 0.5
+# Max seconds a burst is held back
+MAXWAIT = 5
+# Seconds the nicks of a split are remembered to notice their netjoin
+REMEMBER = 1800
+
+def split_servers(reason):
+    '''
+    The two servers of a netsplit QUIT reason, None for a normal QUIT
+    '''
+    match = SPLIT.match(reason)
+    if match is None or match.group(1) == match.group(2):
+        return None
+    return (match.group(1),match.group(2))
+
+class Burst(object):
+    '''
+    One netsplit or netjoin, events are (nick,hostname) for a netsplit and
+    (nick,channel,hostname) for a netjoin
+    '''
+    __slots__ = ("kind","servers","events","first","last")
+
+    def __init__(self,kind,servers,now):
+        self.kind = kind
+        self.servers = servers
+        self.events = []
+        self.first = now
+        self.last = now
+
+class SplitTracker(object):
+    '''
+    The receive thread adds the QUITs and JOINs, whatever drives
+    IrcCon.tick collects the finished bursts
+
+    Methods:
+        quit(nick,hostname,reason,batch,now)
+            the Burst the QUIT was added to, None if it's not a netsplit
+        join(nick,channel,hostname,batch,now)
+            the Burst the JOIN was added to, None if it's not a netjoin
+        batch_start(ref,kind,servers,now), batch_end(ref)
+            a BATCH netsplit or netjoin started or ended, batch_end returns
+            its Burst
+        release(nick)
+            the events of nick still held back, as bursts of their own in
+            the order they came
+        configure(casemapping)
+            match nicks with the server's ISUPPORT CASEMAPPING
+        due(now)
+            the bursts which are done
+        next(now)
+            seconds until a burst may be done, None if there are none
+        flush()
+            all the waiting bursts, done or not
+    '''
+    def __init__(self,casemapping="rfc1459"):
+        # (kind,servers) -> Burst, gathered by the QUIT reason
+        self.pending = dict()
+        # BATCH reference -> Burst, ended by the server
+        self.batches = dict()
+        # Case folded nick -> (servers,when) of the splits, for their netjoin
+        self.split = dict()
+        # Case folded nick -> the bursts holding events of theirs, oldest
+        # first
+        self.held = dict()
+        self.casemap = CASEMAPS[casemapping]
+        self.lock = threading.Lock()
+
+    def configure(self,casemapping):
+        if casemapping in CASEMAPS:
+            self.casemap = CASEMAPS[casemapping]
+
+    def fold(self,nick):
+        return nick.translate(self.casemap)
+
+    def quit(self,nick,hostname,reason,batch,now):
+        with self.lock:
+            burst = self.batches.get(batch) if batch is not None else None
+            if burst is None:
+                servers = split_servers(reason)
+                if servers is None:
+                    return None
+                burst = self.burst("netsplit",servers,now)
+            elif burst.kind != "netsplit":
+                return None
+            burst.events.append((nick,hostname))
+            key = self.fold(nick)
+            self.split[key] = (burst.servers,now)
+            self.hold(key,burst)
+            return burst
+
+    def join(self,nick,channel,hostname,batch,now):
+        with self.lock:
+            burst = self.batches.get(batch) if batch is not None else None
+            key = self.fold(nick)
+            if burst is None:
+                # Only nicks we saw split
+                if not self.split:
+                    return None
+                seen = self.split.get(key)
+                if seen is None:
+                    return None
+                (servers,when) = seen
+                if now - when > REMEMBER:
+                    del self.split[key]
+                    return None
+                burst = self.burst("netjoin",servers,now)
+            elif burst.kind != "netjoin":
+                return None
+            burst.events.append((nick,channel,hostname))
+            self.hold(key,burst)
+            return burst
+
+    def hold(self,key,burst):
+        bursts = self.held.get(key)
+        if bursts is None:
+            self.held[key] = [burst]
+        elif bursts[-1] is not burst:
+            bursts.append(burst)
+
+    def burst(self,kind,servers,now):
+        burst = self.pending.get((kind,servers))
+        if burst is None:
+            burst = self.pending[(kind,servers)] = Burst(kind,servers,now)
+        burst.last = now
+        return burst
+
+    def batch_start(self,ref,kind,servers,now):
+        with self.lock:
+            self.batches[ref] = Burst(kind,servers,now)
+
+    def batch_end(self,ref):
+        with self.lock:
+            burst = self.batches.pop(ref,None)
+            if burst is not None:
+                self.done(burst)
+            return burst
+
+    def release(self,nick):
+        if not self.held:
+            return []
+        with self.lock:
+            key = self.fold(nick)
+            bursts = self.held.pop(key,None)
+            if not bursts:
+                return []
+            released = []
+            for burst in bursts:
+                mine = Burst(burst.kind,burst.servers,burst.first)
+                mine.events = [event for event in burst.events if self.fold(event[0]) == key]
+                burst.events = [event for event in burst.events if self.fold(event[0]) != key]
+                # Nothing left to show, a BATCH is still ended by the server
+                if not burst.events and self.pending.get((burst.kind,burst.servers)) is burst:
+                    del self.pending[(burst.kind,burst.servers)]
+                if burst.kind == "netjoin":
+                    self.split.pop(key,None)
+                released.append(mine)
+            return released
+
+    def done(self,burst):
+        for event in burst.events:
+            key = self.fold(event[0])
+            bursts = self.held.get(key)
+            if bursts is not None:
+                if burst in bursts:
+                    bursts.remove(burst)
+                if not bursts:
+                    del self.held[key]
+            # Back in, a later JOIN is an ordinary one
+            if burst.kind == "netjoin":
+                self.split.pop(key,None)
+
+    def due(self,now):
+        if not self.pending:
+            return []
+        with self.lock:
+            ready = [key for (key,burst) in self.pending.items()
+                if now - burst.last >= QUIET or now - burst.first >= MAXWAIT]
+            bursts = [self.pending.pop(key) for key in ready]
+            for burst in bursts:
+                self.done(burst)
+            # Forget old splits now and then
+            if bursts and self.split:
+                self.split = {nick: seen for (nick,seen) in self.split.items() if now - seen[1] <= REMEMBER}
+            return bursts
+
+    def next(self,now):
+        if not self.pending:
+            return None
+        with self.lock:
+            if not self.pending:
+                return None
+            return max(0,min(min(burst.last + QUIET,burst.first + MAXWAIT) for burst in self.pending.values()) - now)
+
+    def flush(self):
+        with self.lock:
+            bursts = list(self.pending.values())
+            self.pending = dict()
+            for burst in bursts:
+                self.done(burst)
+            return bursts
@@ -0,0 +1,276 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the Roster which keeps track of who is in which channel.
+Each channel maps nick -> mode prefix (@, + etc.) and keeps a sorted list for
+the names listbox which is updated in place, and there is an index from each
+nick to the channels they're in. So a QUIT or NICK only touches the channels
+that user is actually in instead of searching every channel.
+'''
+import string
+import threading
+from bisect import bisect_left, insort
+
+# Case mappings from ISUPPORT CASEMAPPING, IRC considers []\~ the upper case
+# of {}|^ for historical reasons
+CASEMAPS = {
+    "ascii": str.maketrans(string.ascii_uppercase,string.ascii_lowercase),
+    "rfc1459": str.maketrans(string.ascii_uppercase + "[]\\~",string.ascii_lowercase + "{}|^"),
+    "strict-rfc1459": str.maketrans(string.ascii_uppercase + "[]\\",string.ascii_lowercase + "{}|"),
+}
+
+# Mode prefixes from ISUPPORT PREFIX, highest rank first
+PREFIXES = "~&@%+"
+
+class ChannelRoster(object):
+    '''
+    Members of one channel
+
+    Attributes:
+        name : str
+            The channel name as the server sent it
+        members : dict
+            Case folded nick -> (prefix, nick)
+        view : list
+            Sorted "prefix+nick" strings, what the names listbox shows
+    '''
+    __slots__ = ("name","members","view")
+
+    def __init__(self,name):
+        self.name = name
+        self.members = dict()
+        self.view = []
+
+    def __len__(self):
+        return len(self.members)
+
+    def insert(self,key,prefix,nick):
+        self.members[key] = (prefix,nick)
+        insort(self.view,prefix + nick)
+
+    def delete(self,key):
+        '''
+        Remove a member, returns their (prefix, nick) or None
+        '''
+        member = self.members.pop(key,None)
+        if member:
+            display = member[0] + member[1]
+            i = bisect_left(self.view,display)
+            if i < len(self.view) and self.view[i] == display:
+                del self.view[i]
+        return member
+
+    def delete_many(self,keys):
+        '''
+        Remove several members with one pass over the view, returns the
+        nicks which were members
+        '''
+        gone = set()
+        nicks = []
+        for key in keys:
+            member = self.members.pop(key,None)
+            if member:
+                gone.add(member[0] + member[1])
+                nicks.append(member[1])
+        if gone:
+            self.view = [display for display in self.view if display not in gone]
+        return nicks
+
+class Roster(object):
+    '''
+    Channel membership for one connection. Changes come from the receive
+    thread while the GUI reads the views, so view returns a copy.
+
+    Methods:
+        configure(casemapping=None,prefixes=None)
+            use the server's ISUPPORT CASEMAPPING and PREFIX
+        set_names(channel,names)
+            replace the members of channel with a NAMES list
+        add(channel,nick,prefix="")
+            someone joined channel
+        remove(channel,nick)
+            someone left channel, returns True if they were in it
+        quit(nick)
+            someone quit, returns the channels they were in
+        quit_many(nicks)
+            many quit at once such as in a netsplit, returns channel ->
+            the nicks who were in it
+        add_many(channel,nicks)
+            many joined channel at once, returns the nicks added
+        rename(nick,newNick)
+            someone changed nick, returns the channels they are in
+        clear(channel)
+            forget a channel, when we part it
+        channels_of(nick)
+            the channels nick is in
+        view(channel)
+            sorted names list of channel, a copy taken under the lock
+    '''
+    def __init__(self,casemapping="rfc1459",prefixes=PREFIXES):
+        self.casemap = CASEMAPS[casemapping]
+        self.prefixes = prefixes
+        # Case folded channel -> ChannelRoster
+        self.channels = dict()
+        # Case folded nick -> set of case folded channels
+        self.nicks = dict()
+        self.lock = threading.RLock()
+
+    def configure(self,casemapping=None,prefixes=None):
+        with self.lock:
+            if casemapping in CASEMAPS:
+                self.casemap = CASEMAPS[casemapping]
+            if prefixes:
+                self.prefixes = prefixes
+            # Keys depend on the case mapping, rebuild what we have
+            old = list(self.channels.values())
+            self.channels = dict()
+            self.nicks = dict()
+            for chan in old:
+                self.set_names(chan.name,[prefix + nick for (prefix,nick) in chan.members.values()])
+
+    def fold(self,name):
+        return name.translate(self.casemap)
+
+    def split(self,name):
+        '''
+        Split "@nick" into ("@", "nick"). With multi-prefix there may be
+        several, only the highest one is kept
+        '''
+        i = 0
+        while i < len(name) and name[i] in self.prefixes:
+            i += 1
+        return (name[:1] if i else "",name[i:])
+
+    def set_names(self,channel,names):
+        with self.lock:
+            key = self.fold(channel)
+            self.clear(channel)
+            chan = ChannelRoster(channel)
+            for name in names:
+                (prefix,nick) = self.split(name)
+                if not nick:
+                    continue
+                nickKey = self.fold(nick)
+                chan.members[nickKey] = (prefix,nick)
+                self.nicks.setdefault(nickKey,set()).add(key)
+            # Sorting once beats inserting thousands of names one by one
+            chan.view = sorted(prefix + nick for (prefix,nick) in chan.members.values())
+            self.channels[key] = chan
+
+    def add(self,channel,nick,prefix=""):
+        with self.lock:
+            key = self.fold(channel)
+            chan = self.channels.get(key)
+            if chan is None:
+                chan = self.channels[key] = ChannelRoster(channel)
+            nickKey = self.fold(nick)
+            chan.delete(nickKey)
+            chan.insert(nickKey,prefix,nick)
+            self.nicks.setdefault(nickKey,set()).add(key)
+
+    def remove(self,channel,nick):
+        with self.lock:
+            key = self.fold(channel)
+            nickKey = self.fold(nick)
+            chan = self.channels.get(key)
+            if chan is None or not chan.delete(nickKey):
+                return False
+            chans = self.nicks.get(nickKey)
+            if chans:
+                chans.discard(key)
+                if not chans:
+                    del self.nicks[nickKey]
+            return True
+
+    def quit(self,nick):
+        with self.lock:
+            nickKey = self.fold(nick)
+            left = []
+            for key in self.nicks.pop(nickKey,()):
+                chan = self.channels[key]
+                chan.delete(nickKey)
+                left.append(chan.name)
+            return left
+
+    def quit_many(self,nicks):
+        with self.lock:
+            # Case folded channel -> case folded nicks to remove
+            leaving = dict()
+            for nick in nicks:
+                nickKey = self.fold(nick)
+                for key in self.nicks.pop(nickKey,()):
+                    leaving.setdefault(key,[]).append(nickKey)
+            left = dict()
+            for (key,nickKeys) in leaving.items():
+                chan = self.channels[key]
+                left[chan.name] = chan.delete_many(nickKeys)
+            return left
+
+    def add_many(self,channel,nicks):
+        with self.lock:
+            key = self.fold(channel)
+            chan = self.channels.get(key)
+            if chan is None:
+                chan = self.channels[key] = ChannelRoster(channel)
+            added = []
+            for nick in nicks:
+                nickKey = self.fold(nick)
+                if nickKey in chan.members:
+                    continue
+                chan.members[nickKey] = ("",nick)
+                self.nicks.setdefault(nickKey,set()).add(key)
+                added.append(nick)
+            # The view is sorted already, sorting it with the new ones
+            # appended is close to a merge
+            if added:
+                chan.view = sorted(chan.view + added)
+            return added
+
+    def rename(self,nick,newNick):
+        with self.lock:
+            nickKey = self.fold(nick)
+            newKey = self.fold(newNick)
+            keys = self.nicks.pop(nickKey,set())
+            renamed = []
+            for key in keys:
+                chan = self.channels[key]
+                member = chan.delete(nickKey)
+                if member is None:
+                    continue
+                # Keep the @, + etc. they had
+                prefix = member[0]
+                chan.delete(newKey)
+                chan.insert(newKey,prefix,newNick)
+                renamed.append(chan.name)
+            if keys:
+                self.nicks.setdefault(newKey,set()).update(keys)
+            return renamed
+
+    def clear(self,channel):
+        with self.lock:
+            key = self.fold(channel)
+            chan = self.channels.pop(key,None)
+            if chan is None:
+                return
+            for nickKey in chan.members:
+                chans = self.nicks.get(nickKey)
+                if chans:
+                    chans.discard(key)
+                    if not chans:
+                        del self.nicks[nickKey]
+
+    def channels_of(self,nick):
+        with self.lock:
+            return [self.channels[key].name for key in self.nicks.get(self.fold(nick),())]
+
+    def view(self,channel):
+        with self.lock:
+            chan = self.channels.get(self.fold(channel))
+            if chan is None:
+                return []
+            return list(chan.view)
+
+    def __contains__(self,channel):
+        return self.fold(channel) in self.channels
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the Scrollback, a bounded ring of the last messages shown in
+a tab. Tk text widgets get slow and huge when text is appended forever, so the
+chat boxes are trimmed to the same size and anything older is only kept in the
+chat log on disk.
+'''
+from collections import deque
+
+# Default limits, by line count and optionally by bytes of text
+LINES = 2000
+BYTES = None
+# Trim the widget only once it is this many lines over, deleting lines from a
+# Tk text widget is cheap but not free
+TRIM_BATCH = 200
+
+class Scrollback(object):
+    '''
+    The last messages of a tab. A message is a tuple of (text,color,font)
+    segments, the same as what the UiQueue appends
+
+    Methods:
+        append(message)
+            add a message, dropping the oldest ones over the limits
+        keep()
+            how many lines the chat box should keep
+        add_backlog(lines)
+            older lines were put at the top of the chat box, keep them too
+        clear()
+            forget everything
+    '''
+    def __init__(self,maxLines=LINES,maxBytes=BYTES):
+        self.maxLines = maxLines
+        self.maxBytes = maxBytes
+        self.messages = deque()
+        self.size = 0
+        # Set once we had to drop something, until then the chat box may
+        # also show backlog we don't hold here
+        self.full = False
+        # Lines of older backlog the user paged into the chat box
+        self.backlog = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def append(self,message):
+        message = tuple(message)
+        self.messages.append(message)
+        self.size += messageSize(message)
+        while len(self.messages) > self.maxLines or (self.maxBytes and self.size > self.maxBytes and len(self.messages) > 1):
+            self.size -= messageSize(self.messages.popleft())
+            self.full = True
+
+    def keep(self):
+        if self.full:
+            return len(self.messages) + self.backlog
+        return self.maxLines + self.backlog
+
+    def add_backlog(self,lines):
+        self.backlog += lines
+
+    def clear(self):
+        self.messages.clear()
+        self.size = 0
+        self.full = False
+        self.backlog = 0
+
+def messageSize(message):
+    return sum(len(text) for (text,color,font) in message)
+
+def trimWidget(widget,keep,batch=TRIM_BATCH):
+    '''
+    Delete the oldest lines of a Tk text widget once it has more than keep
+    lines plus batch, returns how many lines were deleted
+    '''
+    # The text always ends in a newline so the last line is empty
+    lines = int(widget.index("end-1c").split(".")[0]) - 1
+    if lines <= keep + batch:
+        return 0
+    drop = lines - keep
+    widget.delete("1.0",f"{drop + 1}.0")
+    return drop
@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the outgoing side of a connection. Lines are queued instead
+of being written straight to the socket, a writer then sends as many of them
+as it can in one go. A token bucket keeps us under the server's flood limit,
+servers kill the connection with "Excess Flood" if we send too fast.
+'''
+import threading
+import time
+from collections import deque
+
+# Defaults for the flood control, we can send BURST lines at once and after
+# that one line every 1/RATE seconds. These are on the safe side for most
+# networks, see SendQueue.configure. A RATE of 0 turns the flood control off,
+# eg. for a bouncer which has its own
+BURST = 5
+RATE = 0.5
+
+class TokenBucket(object):
+    '''
+    Token bucket rate limiter, holds up to burst tokens and refills at rate
+    tokens per second. Every line sent costs one token
+    '''
+    def __init__(self,burst=BURST,rate=RATE):
+        self.burst = burst
+        self.rate = rate
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def refill(self,now):
+        self.tokens = min(self.burst,self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def take(self,now):
+        '''
+        Take a token, returns False if there is none to take
+        '''
+        if self.rate <= 0:
+            return True
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self,now):
+        '''
+        Seconds until a token is available
+        '''
+        if self.rate <= 0:
+            return 0
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class SendQueue(object):
+    '''
+    Queue of outgoing lines for one connection. It is safe to put from any
+    thread, one writer takes from it.
+
+    There are two lanes, priority lines (PONG, QUIT) skip the flood control
+    and go out before anything else, normal lines go out as tokens allow.
+
+    Methods:
+        put(data,priority=False,waiter=None)
+            queue bytes to send, waiter.set_result(None) is called once
+            they're written
+        put_lines(lines,priority=False,waiter=None)
+            queue several lines at once, each costs a token of its own and
+            the waiter goes with the last
+        take(now=None)
+            the bytes to write right now, merged into one buffer
+        sent(n)
+            tell the queue n bytes of what take returned were written
+        delay(now=None)
+            seconds until there is something to take, None if empty
+        wait(timeout=None)
+            block until there is something to take
+        join(timeout=None)
+            block until everything queued has been written
+        configure(burst,rate)
+            change the flood control, rate 0 turns it off
+        reset()
+            drop everything queued, returns the dropped waiters
+    '''
+    def __init__(self,burst=BURST,rate=RATE):
+        self.lines = deque()
+        self.priority = deque()
+        self.bucket = TokenBucket(burst,rate)
+        # Taken but not yet written out, a write may be partial
+        self.out = bytearray()
+        self.outWaiters = []
+        self.cond = threading.Condition()
+
+    def __len__(self):
+        return len(self.lines) + len(self.priority)
+
+    def configure(self,burst=None,rate=None):
+        with self.cond:
+            if burst is not None:
+                self.bucket.burst = burst
+                self.bucket.tokens = min(self.bucket.tokens,burst)
+            if rate is not None:
+                self.bucket.rate = rate
+
+    def put(self,data,priority=False,waiter=None):
+        with self.cond:
+            if priority:
+                self.priority.append((data,waiter))
+            else:
+                self.lines.append((data,waiter))
+            self.cond.notify_all()
+
+    def put_lines(self,lines,priority=False,waiter=None):
+        with self.cond:
+            lane = self.priority if priority else self.lines
+            for data in lines[:-1]:
+                lane.append((data,None))
+            lane.append((lines[-1],waiter))
+            self.cond.notify_all()
+
+    def take(self,now=None):
+        '''
+        Returns the bytes to write now, empty if the flood control says wait.
+        Whatever is returned stays queued until sent is called
+        '''
+        if now is None:
+            now = time.monotonic()
+        with self.cond:
+            out = self.out
+            while self.priority:
+                (data,waiter) = self.priority.popleft()
+                out += data
+                if waiter:
+                    self.outWaiters.append(waiter)
+            while self.lines and self.bucket.take(now):
+                (data,waiter) = self.lines.popleft()
+                out += data
+                if waiter:
+                    self.outWaiters.append(waiter)
+            return bytes(out)
+
+    def sent(self,n):
+        '''
+        n bytes were written, returns the waiters whose lines are all out
+        '''
+        with self.cond:
+            del self.out[:n]
+            if self.out:
+                return []
+            done = self.outWaiters
+            self.outWaiters = []
+            # Wake up anyone in join
+            self.cond.notify_all()
+            return done
+
+    def delay(self,now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.cond:
+            if self.out or self.priority:
+                return 0
+            if not self.lines:
+                return None
+            return self.bucket.delay(now)
+
+    def wait(self,timeout=None):
+        '''
+        Block until there is something to take or timeout seconds have
+        passed, returns True if there is something
+        '''
+        with self.cond:
+            delay = self.delay()
+            if delay == 0:
+                return True
+            if delay is None or (timeout is not None and timeout < delay):
+                delay = timeout
+            self.cond.wait(delay)
+            return self.delay() == 0
+
+    def join(self,timeout=None):
+        '''
+        Block until everything queued is written, returns False on timeout
+        '''
+        with self.cond:
+            return self.cond.wait_for(lambda: not (self.out or self.lines or self.priority),timeout)
+
+    def reset(self):
+        with self.cond:
+            dropped = self.outWaiters
+            for lane in (self.priority,self.lines):
+                dropped += [waiter for (data,waiter) in lane if waiter]
+                lane.clear()
+            self.out = bytearray()
+            self.outWaiters = []
+            self.cond.notify_all()
+            return dropped
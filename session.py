@@ -0,0 +1,301 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the SessionManager which lets us stay connected to many
+networks at once. Every IrcCon normally starts its own receive thread, the
+manager instead watches all their sockets with one selector from a single
+thread, so we only pay for the sockets and not a thread per network. The
+same loop writes out each connection's send queue as the flood control and
+the sockets allow.
+
+A line a handler can't take is printed and skipped by IrcCon.dispatch. Only a
+socket error takes its connection down, that connection is dropped as if the
+server had gone away, so whatever reconnects it does. Anything else which
+raises is printed and the loop goes on for all the connections.
+'''
+import selectors
+import socket
+import threading
+import time
+import traceback
+from irclib import LineFramer
+
+class SessionManager(object):
+    '''
+    Own several IrcCon connections, one per network, and receive on all of
+    them from one thread. Each IrcCon keeps its own state (channels, names,
+    nick) so the networks don't step on each other.
+
+    Methods:
+        add(name,con)
+            manage con under the network name, before connecting it
+        remove(name)
+            stop managing a network, disconnecting it if needed
+        get(name)
+            the IrcCon for a network, also available as manager[name]
+        start()
+            run the loop in a daemon thread
+        run()
+            run the receive loop in the current thread until stop()
+        stop()
+            stop the receive loop
+    '''
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.sessions = dict()
+        # IrcCon -> socket it is registered with, a reconnect swaps it
+        self.sockets = dict()
+        # Selectors aren't thread safe, connections made from other threads
+        # are queued here and registered by the loop itself
+        self.pending = []
+        # Connections with something in their send queue
+        self.writers = set()
+        self.lock = threading.Lock()
+        # Writing to the socket pair wakes the loop up from select
+        self.wakeR,self.wakeW = socket.socketpair()
+        self.wakeR.setblocking(False)
+        # Never blocks whoever wakes us, a full pair wakes the loop anyway
+        self.wakeW.setblocking(False)
+        self.selector.register(self.wakeR,selectors.EVENT_READ,None)
+        self.running = False
+        self.thread = None
+        self.ident = None
+        # When the connections next need their tick
+        self.nextTick = 0
+
+    def __getitem__(self,name):
+        return self.sessions[name]
+
+    def __contains__(self,name):
+        return name in self.sessions
+
+    def __iter__(self):
+        return iter(self.sessions)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def add(self,name,con):
+        '''
+        Manage con as the network name, connect it afterwards as usual with
+        con.connect(HOST,PORT,SSL) and the manager will receive for it
+        '''
+        if name in self.sessions:
+            raise KeyError(f"Network {name} already exists")
+        con.manager = self
+        con.network = name
+        self.sessions[name] = con
+        # Already connected, take over from here on
+        if con.connected:
+            self.watch(con)
+        return con
+
+    def get(self,name,default=None):
+        return self.sessions.get(name,default)
+
+    def remove(self,name):
+        '''
+        Stop managing the network name, disconnects it if still connected
+        '''
+        con = self.sessions.pop(name)
+        if con.connected:
+            con.disconnect()
+        con.manager = None
+        self.watch(con,remove=True)
+        return con
+
+    def watch(self,con,remove=False):
+        '''
+        Called by IrcCon.connect so that we receive on its new socket
+        '''
+        with self.lock:
+            self.pending.append((con,None if remove else con.sckt))
+        self.wake()
+
+    def want_write(self,con):
+        '''
+        Called by IrcCon.send_raw when it has queued something
+        '''
+        with self.lock:
+            self.writers.add(con)
+        # Queued from our own loop, like a PONG, it is flushed before we
+        # select again anyway
+        if threading.get_ident() != self.ident:
+            self.wake()
+
+    def wake(self):
+        try:
+            self.wakeW.send(b"\0")
+        # The pipe is full so the loop is going to wake up anyway
+        except BlockingIOError:
+            pass
+
+    def apply_pending(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+        for con,sock in pending:
+            old = self.sockets.pop(con,None)
+            if old is not None:
+                try:
+                    self.selector.unregister(old)
+                except (KeyError,ValueError):
+                    pass
+            if sock is not None:
+                # We must never block here, one slow network would hold up
+                # all the others
+                sock.setblocking(False)
+                self.selector.register(sock,selectors.EVENT_READ,(con,LineFramer()))
+                self.sockets[con] = sock
+                with self.lock:
+                    self.writers.add(con)
+
+    def flush_writers(self):
+        '''
+        Write out the send queues, returns the select timeout until one of
+        them can send again
+        '''
+        with self.lock:
+            writers = list(self.writers)
+        timeout = None
+        for con in writers:
+            sock = self.sockets.get(con)
+            if sock is None:
+                with self.lock:
+                    self.writers.discard(con)
+                continue
+            delay = con.handle_write(sock)
+            # Socket buffer is full, wait until it is writable again
+            full = bool(con.sendq.out)
+            events = selectors.EVENT_READ
+            if full:
+                events |= selectors.EVENT_WRITE
+            try:
+                key = self.selector.get_key(sock)
+                if key.events != events:
+                    self.selector.modify(sock,events,key.data)
+            # Closed under us, the read side cleans up
+            except (KeyError,ValueError,OSError):
+                pass
+            if full:
+                # EVENT_WRITE puts it back
+                with self.lock:
+                    self.writers.discard(con)
+            elif delay is None:
+                with self.lock:
+                    # Something may have been queued since we looked
+                    if con.sendq.delay() is None:
+                        self.writers.discard(con)
+                        continue
+                timeout = 0
+            elif timeout is None or delay < timeout:
+                timeout = delay
+        return timeout
+
+    def tick(self):
+        '''
+        Run the timed work of the connections, eg. the lag probes, returns
+        the seconds until one of them needs it again
+        '''
+        now = time.monotonic()
+        if now < self.nextTick:
+            return self.nextTick - now
+        delay = None
+        for con in list(self.sessions.values()):
+            try:
+                due = con.tick(now)
+            # The bursts it was handing over are gone, the next tick won't
+            # raise for them again
+            except Exception:
+                traceback.print_exc()
+                continue
+            if delay is None or due < delay:
+                delay = due
+        if delay is None:
+            delay = 1
+        self.nextTick = now + delay
+        return delay
+
+    def wake_tick(self):
+        '''
+        A connection needs its tick sooner
+        '''
+        self.nextTick = 0
+        if threading.get_ident() != self.ident:
+            self.wake()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wake()
+
+    def run(self):
+        '''
+        Receive loop for all the managed connections
+        '''
+        self.running = True
+        self.ident = threading.get_ident()
+        while self.running:
+            # First, so a PING it queues goes out right away
+            due = self.tick()
+            timeout = self.flush_writers()
+            if timeout is None or due < timeout:
+                timeout = due
+            for key,events in self.selector.select(timeout):
+                if key.data is None:
+                    try:
+                        while self.wakeR.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    self.apply_pending()
+                    continue
+                (con,framer) = key.data
+                sock = key.fileobj
+                if events & selectors.EVENT_WRITE:
+                    with self.lock:
+                        self.writers.add(con)
+                if not events & selectors.EVENT_READ:
+                    continue
+                try:
+                    alive = con.handle_read(sock,framer)
+                    # An SSL socket may hold decrypted data already, the
+                    # selector can't see that so read it out now
+                    while alive and hasattr(sock,"pending") and sock.pending():
+                        alive = con.handle_read(sock,framer)
+                except OSError:
+                    self.failed(con)
+                    alive = False
+                # Not the socket's fault, keep receiving on it
+                except Exception:
+                    traceback.print_exc()
+                    alive = True
+                if not alive:
+                    self.forget(con,sock)
+
+    def forget(self,con,sock):
+        '''
+        Stop receiving on sock, the connection went away
+        '''
+        try:
+            self.selector.unregister(sock)
+        except (KeyError,ValueError):
+            pass
+        if self.sockets.get(con) is sock:
+            del self.sockets[con]
+
+    def failed(self,con):
+        '''
+        The socket of con failed, print it and drop con alone
+        '''
+        traceback.print_exc()
+        sock = self.sockets.get(con)
+        if sock is not None:
+            self.forget(con,sock)
+        con.connection_broken()
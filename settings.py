@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the saved login profile. Once we have logged in the details
+are kept in profile.json so the next start can connect straight away instead
+of asking again, Server settings still changes them.
+
+To log in to an account with SASL add these by hand, there is no field for
+them in the login window:
+    "sasl": "PLAIN", "account": "name", "password": "secret"
+or "sasl": "EXTERNAL" with "certfile" and "keyfile" for the TLS client
+certificate. "nickserv_fallback": false stops it from trying NickServ when
+SASL fails. Saving the profile makes it readable only by you.
+
+With SSL the server's certificate is checked, "verify": false accepts a
+self-signed one, eg. on a test server.
+
+The flood control, Server > Flood control, is kept in there too as
+"flood_burst" and "flood_rate".
+'''
+import json
+import os
+from sendqueue import BURST, RATE
+
+PROFILE = "profile.json"
+FIELDS = ("server","port","nick","user","rname","ssl")
+AUTH = ("sasl","account","password","certfile","keyfile","nickserv_fallback","verify")
+
+def load_profile(path=PROFILE):
+    '''
+    Returns (server,port,nick,user,rname,ssl) or None if there's no usable
+    profile
+    '''
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path,"r") as f:
+            saved = json.load(f)
+        return tuple(saved[field] for field in FIELDS)
+    # Broken or from an older version, just ask
+    except (OSError,ValueError,KeyError,TypeError):
+        return None
+
+def load_auth(path=PROFILE):
+    '''
+    Returns a dict with whichever of AUTH are in the profile
+    '''
+    saved = load_saved(path)
+    return {key: saved[key] for key in AUTH if key in saved}
+
+def load_saved(path):
+    try:
+        with open(path,"r") as f:
+            saved = json.load(f)
+        return saved if isinstance(saved,dict) else dict()
+    except (OSError,ValueError):
+        return dict()
+
+def load_flood(path=PROFILE):
+    '''
+    Returns the (burst,rate) of the flood control, see sendqueue.py
+    '''
+    saved = load_saved(path)
+    return (saved.get("flood_burst",BURST),saved.get("flood_rate",RATE))
+
+def save_flood(burst,rate,path=PROFILE):
+    saved = load_saved(path)
+    saved.update(flood_burst=burst,flood_rate=rate)
+    write_saved(saved,path)
+
+def save_profile(profile,path=PROFILE):
+    # Keep anything added by hand such as the SASL details
+    saved = load_saved(path)
+    saved.update(zip(FIELDS,profile))
+    write_saved(saved,path)
+
+def write_saved(saved,path):
+    try:
+        # Only for us, it may hold a password. An older profile may have
+        # been made readable by everyone
+        fd = os.open(path,os.O_WRONLY | os.O_CREAT | os.O_TRUNC,0o600)
+        os.fchmod(fd,0o600)
+        with open(fd,"w") as f:
+            json.dump(saved,f,indent=1)
+    except OSError:
+        pass
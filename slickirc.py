@@ -0,0 +1,27 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file starts Slick IRC, the GUI by default or the headless client with
+--headless, see headless.py:
+    python3 -m slickirc
+    python3 -m slickirc --headless --config net.toml
+'''
+import argparse
+import runpy
+
+def main():
+    parser = argparse.ArgumentParser(prog="slickirc",description="Slick IRC client")
+    parser.add_argument("--headless",action="store_true",help="run without the GUI")
+    parser.add_argument("--config",default="net.toml",help="networks to connect to in headless mode")
+    args = parser.parse_args()
+    if args.headless:
+        # Only import what we need, the headless client runs without a display
+        import headless
+        headless.main(args.config)
+    else:
+        runpy.run_module("client",run_name="__main__")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the startup timing trace. client.py imports it before
+anything else and marks each step of getting to the first message, run with
+SLICKIRC_TRACE=1 to have the times printed as they happen.
+'''
+import os
+import sys
+import time
+
+START = time.perf_counter()
+TRACE = bool(os.environ.get("SLICKIRC_TRACE"))
+# (label, seconds since START) in the order they happened
+marks = []
+seen = set()
+
+def mark(label):
+    '''
+    Record that startup got to label, only the first time
+    '''
+    if label in seen:
+        return
+    seen.add(label)
+    elapsed = time.perf_counter() - START
+    marks.append((label,elapsed))
+    if TRACE:
+        print(f"startup {elapsed * 1000:8.1f} ms  {label}",file=sys.stderr)
+
+def report():
+    return [f"{elapsed * 1000:.1f} ms {label}" for (label,elapsed) in marks]
@@ -0,0 +1,333 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the MessageStore, an SQLite database of the chat history
+with a full text index for /search. The receive thread only puts messages on a
+queue, a writer thread inserts them in batches of one transaction each. The
+database is in WAL mode so searching doesn't wait for the writer.
+
+Existing chat logs can be imported with:
+    python3 store.py [chatlog] [history.db]
+'''
+import datetime
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+# Messages per transaction and max seconds a message waits to be inserted
+BATCH = 500
+FLUSH_INTERVAL = 1
+# Results shown by /search
+LIMIT = 20
+
+# Only the nick and the text are searched, the user@host of a JOIN, PART or
+# QUIT is kept in the messages table alone
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+    nick, text, content='messages', content_rowid='id'
+);
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    network TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    nick TEXT,
+    kind TEXT NOT NULL,
+    text TEXT NOT NULL,
+    host TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel COLLATE NOCASE, time);
+""" + FTS_SCHEMA + """
+CREATE TABLE IF NOT EXISTS imported (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+
+class MessageStore(object):
+    '''
+    Methods:
+        start()
+            open the database and start the writer thread
+        record(network,channel,nick,kind,text,when=None,host=None)
+            queue a message, kind is the IRC command eg. PRIVMSG. host is
+            the user's hostname, which isn't searched
+        search(terms,channel=None,nick=None,limit=LIMIT)
+            best matches first as (time, channel, nick, kind, text, host)
+            tuples
+        flush(timeout=None)
+            wait until everything recorded so far is in the database
+        close()
+            flush and stop the writer
+    '''
+    def __init__(self,path="history.db"):
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        # Connection for searching, SQLite connections belong to the thread
+        # which made them so this one is made by the first search
+        self.reader = None
+
+    def connect(self):
+        con = sqlite3.connect(self.path,isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        # With WAL this only risks the last transactions on a power cut,
+        # never a corrupt database
+        con.execute("PRAGMA synchronous=NORMAL")
+        return con
+
+    def start(self):
+        con = self.connect()
+        create_schema(con)
+        recording_since(con)
+        con.close()
+        self.thread = threading.Thread(target=self.run,daemon=True)
+        self.thread.start()
+
+    def record(self,network,channel,nick,kind,text,when=None,host=None):
+        self.queue.put((time.time() if when is None else when,network,channel,nick,kind,text,host))
+
+    def flush(self,timeout=None):
+        done = threading.Event()
+        self.queue.put(("flush",done))
+        return done.wait(timeout)
+
+    def close(self,timeout=None):
+        done = threading.Event()
+        self.queue.put(("close",done))
+        return done.wait(timeout)
+
+    def run(self):
+        con = self.connect()
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            # Anything but a message is a marker, which ends the batch
+            while len(batch) < BATCH and len(batch[-1]) != 2:
+                try:
+                    batch.append(self.queue.get(timeout=max(0,deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            marker = batch.pop() if len(batch[-1]) == 2 else None
+            if batch:
+                try:
+                    insert(con,batch)
+                # Losing some history is better than losing the client
+                except sqlite3.Error:
+                    pass
+            if marker is not None:
+                marker[1].set()
+                if marker[0] == "close":
+                    con.close()
+                    return
+
+    def search(self,terms,channel=None,nick=None,limit=LIMIT):
+        query = fts_query(terms)
+        if not query:
+            return []
+        if self.reader is None:
+            self.reader = self.connect()
+        sql = ["SELECT m.time, m.channel, m.nick, m.kind, m.text, m.host FROM messages_fts f",
+            "JOIN messages m ON m.id = f.rowid WHERE messages_fts MATCH ?"]
+        args = [query]
+        if channel:
+            sql.append("AND m.channel = ? COLLATE NOCASE")
+            args.append(channel)
+        if nick:
+            sql.append("AND m.nick = ? COLLATE NOCASE")
+            args.append(nick)
+        sql.append("ORDER BY f.rank, m.time DESC LIMIT ?")
+        args.append(limit)
+        try:
+            return self.reader.execute(" ".join(sql),args).fetchall()
+        except sqlite3.Error:
+            return []
+
+def insert(con,rows):
+    '''
+    Insert (time, network, channel, nick, kind, text, host) rows in one
+    transaction
+    '''
+    con.execute("BEGIN")
+    try:
+        for row in rows:
+            cur = con.execute("INSERT INTO messages (time,network,channel,nick,kind,text,host) VALUES (?,?,?,?,?,?,?)",row)
+            con.execute("INSERT INTO messages_fts (rowid,nick,text) VALUES (?,?,?)",(cur.lastrowid,row[3] or "",row[5]))
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    con.execute("COMMIT")
+
+def create_schema(con):
+    '''
+    Create the tables. A database from before the host column had the
+    hostname of a JOIN or PART as its text, where it was searched, so it's
+    moved and the index is rebuilt
+    '''
+    columns = [row[1] for row in con.execute("PRAGMA table_info(messages)")]
+    if columns and "host" not in columns:
+        con.execute("BEGIN")
+        try:
+            con.execute("ALTER TABLE messages ADD COLUMN host TEXT")
+            con.execute("UPDATE messages SET host = text, text = '' WHERE kind IN ('JOIN','PART')")
+            con.execute("DROP TABLE IF EXISTS messages_fts")
+            con.execute(FTS_SCHEMA)
+            con.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+    con.executescript(SCHEMA)
+
+def recording_since(con):
+    '''
+    When the store started recording, anything logged after that is in it
+    already. Set the first time, a store from before this was kept starts
+    with its oldest message
+    '''
+    row = con.execute("SELECT value FROM meta WHERE key = 'since'").fetchone()
+    if row:
+        return row[0]
+    oldest = con.execute("SELECT min(time) FROM messages").fetchone()[0]
+    since = time.time() if oldest is None else oldest
+    con.execute("INSERT INTO meta (key,value) VALUES ('since',?)",(since,))
+    return since
+
+def fts_query(terms):
+    '''
+    Turn what the user typed into an FTS5 query matching all the words, each
+    word is quoted so nothing in it is taken as FTS syntax
+    '''
+    words = terms.split()
+    return " ".join('"' + word.replace('"','""') + '"' for word in words)
+
+def parse_search(words):
+    '''
+    Split the words of "/search [#chan] [nick:who] terms" into
+    (channel, nick, terms), channel and nick are None if not given
+    '''
+    words = list(words)
+    channel = nick = None
+    while len(words) > 1:
+        if words[0][0] in "#&" and channel is None:
+            channel = words.pop(0)
+        elif words[0].lower().startswith("nick:") and nick is None:
+            nick = words.pop(0)[5:]
+        else:
+            break
+    return (channel,nick,' '.join(words))
+
+# Lines as the client shows and logs them, after the "HH:MM:SS | "
+LOGLINE = re.compile(r"^\s*(\d\d):(\d\d):(\d\d) \| (.*)$")
+LOGFORMATS = [
+    ("JOIN",re.compile(r"^---> (\S+) \((\S*)\) has joined \S+$")),
+    ("PART",re.compile(r"^<--- (\S+) \((\S*)\) has parted \S+$")),
+    ("QUIT",re.compile(r"^(\S+) \((\S*)\) quit: (.*)$")),
+    ("NOTICE",re.compile(r"^Notice (.*)$")),
+    ("PRIVMSG",re.compile(r"^(\S+) > (.*)$")),
+]
+
+def parse_log_line(line):
+    '''
+    Parse a chat log line, returns (seconds into the day, nick, kind, text,
+    host) or None for lines which aren't messages
+    '''
+    found = LOGLINE.match(line)
+    if not found:
+        return None
+    (hour,minute,second,rest) = found.groups()
+    seconds = int(hour) * 3600 + int(minute) * 60 + int(second)
+    for (kind,pattern) in LOGFORMATS:
+        match = pattern.match(rest)
+        if not match:
+            continue
+        if kind == "NOTICE":
+            return (seconds,None,kind,match.group(1),None)
+        if kind == "PRIVMSG":
+            return (seconds,match.group(1),kind,match.group(2),None)
+        if kind == "QUIT":
+            return (seconds,match.group(1),kind,match.group(3),match.group(2))
+        return (seconds,match.group(1),kind,"",match.group(2))
+    return None
+
+def log_date(path):
+    '''
+    The day of a log file from its name, or when it was last written for the
+    old single file logs
+    '''
+    name = os.path.splitext(os.path.basename(path))[0]
+    try:
+        return datetime.date.fromisoformat(name)
+    except ValueError:
+        return datetime.date.fromtimestamp(os.path.getmtime(path))
+
+def import_logs(root="chatlog",path="history.db"):
+    '''
+    Import the chat logs under root, ie. root/<network>/<tab>/<date>.txt and
+    the old root/<network>/<tab>.txt. Meant for the logs from before the
+    client kept a store, so only the lines from before it started recording
+    are imported and a file which was imported before is skipped. Returns
+    how many messages were imported
+    '''
+    store = MessageStore(path)
+    con = store.connect()
+    create_schema(con)
+    since = recording_since(con)
+    count = 0
+    for network in sorted(os.listdir(root)):
+        for (dirpath,dirnames,filenames) in os.walk(os.path.join(root,network)):
+            for filename in sorted(filenames):
+                if not filename.endswith(".txt"):
+                    continue
+                logPath = os.path.join(dirpath,filename)
+                # The tab is the directory of a day file, or the file name
+                if dirpath == os.path.join(root,network):
+                    tab = filename[:-4]
+                else:
+                    tab = os.path.basename(dirpath)
+                tab = tab.replace("%2F","/")
+                count += import_file(con,logPath,network,tab,since)
+    con.close()
+    return count
+
+def import_file(con,logPath,network,tab,since):
+    '''
+    Import the lines of one log from before since, returns how many
+    '''
+    if con.execute("SELECT 1 FROM imported WHERE path = ?",(logPath,)).fetchone():
+        return 0
+    size = os.path.getsize(logPath)
+    day = log_date(logPath)
+    start = time.mktime(day.timetuple())
+    rows = []
+    with open(logPath,"rb") as f:
+        for line in f:
+            parsed = parse_log_line(line.decode("UTF-8",errors="replace").rstrip("\r\n"))
+            if parsed:
+                (seconds,nick,kind,text,host) = parsed
+                # The store has it already
+                if start + seconds >= since:
+                    continue
+                rows.append((start + seconds,network,tab,nick,kind,text,host))
+    for i in range(0,len(rows),BATCH):
+        insert(con,rows[i:i + BATCH])
+    con.execute("INSERT OR REPLACE INTO imported (path,size) VALUES (?,?)",(logPath,size))
+    return len(rows)
+
+if __name__ == "__main__":
+    root = sys.argv[1] if len(sys.argv) > 1 else "chatlog"
+    path = sys.argv[2] if len(sys.argv) > 2 else "history.db"
+    print(f"Imported {import_logs(root,path)} messages into {path}")
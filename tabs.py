@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+This file contains the TabRegistry which keeps track of the chat tabs. Tabs are
+never really deleted, only hidden (see client.delete_tab), so a tab keeps the
+notebook index it was created with and we can look it up directly instead of
+searching a list. It also remembers which tabs are unread so the Tk tab title
+is only touched when that actually changes. Each tab also has a Scrollback
+holding its last messages.
+'''
+from scrollback import Scrollback, LINES, BYTES
+
+class Tab(object):
+    '''
+    State of one chat tab
+
+    Attributes:
+        name : str
+            The channel or nick, also the key of the tab
+        index : int
+            Position in the notebook, hidden tabs keep theirs
+        open : bool
+            False while the tab is hidden
+        unread : int
+            Messages since the tab was last read
+        history : Scrollback
+            The last messages shown in the tab
+    '''
+    __slots__ = ("name","index","open","unread","history")
+
+    def __init__(self,name,index,history):
+        self.name = name
+        self.index = index
+        self.open = True
+        self.unread = 0
+        self.history = history
+
+class TabRegistry(object):
+    '''
+    Methods:
+        attach(notebook)
+            the ttk notebook whose tab titles we keep up to date
+        add(name)
+            register a new tab or reopen a hidden one, returns True if new
+        close(name)
+            the tab was hidden
+        is_open(name)
+            True if the tab exists and isn't hidden
+        open_tabs()
+            names of the open tabs, in notebook order
+        names()
+            names of every tab ever created, in notebook order
+        mark_unread(name), mark_read(name)
+            add or remove the asterisk in front of the title
+        unread(name)
+            unread messages in a tab
+        lookup(title)
+            the tab name for a title which may have an asterisk
+        history(name)
+            the Scrollback of a tab
+    '''
+    def __init__(self,notebook=None,maxLines=LINES,maxBytes=BYTES):
+        self.notebook = notebook
+        # Scrollback limits for every tab
+        self.maxLines = maxLines
+        self.maxBytes = maxBytes
+        self.tabs = dict()
+        self.order = []
+
+    def attach(self,notebook):
+        self.notebook = notebook
+
+    def __contains__(self,name):
+        return name in self.tabs
+
+    def __len__(self):
+        return len(self.order)
+
+    def add(self,name):
+        tab = self.tabs.get(name)
+        if tab is not None:
+            tab.open = True
+            return False
+        self.tabs[name] = Tab(name,len(self.order),Scrollback(self.maxLines,self.maxBytes))
+        self.order.append(name)
+        return True
+
+    def close(self,name):
+        tab = self.tabs.get(name)
+        if tab is not None:
+            tab.open = False
+            self.mark_read(name)
+
+    def is_open(self,name):
+        tab = self.tabs.get(name)
+        return tab is not None and tab.open
+
+    def open_tabs(self):
+        return [name for name in self.order if self.tabs[name].open]
+
+    def names(self):
+        return list(self.order)
+
+    def history(self,name):
+        return self.tabs[name].history
+
+    def unread(self,name):
+        tab = self.tabs.get(name)
+        return tab.unread if tab else 0
+
+    def lookup(self,title):
+        if title in self.tabs:
+            return title
+        return title.lstrip("*")
+
+    def mark_unread(self,name,count=1):
+        tab = self.tabs.get(name)
+        if tab is None:
+            return
+        if not tab.unread:
+            self.set_title(tab,"*" + name)
+        tab.unread += count
+
+    def mark_read(self,name):
+        tab = self.tabs.get(name)
+        if tab is None or not tab.unread:
+            return
+        tab.unread = 0
+        self.set_title(tab,name)
+
+    def set_title(self,tab,title):
+        if self.notebook is not None:
+            self.notebook.tab(tab.index,text=title)
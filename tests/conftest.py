@@ -0,0 +1,16 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+The tests import the modules from the top of the repo, none of them need
+PySimpleGUI or a display. From the top of the repo:
+
+    python3 -m pytest tests
+'''
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0,ROOT)
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for the AsyncIrcCon against a server on a local asyncio stream
+'''
+import asyncio
+from asyncirc import AsyncIrcCon
+
+class Client(AsyncIrcCon):
+    '''
+    An AsyncIrcCon which keeps the messages it got
+    '''
+    def __init__(self):
+        AsyncIrcCon.__init__(self)
+        self.messages = []
+        self.broken = asyncio.Event()
+
+    def on_message(self,who,channel,msg):
+        self.messages.append((who,channel,msg))
+
+    def on_connection_broken(self):
+        self.broken.set()
+
+    def unknown_message(self,line):
+        pass
+
+class Server(object):
+    '''
+    Keeps the lines the client sent and lets the test send it some
+    '''
+    def __init__(self):
+        self.lines = asyncio.Queue()
+        self.writer = None
+        self.connected = asyncio.Event()
+
+    async def handle(self,reader,writer):
+        self.writer = writer
+        self.connected.set()
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            await self.lines.put(line.decode("UTF-8").rstrip("\r\n"))
+
+    async def expect(self,count):
+        return [await asyncio.wait_for(self.lines.get(),5) for i in range(count)]
+
+    def send(self,*lines):
+        self.writer.write("".join(f"{line}\r\n" for line in lines).encode("UTF-8"))
+
+async def session(check):
+    server = Server()
+    listener = await asyncio.start_server(server.handle,"127.0.0.1",0)
+    port = listener.sockets[0].getsockname()[1]
+    con = Client()
+    con.wantCaps = []
+    try:
+        await check(con,server,port)
+    finally:
+        listener.close()
+
+def test_no_blocking_socket():
+    con = AsyncIrcCon()
+    assert con.sckt is None
+
+def test_lines_both_ways():
+    async def check(con,server,port):
+        # Queued before connecting, sent once we are after the login which
+        # skips the queue
+        early = con.privmsg("#c","early")
+        assert await con.connect("127.0.0.1",port)
+        con.login("me","user")
+        assert await server.expect(3) == ["NICK me","USER user user user: me","PRIVMSG #c :early"]
+        await asyncio.wait_for(asyncio.wrap_future(early),5)
+        server.send("PING :abc",":bob!u@h PRIVMSG #c :hello there")
+        assert await server.expect(1) == ["PONG abc"]
+        assert con.messages == [("bob","#c","hello there")]
+        await asyncio.wait_for(con.privmsg("#c","hi"),5)
+        assert await server.expect(1) == ["PRIVMSG #c :hi"]
+        await con.disconnect()
+        assert not con.connected
+    asyncio.run(session(check))
+
+def test_server_closing():
+    async def check(con,server,port):
+        assert await con.connect("127.0.0.1",port)
+        await server.connected.wait()
+        server.writer.close()
+        await asyncio.wait_for(con.broken.wait(),5)
+        assert not con.connected
+        await asyncio.wait_for(con.wait_closed(),5)
+    asyncio.run(session(check))
+
+def test_connect_refused():
+    async def check(con,server,port):
+        errors = []
+        con.on_error = errors.append
+        # Nothing listens on port 1
+        assert not await con.connect("127.0.0.1",1)
+        assert errors == ["ConnectionRefusedError"]
+    asyncio.run(session(check))
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for the BacklogReader
+'''
+from backlog import BacklogReader
+
+def write(path,lines,mode="w"):
+    with open(path,mode) as f:
+        f.write("".join(f"{line}\n" for line in lines))
+
+def logs(tmp_path,*names):
+    return lambda: [str(tmp_path / name) for name in names if (tmp_path / name).exists()]
+
+def test_pages_back_across_files(tmp_path):
+    write(tmp_path / "2021-01-01.txt",["a1","a2","a3"])
+    write(tmp_path / "2021-01-02.txt",["b1","b2"])
+    reader = BacklogReader(logs(tmp_path,"2021-01-01.txt","2021-01-02.txt"))
+    assert reader.older(3) == "a3\nb1\nb2\n"
+    assert not reader.exhausted()
+    assert reader.older(3) == "a1\na2\n"
+    assert reader.exhausted()
+    assert reader.older(3) == ""
+
+def test_lines_logged_since(tmp_path):
+    path = tmp_path / "2021-01-01.txt"
+    write(path,["a1","a2","a3"])
+    reader = BacklogReader(logs(tmp_path,"2021-01-01.txt"))
+    assert reader.older(2) == "a2\na3\n"
+    # Two more lines were shown and logged
+    write(path,["a4","a5"],"a")
+    reader.shown(2)
+    assert reader.older(2) == "a1\n"
+
+def test_trimmed_lines_come_back(tmp_path):
+    write(tmp_path / "2021-01-01.txt",["a1","a2","a3","a4"])
+    reader = BacklogReader(logs(tmp_path,"2021-01-01.txt"))
+    assert reader.older(5) == "a1\na2\na3\na4\n"
+    assert reader.exhausted()
+    # The two oldest were deleted from the top of the tab
+    reader.trimmed(2)
+    assert not reader.exhausted()
+    assert reader.older(5) == "a1\na2\n"
+
+def test_new_day_file(tmp_path):
+    write(tmp_path / "2021-01-01.txt",["a1","a2"])
+    reader = BacklogReader(logs(tmp_path,"2021-01-01.txt","2021-01-02.txt"))
+    assert reader.older(1) == "a2\n"
+    write(tmp_path / "2021-01-02.txt",["b1","b2","b3"])
+    reader.shown(3)
+    assert reader.older(5) == "a1\n"
+
+def test_missing_trailing_newline(tmp_path):
+    with open(tmp_path / "log.txt","w") as f:
+        f.write("a1\na2")
+    reader = BacklogReader(logs(tmp_path,"log.txt"))
+    assert reader.older(1) == "a2\n"
+    assert reader.older(1) == "a1\n"
+
+def test_empty_and_missing_files(tmp_path):
+    write(tmp_path / "empty.txt",[])
+    reader = BacklogReader(logs(tmp_path,"empty.txt","missing.txt"))
+    assert reader.older() == ""
+    assert reader.exhausted()
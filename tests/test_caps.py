@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for the CAP negotiation in IrcCon
+'''
+from caps import parse_caps, server_time
+from irclib import IrcCon
+
+class Client(IrcCon):
+    '''
+    An IrcCon which remembers what it was told instead of showing it
+    '''
+    def __init__(self):
+        IrcCon.__init__(self)
+        self.events = []
+
+    def on_caps(self,caps):
+        self.events.append(("caps",set(caps)))
+
+    def unknown_message(self,line):
+        pass
+
+    def sent(self):
+        '''
+        The lines queued for the server since the last call
+        '''
+        data = self.sendq.take()
+        self.sendq.sent(len(data))
+        return data.decode("UTF-8").split("\r\n")[:-1]
+
+def login(con,wantCaps=("multi-prefix","batch")):
+    con.wantCaps = list(wantCaps)
+    con.connected = True
+    con.login("me","user")
+    return con
+
+def test_parse_caps():
+    assert parse_caps("sasl=PLAIN,EXTERNAL batch ") == {"sasl": "PLAIN,EXTERNAL","batch": None}
+
+def test_server_time():
+    assert server_time("1970-01-01T00:01:40.500Z") == 100.5
+    assert server_time("yesterday") is None
+
+def test_login_starts_with_cap_ls():
+    con = login(Client())
+    assert con.sent() == ["CAP LS 302","NICK me","USER user user user: me"]
+    assert con.negotiating
+
+def test_multiline_ls():
+    con = login(Client())
+    con.sent()
+    con.dispatch([":srv CAP * LS * :multi-prefix away-notify"])
+    # Nothing asked for until the last LS line
+    assert con.sent() == []
+    con.dispatch([":srv CAP * LS :batch sasl=PLAIN"])
+    assert con.sent() == ["CAP REQ :multi-prefix batch"]
+    con.dispatch([":srv CAP me ACK :multi-prefix batch"])
+    assert con.sent() == ["CAP END"]
+    assert con.caps == {"multi-prefix","batch"}
+    assert con.events == [("caps",{"multi-prefix","batch"})]
+    assert not con.negotiating
+
+def test_nothing_wanted_ends_at_once():
+    con = login(Client())
+    con.sent()
+    con.dispatch([":srv CAP * LS :away-notify"])
+    assert con.sent() == ["CAP END"]
+
+def test_nak():
+    con = login(Client())
+    con.sent()
+    con.dispatch([":srv CAP * LS :batch",":srv CAP me NAK :batch"])
+    assert con.sent() == ["CAP REQ :batch","CAP END"]
+    assert con.caps == set()
+
+def test_new_and_del():
+    con = login(Client())
+    con.sent()
+    con.dispatch([":srv CAP * LS :batch",":srv CAP me ACK :batch"])
+    con.sent()
+    con.dispatch([":srv CAP me NEW :multi-prefix"])
+    assert con.sent() == ["CAP REQ :multi-prefix"]
+    con.dispatch([":srv CAP me ACK :multi-prefix",":srv CAP me DEL :batch"])
+    assert con.caps == {"multi-prefix"}
+    # No CAP END again after registration
+    assert con.sent() == []
+
+def test_no_caps_wanted():
+    con = login(Client(),())
+    assert con.sent() == ["NICK me","USER user user user: me"]
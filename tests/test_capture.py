@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for capturing the raw traffic and replaying it
+'''
+import io
+import socket
+import pytest
+from capture import IN, OUT, dump, read_capture, replay
+from irclib import IrcCon
+
+class Recorder(IrcCon):
+    '''
+    An IrcCon which keeps a list of the handlers called
+    '''
+    def __init__(self):
+        IrcCon.__init__(self)
+        self.events = []
+
+    def on_message(self,who,channel,msg):
+        self.events.append(("message",who,channel,msg))
+
+    def on_echo(self,target,msg):
+        self.events.append(("echo",target,msg))
+
+    def on_user_join(self,who,channel,hostname):
+        self.events.append(("join",who,channel,hostname))
+
+    def on_user_part(self,who,channel,hostname):
+        self.events.append(("part",who,channel,hostname))
+
+    def on_topic(self,chan,topic):
+        self.events.append(("topic",chan,topic))
+
+    def on_notice(self,chan,msg):
+        self.events.append(("notice",chan,msg))
+
+    def on_user_nick_change(self,who,newNick):
+        self.events.append(("nick",who,newNick))
+
+    def unknown_message(self,line):
+        self.events.append(("unknown",line))
+
+TRAFFIC = [
+    b":alice!a@host JOIN #chan\r\n:alice!a@host PRIVMSG #chan :hello ",
+    b"there\r\nPING :srv\r\n:srv 332 me #chan :the topic\r\n",
+    # Our own message, only ignored if the replay knows our nick
+    b":me!m@host PRIVMSG #chan :mine\r\n:srv NOTICE me :caf\xc3",
+    b"\xa9\r\n:alice!a@host NICK bob\r\n:bob!a@host PART #chan\r\nFOO bar\r\n",
+]
+
+def capture(path):
+    (ours,theirs) = socket.socketpair()
+    con = Recorder()
+    con.NICK = "me"
+    con.sckt = ours
+    con.connected = True
+    con.start_capture(path)
+    con.send_raw("NICK me")
+    con.handle_write(ours)
+    for chunk in TRAFFIC:
+        theirs.sendall(chunk)
+    theirs.close()
+    con.recv_loop(ours)
+    con.stop_capture()
+    ours.close()
+    return con
+
+def test_replay_calls_the_same_handlers(tmp_path):
+    path = str(tmp_path / "net.cap.gz")
+    live = capture(path)
+    assert ("notice","info","café") in live.events
+    assert not any(event[0] == "message" and event[1] == "me" for event in live.events)
+    replayed = Recorder()
+    (lines,seconds) = replay(path,replayed)
+    assert lines == 9
+    assert replayed.NICK == "me"
+    assert replayed.events == live.events
+
+def test_records(tmp_path):
+    path = str(tmp_path / "net.cap")
+    capture(path)
+    records = list(read_capture(path))
+    assert [data for (direction,seconds,data) in records if direction == OUT] == [b"NICK me\r\n"]
+    assert b"".join(data for (direction,seconds,data) in records if direction == IN) == b"".join(TRAFFIC)
+    times = [seconds for (direction,seconds,data) in records]
+    assert times == sorted(times)
+    out = io.StringIO()
+    dump(path,out)
+    assert ">> NICK me" in out.getvalue()
+    assert "<< PING :srv" in out.getvalue()
+
+def test_cut_short(tmp_path):
+    path = tmp_path / "net.cap"
+    capture(str(path))
+    whole = list(read_capture(str(path)))
+    # A crash in the middle of the last record
+    path.write_bytes(path.read_bytes()[:-3])
+    assert list(read_capture(str(path))) == whole[:-1]
+
+def test_not_a_capture(tmp_path):
+    path = tmp_path / "net.cap"
+    path.write_bytes(b"hello")
+    with pytest.raises(ValueError):
+        list(read_capture(str(path)))
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for the ChatLogger
+'''
+import datetime
+import os
+
+from chatlog import ChatLogger, logFiles
+
+class Clock(object):
+    def __init__(self,date):
+        self.date = date
+
+    def __call__(self):
+        return self.date
+
+def read(path):
+    with open(path,encoding="UTF-8") as f:
+        return f.read()
+
+def logger(tmp_path,clock=None):
+    # A long interval so only flush() and close() write anything out
+    log = ChatLogger(str(tmp_path),interval=3600,today=clock or Clock(datetime.date(2021,1,1)))
+    log.start()
+    return log
+
+def test_flush(tmp_path):
+    log = logger(tmp_path)
+    log.write("libera","#linux","hello\n")
+    log.write("libera","#linux","world\n")
+    assert log.flush(5)
+    [path] = logFiles(str(tmp_path),"libera","#linux")
+    assert os.path.basename(path) == "2021-01-01.txt"
+    assert read(path) == "hello\nworld\n"
+    log.write("libera","#linux","again\n")
+    assert log.flush(5)
+    assert read(path) == "hello\nworld\nagain\n"
+    log.close(5)
+
+def test_rotates_at_midnight(tmp_path):
+    clock = Clock(datetime.date(2021,1,1))
+    log = logger(tmp_path,clock)
+    log.write("libera","#linux","before\n")
+    clock.date = datetime.date(2021,1,2)
+    log.write("libera","#linux","after\n")
+    assert log.close(5)
+    paths = logFiles(str(tmp_path),"libera","#linux")
+    assert [os.path.basename(path) for path in paths] == ["2021-01-01.txt","2021-01-02.txt"]
+    assert [read(path) for path in paths] == ["before\n","after\n"]
+
+def test_close_drains_queue(tmp_path):
+    log = ChatLogger(str(tmp_path),interval=3600,today=Clock(datetime.date(2021,1,1)))
+    # Queued before the thread even runs
+    for i in range(100):
+        log.write("libera","alice",f"{i}\n")
+    log.start()
+    assert log.close(5)
+    log.thread.join(5)
+    assert not log.thread.is_alive()
+    assert log.files == dict()
+    [path] = logFiles(str(tmp_path),"libera","alice")
+    assert read(path) == "".join(f"{i}\n" for i in range(100))
+
+def test_tabs_kept_apart(tmp_path):
+    log = logger(tmp_path)
+    log.write("libera","#a/b","slash\n")
+    log.write("oftc","#a/b","other network\n")
+    assert log.close(5)
+    assert read(logFiles(str(tmp_path),"libera","#a/b")[0]) == "slash\n"
+    assert read(logFiles(str(tmp_path),"oftc","#a/b")[0]) == "other network\n"
+    assert os.path.isdir(tmp_path / "libera" / "#a%2Fb")
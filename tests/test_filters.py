@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for the FilterEngine and its rules
+'''
+from filters import FilterEngine, parse_rule
+
+def engine(*rules):
+    filters = FilterEngine()
+    filters.set_rules(list(rules))
+    return filters
+
+def test_parse_rule():
+    rule = parse_rule("#Linux nick:Bot *http*")
+    assert (rule.channel,rule.sender,rule.pattern,rule.substring) == ("#linux","bot","http",True)
+    rule = parse_rule("#chan")
+    assert (rule.channel,rule.pattern) == (None,"#chan")
+    assert parse_rule("**") is not None
+    assert parse_rule("   ") is None
+
+def test_words_not_inside_words():
+    filters = engine("cat")
+    assert filters.match("#c","a","my CAT is here") == "cat"
+    assert filters.match("#c","a","cat") == "cat"
+    assert filters.match("#c","a","concatenate") is None
+
+def test_substring():
+    filters = engine("*cat*")
+    assert filters.match("#c","a","concatenate") == "*cat*"
+
+def test_phrase_matches_any_whitespace():
+    filters = engine("buy  now")
+    assert filters.match("#c","a","please BUY\tnow") == "buy  now"
+    assert filters.match("#c","a","buy it now") is None
+
+def test_literal_patterns():
+    # Nothing in a rule is regex syntax, including the | joining the rules
+    filters = engine("a|b","c++","*.*","(x")
+    assert filters.match("#c","n","a") is None
+    assert filters.match("#c","n","b") is None
+    assert filters.match("#c","n","x a|b y") == "a|b"
+    assert filters.match("#c","n","i like c++ a lot") == "c++"
+    assert filters.match("#c","n","cxx") is None
+    assert filters.match("#c","n","no dots here") is None
+    assert filters.match("#c","n","one.two") == "*.*"
+    assert filters.match("#c","n","(x") == "(x"
+
+def test_longest_rule_wins():
+    filters = engine("spam","spam and eggs")
+    assert filters.match("#c","n","spam and eggs") == "spam and eggs"
+    assert filters.match("#c","n","spam") == "spam"
+
+def test_scopes():
+    filters = engine("#linux hello","nick:bot hello","#linux nick:bot *http*")
+    assert filters.match("#LINUX","alice","hello") == "#linux hello"
+    assert filters.match("#other","alice","hello") is None
+    assert filters.match("#other","Bot","hello") == "nick:bot hello"
+    assert filters.match("#linux","bot","see http://x") == "#linux nick:bot *http*"
+    assert filters.match("#other","bot","see http://x") is None
+    assert filters.match("#linux","alice","see http://x") is None
+
+def test_rebuilt_when_rules_change():
+    filters = engine("spam")
+    assert filters.match("#c","n","spam") == "spam"
+    filters.set_rules(["eggs"," eggs ",""])
+    assert filters.rules() == ["eggs"]
+    assert filters.match("#c","n","spam") is None
+    assert filters.match("#c","n","eggs") == "eggs"
+    filters.set_rules([])
+    assert filters.match("#c","n","eggs") is None
+
+def test_hits_saved(tmp_path):
+    path = str(tmp_path / "filters.json")
+    filters = FilterEngine(path)
+    filters.set_rules(["spam","eggs"])
+    filters.match("#c","n","spam")
+    filters.match("#c","n","spam")
+    filters.save()
+    loaded = FilterEngine(path)
+    assert loaded.rules() == ["spam","eggs"]
+    assert loaded.hits("spam") == 2
+    assert loaded.hits("eggs") == 0
+    assert loaded.match("#c","n","eggs") == "eggs"
+    # Kept for the rules which stay
+    loaded.set_rules(["spam"])
+    assert loaded.hits("spam") == 2
+
+def test_broken_file(tmp_path):
+    path = tmp_path / "filters.json"
+    path.write_text("not json")
+    filters = FilterEngine(str(path))
+    assert filters.rules() == []
+    assert filters.match("#c","n","anything") is None
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for the LineFramer, IrcCon.recv_loop and parse_message
+'''
+import socket
+import pytest
+from irclib import IrcCon, LineFramer, parse_message
+
+class Lines(IrcCon):
+    '''
+    An IrcCon which keeps the batches of lines recv_loop hands over
+    '''
+    def __init__(self):
+        IrcCon.__init__(self)
+        self.batches = []
+
+    def dispatch(self,lines):
+        self.batches.append(lines)
+
+def test_partial_line_waits_for_the_rest():
+    framer = LineFramer()
+    assert framer.feed(b":a PRIVMSG #c :hel") == []
+    assert framer.feed(b"lo\r\n:b PING") == [":a PRIVMSG #c :hello"]
+    assert framer.feed(b" x\r\n") == [":b PING x"]
+
+def test_several_lines_in_one_read():
+    framer = LineFramer()
+    assert framer.feed(b"PING a\r\nPING b\nPING c\r\n") == ["PING a","PING b","PING c"]
+
+def test_utf8_split_across_reads():
+    data = "PRIVMSG #c :héllo ☃\r\n".encode("UTF-8")
+    # Cut in the middle of the snowman
+    cut = data.index("☃".encode("UTF-8")) + 1
+    framer = LineFramer()
+    assert framer.feed(data[:cut]) == []
+    assert framer.feed(data[cut:]) == ["PRIVMSG #c :héllo ☃"]
+
+def test_latin1_fallback():
+    framer = LineFramer()
+    assert framer.feed("PRIVMSG #c :café\r\n".encode("latin-1")) == ["PRIVMSG #c :café"]
+
+def test_read_from_a_socket():
+    (ours,theirs) = socket.socketpair()
+    framer = LineFramer(size=8)
+    theirs.sendall(b"PING :abcdefgh\r\n")
+    lines = []
+    while not lines:
+        lines = framer.read_from(ours)
+    assert lines == ["PING :abcdefgh"]
+    theirs.close()
+    assert framer.read_from(ours) is None
+    ours.close()
+
+def test_recv_loop_batches_complete_lines():
+    (ours,theirs) = socket.socketpair()
+    con = Lines()
+    theirs.sendall(b"PING :a\r\nPRIVMSG #c :cut ")
+    theirs.sendall(b"here\r\n")
+    theirs.close()
+    # Returns once the server closed the connection
+    con.recv_loop(ours)
+    ours.close()
+    assert sum(con.batches,[]) == ["PING :a","PRIVMSG #c :cut here"]
+    assert not con.connected
+
+def test_prefix_and_trailing():
+    msg = parse_message(":nick!~user@host PRIVMSG #chan :hello there :)")
+    assert (msg.nick,msg.user,msg.host) == ("nick","~user","host")
+    assert msg.hostname == "~user@host"
+    assert msg.command == "PRIVMSG"
+    assert msg.params == ["#chan","hello there :)"]
+
+def test_server_prefix_and_lower_case_command():
+    msg = parse_message(":irc.example.net ping :token")
+    assert msg.nick == "irc.example.net"
+    assert msg.user == msg.host == ""
+    assert msg.command == "PING"
+    assert msg.params == ["token"]
+
+def test_empty_trailing_is_kept():
+    assert parse_message("AWAY :").params == [""]
+    assert parse_message("AWAY").params == []
+
+def test_tag_unescaping():
+    msg = parse_message(r"@time=2021-01-01T00:00:00Z;msg=a\:b\sc\\d\re\nf;flag;trail=x\ :n PRIVMSG #c :hi")
+    assert msg.tags == {
+        "time": "2021-01-01T00:00:00Z",
+        "msg": "a;b c\\d\re\nf",
+        "flag": "",
+        "trail": "x",
+    }
+    assert msg.params == ["#c","hi"]
+
+def test_unknown_escape_keeps_the_character():
+    assert parse_message(r"@a=\b\: PING x").tags == {"a": "b;"}
+
+def test_no_command():
+    with pytest.raises(ValueError):
+        parse_message(":prefix.only ")
+    with pytest.raises(ValueError):
+        parse_message("")
@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for the LagMeter and the reconnect Backoff
+'''
+import pytest
+from lag import Backoff, LagMeter, PREFIX
+
+def test_probe_and_pong():
+    lag = LagMeter(interval=30,timeout=120)
+    lag.reset(0)
+    assert lag.probe(10) is None
+    token = lag.probe(30)
+    assert token.startswith(PREFIX)
+    assert lag.pong("someone else's",31) is None
+    assert lag.pong(token,30.25) == 0.25
+    assert lag.current(40) == 0.25
+    assert lag.average == 0.25
+
+def test_moving_average():
+    lag = LagMeter(interval=1)
+    lag.reset(0)
+    lag.pong(lag.probe(1),1.2)
+    lag.pong(lag.probe(2),3)
+    assert lag.last == pytest.approx(1)
+    assert lag.average == pytest.approx(0.2 + 0.25 * 0.8)
+
+def test_one_probe_at_a_time():
+    lag = LagMeter(interval=30,timeout=120)
+    lag.reset(0)
+    token = lag.probe(30)
+    # The PONG is overdue, that shows as lag
+    assert lag.probe(60) is None
+    assert lag.current(60) == 30
+    # It never came, the next probe gets a new token
+    assert lag.probe(160) not in (None,token)
+
+def test_due_and_dead():
+    lag = LagMeter(interval=30,timeout=120)
+    lag.reset(0)
+    assert lag.due(10) == 20
+    assert lag.due(10,probing=False) == 110
+    lag.lastHeard = 100
+    assert not lag.dead(200)
+    assert lag.dead(220)
+
+def test_report():
+    lag = LagMeter()
+    lag.reset(0)
+    assert lag.report() == ["No lag measured yet"]
+    lag.pong(lag.probe(30),30.05)
+    assert lag.report()[0].startswith("Lag 50 ms, average 50 ms over 1 probes")
+
+def test_backoff_doubles_up_to_most():
+    backoff = Backoff(2,10)
+    delays = [backoff.next() for i in range(5)]
+    for (delay,most) in zip(delays,[2,4,8,10,10]):
+        assert most / 2 <= delay <= most
+    backoff.reset()
+    assert 1 <= backoff.next() <= 2
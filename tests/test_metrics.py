@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for the Metrics and exporting them
+'''
+import json
+from metrics import BUCKETS, Histogram, Metrics, export, labels, prometheus
+
+def sample():
+    m = Metrics("libera")
+    m.inbound(100,3)
+    m.outbound(20)
+    m.sent_line()
+    m.handled("PRIVMSG","handle_privmsg",3e-6)
+    m.handled("PRIVMSG","handle_privmsg",0.5)
+    m.handled("PING","handle_ping",2.0)
+    m.gauge("sendq",lambda: 4)
+    m.gauge("gone",lambda: 1 / 0)
+    return m
+
+def test_histogram():
+    h = Histogram()
+    assert h.percentile(0.5) is None
+    for seconds in (1e-6,4e-6,4e-6,2.0):
+        h.observe(seconds)
+    assert h.percentile(0.25) == 1e-6
+    assert h.percentile(0.5) == 5e-6
+    assert h.percentile(1) == float("inf")
+    assert sum(h.counts) == h.count == 4
+
+def test_label_escaping():
+    assert labels(network=None) == ""
+    assert labels(network='a"b') == '{network="a\\"b"}'
+    assert labels(network="a\\b") == '{network="a\\\\b"}'
+    assert labels(network="a\nb",command="X") == '{network="a\\nb",command="X"}'
+
+def test_prometheus():
+    text = prometheus([sample(),Metrics('we"ird\\net\n')])
+    lines = text.splitlines()
+    assert text.endswith("\n")
+    assert 'slickirc_bytes_in_total{network="libera"} 100' in lines
+    assert 'slickirc_lines_out_total{network="libera"} 1' in lines
+    assert 'slickirc_bytes_in_total{network="we\\"ird\\\\net\\n"} 0' in lines
+    assert 'slickirc_commands_total{network="libera",command="PRIVMSG"} 2' in lines
+    # Buckets count everything up to their bound
+    bucket = 'slickirc_handler_seconds_bucket{network="libera",handler="handle_privmsg",le="%s"} %d'
+    assert bucket % (BUCKETS[0],0) in lines
+    assert bucket % (5e-6,1) in lines
+    assert bucket % (1.0,2) in lines
+    assert bucket % ("+Inf",2) in lines
+    assert 'slickirc_handler_seconds_count{network="libera",handler="handle_ping"} 1' in lines
+    assert 'slickirc_handler_seconds_bucket{network="libera",handler="handle_ping",le="+Inf"} 1' in lines
+    assert 'slickirc_queue_depth{network="libera",queue="sendq"} 4' in lines
+    assert not any('queue="gone"' in line for line in lines)
+    # One TYPE line per metric
+    types = [line for line in lines if line.startswith("# TYPE")]
+    assert len(types) == len(set(types)) == 8
+
+def test_export_prometheus(tmp_path):
+    path = str(tmp_path / "slickirc.prom")
+    export(path,[sample()])
+    with open(path) as f:
+        assert f.read() == prometheus([sample()])
+    assert not (tmp_path / "slickirc.prom.tmp").exists()
+
+def test_export_json(tmp_path):
+    path = str(tmp_path / "slickirc.json")
+    export(path,[sample()])
+    with open(path) as f:
+        (snapshot,) = json.load(f)
+    assert snapshot["network"] == "libera"
+    assert snapshot["counters"] == {"bytes_in": 100,"lines_in": 3,"bytes_out": 20,"lines_out": 1}
+    assert snapshot["commands"] == {"PRIVMSG": 2,"PING": 1}
+    assert snapshot["handlers"]["handle_privmsg"]["count"] == 2
+    assert sum(snapshot["handlers"]["handle_privmsg"]["buckets"]) == 2
+    assert snapshot["gauges"] == {"sendq": 4,"gone": None}
+    assert snapshot["buckets"] == BUCKETS
@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for the SplitTracker and how ChatCore shows the netsplits
+'''
+import time
+import pytest
+from core import ChatCore, Sink
+from netsplit import SplitTracker, split_servers
+
+SERVERS = ("hub.example.net","leaf.example.net")
+REASON = "hub.example.net leaf.example.net"
+
+class Lines(Sink):
+    '''
+    Keeps the text appended to each tab, without the timestamps
+    '''
+    def __init__(self):
+        self.lines = []
+
+    def append(self,tab,segments):
+        text = "".join(segment[0] for segment in segments)
+        self.lines.append((tab,text.partition(" | ")[2].rstrip("\n")))
+
+def chat():
+    sink = Lines()
+    core = ChatCore(sink)
+    core.NICK = "me"
+    core.dispatch([":me!u@h JOIN #c",":srv 353 me = #c :me alice bob carol",":srv 366 me #c :End"])
+    return (core,sink)
+
+def test_split_servers():
+    assert split_servers(REASON) == SERVERS
+    assert split_servers("*.net *.split") == ("*.net","*.split")
+    assert split_servers("Ping timeout: 240 seconds") is None
+    assert split_servers("a.net a.net") is None
+
+def test_quits_gathered_until_quiet():
+    splits = SplitTracker()
+    first = splits.quit("a","u@h",REASON,None,100)
+    assert splits.quit("b","u@h",REASON,None,100.2) is first
+    assert splits.quit("c","u@h","Ping timeout",None,100.2) is None
+    assert splits.due(100.5) == []
+    assert splits.next(100.5) == pytest.approx(0.2)
+    (burst,) = splits.due(100.7)
+    assert burst.kind == "netsplit"
+    assert burst.servers == SERVERS
+    assert [nick for (nick,hostname) in burst.events] == ["a","b"]
+    assert splits.next(100.7) is None
+
+def test_netjoin_only_for_split_nicks():
+    splits = SplitTracker()
+    splits.quit("Nick[1]","u@h",REASON,None,100)
+    splits.flush()
+    assert splits.join("other","#c","u@h",None,101) is None
+    burst = splits.join("nick{1}","#c","u@h",None,101)
+    assert burst.kind == "netjoin"
+    splits.flush()
+    # Back in, the next JOIN is an ordinary one
+    assert splits.join("Nick[1]","#c","u@h",None,102) is None
+
+def test_release_in_order():
+    splits = SplitTracker()
+    splits.quit("a","u@h",REASON,None,100)
+    splits.quit("b","u@h",REASON,None,100)
+    splits.flush()
+    splits.join("a","#c","u@h",None,200)
+    splits.join("b","#c","u@h",None,200)
+    (mine,) = splits.release("A")
+    assert mine.kind == "netjoin"
+    assert mine.events == [("a","#c","u@h")]
+    assert splits.release("a") == []
+    (rest,) = splits.flush()
+    assert rest.events == [("b","#c","u@h")]
+
+def test_release_empties_the_burst():
+    splits = SplitTracker()
+    splits.quit("a","u@h",REASON,None,100)
+    assert len(splits.release("a")) == 1
+    assert splits.next(100) is None
+    assert splits.flush() == []
+
+def test_batch():
+    splits = SplitTracker()
+    splits.batch_start("ref","netsplit",SERVERS,100)
+    # Reason doesn't matter inside a BATCH
+    burst = splits.quit("a","u@h","*.net *.split","ref",100)
+    assert splits.due(200) == []
+    assert splits.batch_end("ref") is burst
+    assert burst.events == [("a","u@h")]
+
+def test_netsplit_and_netjoin_shown_once():
+    (core,sink) = chat()
+    core.dispatch([f":alice!u@h QUIT :{REASON}",f":bob!u@h QUIT :{REASON}"])
+    assert core.roster.view("#c") == ["alice","bob","carol","me"]
+    core.tick(time.monotonic() + 10)
+    assert sink.lines[-1] == ("#c","Netsplit hub.example.net <-> leaf.example.net, 2 quit: alice, bob")
+    assert core.roster.view("#c") == ["carol","me"]
+    core.dispatch([":alice!u@h JOIN #c",":bob!u@h JOIN #c"])
+    core.tick(time.monotonic() + 10)
+    assert sink.lines[-1] == ("#c","Netjoin hub.example.net <-> leaf.example.net, 2 joined: alice, bob")
+    assert core.roster.view("#c") == ["alice","bob","carol","me"]
+
+def test_part_after_held_netjoin():
+    (core,sink) = chat()
+    core.dispatch([f":alice!u@h QUIT :{REASON}",f":bob!u@h QUIT :{REASON}"])
+    core.tick(time.monotonic() + 10)
+    start = len(sink.lines)
+    # bob parts while his JOIN is still held back
+    core.dispatch([":alice!u@h JOIN #c",":bob!u@h JOIN #c",":BOB!u@h PART #c"])
+    core.tick(time.monotonic() + 10)
+    assert sink.lines[start:] == [
+        ("#c","Netjoin hub.example.net <-> leaf.example.net, 1 joined: bob"),
+        ("#c","<--- BOB (u@h) has parted #c"),
+        ("#c","Netjoin hub.example.net <-> leaf.example.net, 1 joined: alice"),
+    ]
+    assert core.roster.view("#c") == ["alice","carol","me"]
+
+def test_nick_after_held_quit():
+    (core,sink) = chat()
+    core.dispatch([f":alice!u@h QUIT :{REASON}",":carol!u@h NICK carol2"])
+    core.tick(time.monotonic() + 10)
+    assert core.roster.view("#c") == ["bob","carol2","me"]
+    # A NICK of a nick whose QUIT is held hands the QUIT over first
+    core.dispatch([f":bob!u@h QUIT :{REASON}",":bob!u@h NICK robert"])
+    assert sink.lines[-1] == ("#c","Netsplit hub.example.net <-> leaf.example.net, 1 quit: bob")
+    assert core.roster.view("#c") == ["carol2","me"]
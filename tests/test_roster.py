@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for the Roster
+'''
+from roster import Roster
+
+def test_names_with_prefixes():
+    roster = Roster()
+    roster.set_names("#Chan",["@op","+voice","~@+owner","plain"])
+    assert roster.view("#chan") == ["+voice","@op","plain","~owner"]
+    assert "#CHAN" in roster
+
+def test_rfc1459_casemapping():
+    roster = Roster()
+    roster.set_names("#c",["Nick[a]"])
+    # {} are the lower case of []
+    assert roster.remove("#C","nick{A}")
+    assert roster.view("#c") == []
+    assert roster.channels_of("Nick[a]") == []
+
+def test_ascii_casemapping():
+    roster = Roster(casemapping="ascii")
+    roster.set_names("#c",["Nick[a]"])
+    assert not roster.remove("#c","nick{a}")
+    assert roster.remove("#c","NICK[A]")
+
+def test_configure_refolds():
+    roster = Roster(casemapping="ascii")
+    roster.set_names("#c",["a[b]"])
+    roster.configure("rfc1459")
+    assert roster.channels_of("A{B}") == ["#c"]
+
+def test_rename_keeps_prefix_and_case():
+    roster = Roster()
+    roster.set_names("#a",["@Bob","carol"])
+    roster.set_names("#b",["bob"])
+    assert sorted(roster.rename("BOB","Robert")) == ["#a","#b"]
+    assert roster.view("#a") == ["@Robert","carol"]
+    assert roster.view("#b") == ["Robert"]
+    assert sorted(roster.channels_of("robert")) == ["#a","#b"]
+    assert roster.channels_of("bob") == []
+
+def test_rename_to_a_case_change():
+    roster = Roster()
+    roster.set_names("#a",["bob"])
+    assert roster.rename("bob","Bob") == ["#a"]
+    assert roster.view("#a") == ["Bob"]
+
+def test_quit_and_clear():
+    roster = Roster()
+    roster.set_names("#a",["@x","y"])
+    roster.set_names("#b",["X"])
+    assert sorted(roster.quit("x")) == ["#a","#b"]
+    assert roster.view("#a") == ["y"]
+    assert roster.view("#b") == []
+    roster.clear("#a")
+    assert "#a" not in roster
+    assert roster.channels_of("y") == []
+
+def test_quit_many_and_add_many():
+    roster = Roster()
+    roster.set_names("#a",["x","y","z"])
+    roster.set_names("#b",["y"])
+    left = roster.quit_many(["X","y"])
+    assert sorted(left["#a"]) == ["x","y"]
+    assert left["#b"] == ["y"]
+    assert roster.view("#a") == ["z"]
+    assert roster.add_many("#a",["y","z"]) == ["y"]
+    assert roster.view("#a") == ["y","z"]
+
+def test_view_is_a_copy():
+    roster = Roster()
+    roster.set_names("#a",["x"])
+    view = roster.view("#a")
+    roster.add("#a","y")
+    assert view == ["x"]
+    assert roster.view("#a") == ["x","y"]
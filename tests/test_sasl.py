@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for the SASL login in IrcCon
+'''
+import base64
+import pytest
+from test_caps import Client, login
+
+class SaslClient(Client):
+    '''
+    Also remembers how the SASL login went
+    '''
+    def on_sasl_success(self,account):
+        self.events.append(("sasl",account))
+
+    def on_sasl_failure(self,reason):
+        self.events.append(("failed",reason))
+
+def sasl(mechanism,account=None,password=None):
+    con = SaslClient()
+    con.set_sasl(mechanism,account,password)
+    login(con,())
+    con.sent()
+    return con
+
+def test_sasl_plain():
+    con = sasl("PLAIN","acct","secret")
+    con.dispatch([":srv CAP * LS :sasl=PLAIN,EXTERNAL"])
+    assert con.sent() == ["CAP REQ :sasl"]
+    con.dispatch([":srv CAP me ACK :sasl"])
+    assert con.sent() == ["AUTHENTICATE PLAIN"]
+    con.dispatch(["AUTHENTICATE +"])
+    (line,) = con.sent()
+    assert base64.b64decode(line.split()[1]) == b"acct\0acct\0secret"
+    con.dispatch([":srv 900 me me!u@h acct :You are now logged in as acct",":srv 903 me :SASL authentication successful"])
+    assert con.sent() == ["CAP END"]
+    assert con.saslState == "done"
+    assert con.events == [("sasl","acct"),("caps",{"sasl"})]
+
+def test_sasl_long_payload_is_split():
+    con = sasl("PLAIN","acct","x" * 600)
+    con.dispatch([":srv CAP * LS :sasl",":srv CAP me ACK :sasl","AUTHENTICATE +"])
+    lines = con.sent()[2:]
+    assert [len(line) for line in lines[:-1]] == [len("AUTHENTICATE ") + 400] * 2
+    payload = "".join(line.split()[1] for line in lines)
+    assert base64.b64decode(payload) == b"acct\0acct\0" + b"x" * 600
+
+def test_sasl_payload_of_exactly_400():
+    # 300 bytes are 400 in base64
+    con = sasl("PLAIN","acct","x" * 290)
+    con.dispatch([":srv CAP * LS :sasl",":srv CAP me ACK :sasl","AUTHENTICATE +"])
+    lines = con.sent()[2:]
+    assert len(lines[0]) == len("AUTHENTICATE ") + 400
+    assert lines[1:] == ["AUTHENTICATE +"]
+
+def test_sasl_mechanism_not_offered():
+    con = sasl("PLAIN","acct","secret")
+    con.dispatch([":srv CAP * LS :sasl=EXTERNAL",":srv CAP me ACK :sasl"])
+    assert con.sent() == ["CAP REQ :sasl","CAP END"]
+    assert con.events[0][0] == "failed"
+
+def test_sasl_failure_falls_back_to_nickserv():
+    con = sasl("PLAIN",None,"secret")
+    con.dispatch([":srv CAP * LS :sasl",":srv CAP me ACK :sasl","AUTHENTICATE +"])
+    con.sent()
+    con.dispatch([":srv 904 me :SASL authentication failed"])
+    assert con.sent() == ["CAP END"]
+    assert con.events[0] == ("failed","SASL authentication failed")
+    con.dispatch([":srv 001 me :Welcome"])
+    assert con.sent() == ["NICKSERV IDENTIFY me secret"]
+    assert con.identify is None
+
+def test_sasl_without_cap_support():
+    con = sasl("PLAIN",None,"secret")
+    con.dispatch([":srv 001 me :Welcome"])
+    assert con.events == [("failed","The server doesn't support CAP")]
+    assert con.sent() == ["NICKSERV IDENTIFY me secret"]
+
+def test_no_fallback():
+    con = SaslClient()
+    con.set_sasl("PLAIN",None,"secret",fallback=False)
+    login(con,())
+    con.sent()
+    con.dispatch([":srv 001 me :Welcome"])
+    assert con.sent() == []
+
+def test_sasl_external():
+    con = sasl("EXTERNAL")
+    con.dispatch([":srv CAP * LS :sasl",":srv CAP me ACK :sasl"])
+    assert con.sent() == ["CAP REQ :sasl","AUTHENTICATE EXTERNAL"]
+    con.dispatch(["AUTHENTICATE +"])
+    assert con.sent() == ["AUTHENTICATE +"]
+
+def test_set_sasl_checks():
+    con = SaslClient()
+    with pytest.raises(ValueError):
+        con.set_sasl("SCRAM-SHA-256","acct","secret")
+    with pytest.raises(ValueError):
+        con.set_sasl("PLAIN","acct")
+
+def test_fallback_identifies_the_account():
+    con = sasl("PLAIN","acct","secret")
+    con.dispatch([":srv CAP * LS :sasl",":srv CAP me ACK :sasl","AUTHENTICATE +"])
+    con.dispatch([":srv 904 me :SASL authentication failed",":srv 001 me :Welcome"])
+    # The account, not the nick
+    assert con.sent()[-1] == "NICKSERV IDENTIFY acct secret"
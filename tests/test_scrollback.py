@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for the Scrollback and trimming the chat boxes
+'''
+from scrollback import Scrollback, trimWidget
+
+class Widget(object):
+    '''
+    Stands in for a Tk text widget holding lines of text
+    '''
+    def __init__(self,lines):
+        self.lines = list(lines)
+
+    def index(self,where):
+        assert where == "end-1c"
+        # Tk counts from 1 and the text ends in a newline
+        return f"{len(self.lines) + 1}.0"
+
+    def delete(self,start,end):
+        assert start == "1.0"
+        del self.lines[:int(end.split(".")[0]) - 1]
+
+def message(text):
+    return [(text,"black",None)]
+
+def test_ring_bound():
+    history = Scrollback(3)
+    for i in range(5):
+        history.append(message(f"m{i}\n"))
+    assert len(history) == 3
+    assert [m[0][0] for m in history] == ["m2\n","m3\n","m4\n"]
+    assert history.full
+
+def test_byte_bound():
+    history = Scrollback(10,maxBytes=6)
+    for text in ("abc","def","ghi"):
+        history.append(message(text))
+    assert [m[0][0] for m in history] == ["def","ghi"]
+    assert history.size == 6
+    # A single message over the limit is still kept
+    history.append(message("x" * 10))
+    assert len(history) == 1
+
+def test_keep_not_full():
+    # The chat box may hold backlog from before the client started, keep up
+    # to the line limit until we had to drop something
+    history = Scrollback(5)
+    history.append(message("a\n"))
+    assert not history.full
+    assert history.keep() == 5
+    history.add_backlog(20)
+    assert history.keep() == 25
+
+def test_keep_full():
+    history = Scrollback(5)
+    for i in range(7):
+        history.append(message(f"{i}\n"))
+    assert history.keep() == 5
+    history.add_backlog(20)
+    history.add_backlog(3)
+    assert history.keep() == 28
+    history.clear()
+    assert history.keep() == 5
+    assert len(history) == 0 and history.size == 0
+
+def test_trim_waits_for_batch():
+    widget = Widget(range(30))
+    assert trimWidget(widget,20,batch=10) == 0
+    assert len(widget.lines) == 30
+    widget.lines.append(30)
+    assert trimWidget(widget,20,batch=10) == 11
+    assert widget.lines == list(range(11,31))
+
+def test_trim_keeps_backlog():
+    history = Scrollback(5)
+    for i in range(7):
+        history.append(message(f"{i}\n"))
+    history.add_backlog(10)
+    widget = Widget(range(40))
+    # Five lines of messages and ten of backlog stay
+    assert trimWidget(widget,history.keep(),batch=0) == 25
+    assert widget.lines == list(range(25,40))
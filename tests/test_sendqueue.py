@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for the write coalescing and flood control in the SendQueue
+'''
+from irclib import IrcCon
+from sendqueue import SendQueue
+
+def lines(queue,now):
+    data = queue.take(now)
+    queue.sent(len(data))
+    return data.count(b"\n")
+
+def test_burst_then_rate():
+    queue = SendQueue(burst=3,rate=1)
+    now = queue.bucket.last
+    for i in range(5):
+        queue.put(b"PRIVMSG #c :hi\r\n")
+    assert lines(queue,now) == 3
+    assert lines(queue,now) == 0
+    assert queue.delay(now) == 1
+    assert lines(queue,now + 1) == 1
+
+def test_priority_skips_the_flood_control():
+    queue = SendQueue(burst=1,rate=1)
+    now = queue.bucket.last
+    queue.put(b"PRIVMSG #c :a\r\n")
+    queue.put(b"PRIVMSG #c :b\r\n")
+    queue.put(b"PONG x\r\n",priority=True)
+    assert queue.take(now) == b"PONG x\r\nPRIVMSG #c :a\r\n"
+
+def test_lines_put_together_cost_a_token_each():
+    queue = SendQueue(burst=2,rate=1)
+    now = queue.bucket.last
+    queue.put_lines([b"PRIVMSG #c :a\r\n",b"PRIVMSG #c :b\r\n",b"PRIVMSG #c :c\r\n"])
+    assert queue.take(now) == b"PRIVMSG #c :a\r\nPRIVMSG #c :b\r\n"
+
+def test_send_lines_goes_through_the_flood_control():
+    con = IrcCon()
+    con.sendq.configure(burst=2)
+    con.send_lines(["PRIVMSG #c :a","PRIVMSG #c :b","PRIVMSG #c :c"])
+    assert lines(con.sendq,con.sendq.bucket.last) == 2
+    assert len(con.sendq) == 1
+
+def test_partial_write_is_kept():
+    queue = SendQueue()
+    queue.put(b"PING a\r\n")
+    queue.put(b"PING b\r\n")
+    now = queue.bucket.last
+    assert queue.take(now) == b"PING a\r\nPING b\r\n"
+    # Only 4 bytes made it out, the rest goes first next time
+    queue.sent(4)
+    queue.put(b"PING c\r\n")
+    assert queue.take(now) == b" a\r\nPING b\r\nPING c\r\n"
+
+def test_join_waits_for_the_write():
+    queue = SendQueue()
+    queue.put(b"QUIT\r\n")
+    assert not queue.join(0)
+    data = queue.take()
+    queue.sent(len(data))
+    assert queue.join(0)
+    assert queue.delay() is None
+
+def test_rate_zero_is_no_limit():
+    queue = SendQueue()
+    queue.configure(burst=1,rate=0)
+    for i in range(20):
+        queue.put(b"PRIVMSG #c :hi\r\n")
+    assert lines(queue,queue.bucket.last) == 20
+    assert queue.delay() is None
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for the SessionManager with connections to local servers
+'''
+import queue
+import socket
+import threading
+import pytest
+from irclib import IrcCon
+from session import SessionManager
+
+class Server(object):
+    '''
+    Accepts one client and keeps the lines it sends
+    '''
+    def __init__(self):
+        self.listener = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1",0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.lines = queue.Queue()
+        self.client = None
+        self.accepted = threading.Event()
+        threading.Thread(target=self.serve,daemon=True).start()
+
+    def serve(self):
+        (self.client,addr) = self.listener.accept()
+        self.accepted.set()
+        data = b""
+        while True:
+            try:
+                chunk = self.client.recv(4096)
+            except OSError:
+                return
+            if not chunk:
+                return
+            data += chunk
+            while b"\r\n" in data:
+                (line,data) = data.split(b"\r\n",1)
+                self.lines.put(line.decode("UTF-8"))
+
+    def send(self,*lines):
+        self.accepted.wait(5)
+        self.client.sendall("".join(f"{line}\r\n" for line in lines).encode("UTF-8"))
+
+    def expect(self):
+        return self.lines.get(timeout=5)
+
+    def hang_up(self):
+        # Our receive thread is in recv, only shutdown sends the FIN
+        self.client.shutdown(socket.SHUT_RDWR)
+        self.client.close()
+
+    def close(self):
+        if self.client:
+            self.client.close()
+        self.listener.close()
+
+class Client(IrcCon):
+    '''
+    An IrcCon which hands its messages to the test
+    '''
+    def __init__(self):
+        IrcCon.__init__(self)
+        self.wantCaps = []
+        self.messages = queue.Queue()
+        self.broken = threading.Event()
+
+    def on_message(self,who,channel,msg):
+        if msg == "boom":
+            raise RuntimeError("a handler which can't take this line")
+        self.messages.put((who,channel,msg))
+
+    def on_connection_broken(self):
+        self.broken.set()
+
+    def unknown_message(self,line):
+        pass
+
+@pytest.fixture
+def network():
+    manager = SessionManager()
+    manager.start()
+    servers = []
+    def connect(name):
+        server = Server()
+        servers.append(server)
+        con = manager.add(name,Client())
+        assert con.connect("127.0.0.1",server.port)
+        server.accepted.wait(5)
+        return (con,server)
+    yield (manager,connect)
+    manager.stop()
+    for server in servers:
+        server.close()
+
+def test_add_twice(network):
+    (manager,connect) = network
+    manager.add("net",Client())
+    with pytest.raises(KeyError):
+        manager.add("net",Client())
+    assert "net" in manager
+    assert list(manager) == ["net"]
+
+def test_networks_receive_their_own_lines(network):
+    (manager,connect) = network
+    (one,oneServer) = connect("one")
+    (two,twoServer) = connect("two")
+    oneServer.send(":a!u@h PRIVMSG #c :to one")
+    twoServer.send(":b!u@h PRIVMSG #c :to two")
+    assert one.messages.get(timeout=5) == ("a","#c","to one")
+    assert two.messages.get(timeout=5) == ("b","#c","to two")
+    assert manager["one"] is one
+    assert manager.get("three") is None
+
+def test_sends_the_queue(network):
+    (manager,connect) = network
+    (con,server) = connect("net")
+    con.login("me","user")
+    assert [server.expect(),server.expect()] == ["NICK me","USER user user user: me"]
+    server.send("PING :abc")
+    assert server.expect() == "PONG abc"
+    con.privmsg("#c","hi")
+    assert server.expect() == "PRIVMSG #c :hi"
+
+def test_bad_line_is_skipped(network,capsys):
+    (manager,connect) = network
+    (con,server) = connect("net")
+    server.send(":a!u@h PRIVMSG #c :boom",":a!u@h PRIVMSG #c :after")
+    assert con.messages.get(timeout=5) == ("a","#c","after")
+    assert con.connected
+    assert not con.broken.is_set()
+    assert "a handler which can't take this line" in capsys.readouterr().err
+
+def test_one_network_going_away(network):
+    (manager,connect) = network
+    (one,oneServer) = connect("one")
+    (two,twoServer) = connect("two")
+    oneServer.hang_up()
+    assert one.broken.wait(5)
+    assert not one.connected
+    twoServer.send(":b!u@h PRIVMSG #c :still here")
+    assert two.messages.get(timeout=5) == ("b","#c","still here")
+    assert two.connected
+
+def test_remove(network):
+    (manager,connect) = network
+    (con,server) = connect("net")
+    assert manager.remove("net") is con
+    assert "net" not in manager
+    assert con.manager is None
+    assert not con.connected
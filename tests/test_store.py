@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for the MessageStore and importing the chat logs into it
+'''
+import datetime
+import sqlite3
+import time
+from store import MessageStore, import_logs, parse_log_line, parse_search
+
+def write_log(root,day,lines):
+    path = root / "net" / "#chan"
+    path.mkdir(parents=True,exist_ok=True)
+    with open(path / f"{day.isoformat()}.txt","w") as f:
+        f.write("".join(f"{line}\n" for line in lines))
+
+def test_parse_log_line():
+    assert parse_log_line("12:00:01 | alice > hi there") == (43201,"alice","PRIVMSG","hi there",None)
+    assert parse_log_line("00:00:00 | ---> bob (u@h) has joined #c") == (0,"bob","JOIN","","u@h")
+    assert parse_log_line("00:00:00 | <--- bob (u@h) has parted #c") == (0,"bob","PART","","u@h")
+    assert parse_log_line("00:00:00 | bob (u@h) quit: Ping timeout") == (0,"bob","QUIT","Ping timeout","u@h")
+    assert parse_log_line("00:00:00 | Notice hello") == (0,None,"NOTICE","hello",None)
+    assert parse_log_line("not a log line") is None
+
+def test_parse_search():
+    assert parse_search(["#c","nick:bob","some","words"]) == ("#c","bob","some words")
+    assert parse_search(["#c"]) == (None,None,"#c")
+
+def test_record_and_search(tmp_path):
+    store = MessageStore(str(tmp_path / "history.db"))
+    store.start()
+    store.record("net","#chan","alice","PRIVMSG","the quick fox")
+    store.record("net","#other","bob","PRIVMSG","a quick dog")
+    assert store.flush(5)
+    assert sorted(row[2] for row in store.search("quick")) == ["alice","bob"]
+    (row,) = store.search("quick",channel="#CHAN")
+    assert row[1:] == ("#chan","alice","PRIVMSG","the quick fox",None)
+    assert store.search("quick",nick="carol") == []
+    # Quotes and FTS operators are just words
+    assert store.search('"quick" OR') == []
+    store.close(5)
+
+def test_import_and_search(tmp_path):
+    day = datetime.date.today() - datetime.timedelta(days=2)
+    write_log(tmp_path / "chatlog",day,["10:00:00 | alice > the quick fox","10:00:01 | bob > slow dog"])
+    db = str(tmp_path / "history.db")
+    assert import_logs(str(tmp_path / "chatlog"),db) == 2
+    store = MessageStore(db)
+    (row,) = store.search("quick")
+    assert row[1:] == ("#chan","alice","PRIVMSG","the quick fox",None)
+    assert store.search("fox",nick="bob") == []
+
+def test_import_twice(tmp_path):
+    day = datetime.date.today() - datetime.timedelta(days=2)
+    write_log(tmp_path / "chatlog",day,["10:00:00 | alice > hello"])
+    db = str(tmp_path / "history.db")
+    assert import_logs(str(tmp_path / "chatlog"),db) == 1
+    assert import_logs(str(tmp_path / "chatlog"),db) == 0
+    assert len(MessageStore(db).search("hello")) == 1
+
+def test_import_skips_what_was_recorded(tmp_path):
+    db = str(tmp_path / "history.db")
+    store = MessageStore(db)
+    store.start()
+    store.record("net","#chan","alice","PRIVMSG","recorded live")
+    store.close(5)
+    # Today's log has the same line, and one from before the store
+    since = time.time()
+    midnight = time.mktime(datetime.date.today().timetuple())
+    earlier = time.strftime("%H:%M:%S",time.localtime(midnight + (since - midnight) // 2))
+    later = time.strftime("%H:%M:%S",time.localtime(since + 1))
+    lines = [f"{earlier} | alice > from before"]
+    # Near midnight there is no later time today
+    if later > earlier:
+        lines.append(f"{later} | alice > recorded live")
+    write_log(tmp_path / "chatlog",datetime.date.today(),lines)
+    assert import_logs(str(tmp_path / "chatlog"),db) == 1
+    assert len(MessageStore(db).search("recorded live")) == 1
+    assert len(MessageStore(db).search("before")) == 1
+
+def test_hosts_not_searched(tmp_path):
+    store = MessageStore(str(tmp_path / "history.db"))
+    store.start()
+    store.record("net","#chan","alice","JOIN","",host="alice@example.org")
+    store.record("net","#chan","bob","QUIT","Ping timeout",host="bob@example.org")
+    store.record("net","#chan","carol","PRIVMSG","example is a word")
+    assert store.flush(5)
+    assert [row[2] for row in store.search("example")] == ["carol"]
+    assert store.search("org") == []
+    # Nicks are searched, and the host comes back with the message
+    (row,) = store.search("alice")
+    assert row[1:] == ("#chan","alice","JOIN","","alice@example.org")
+    (row,) = store.search("timeout")
+    assert row[5] == "bob@example.org"
+    store.close(5)
+
+def test_old_database(tmp_path):
+    # Hostnames were the text of a JOIN or PART and were in the index
+    db = str(tmp_path / "history.db")
+    con = sqlite3.connect(db,isolation_level=None)
+    con.executescript('''
+        CREATE TABLE messages (id INTEGER PRIMARY KEY, time REAL NOT NULL, network TEXT NOT NULL,
+            channel TEXT NOT NULL, nick TEXT, kind TEXT NOT NULL, text TEXT NOT NULL);
+        CREATE VIRTUAL TABLE messages_fts USING fts5 (text, content='messages', content_rowid='id');
+    ''')
+    for (nick,kind,text) in (("alice","JOIN","alice@example.org"),("bob","PRIVMSG","hello there")):
+        cur = con.execute("INSERT INTO messages (time,network,channel,nick,kind,text) VALUES (1,'net','#chan',?,?,?)",(nick,kind,text))
+        con.execute("INSERT INTO messages_fts (rowid,text) VALUES (?,?)",(cur.lastrowid,text))
+    con.close()
+    store = MessageStore(db)
+    store.start()
+    assert store.search("example") == []
+    (row,) = store.search("alice")
+    assert row[3:] == ("JOIN","","alice@example.org")
+    assert [row[4] for row in store.search("hello")] == ["hello there"]
+    store.record("net","#chan","carol","PRIVMSG","hello again")
+    assert store.flush(5)
+    assert len(store.search("hello")) == 2
+    store.close(5)
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+# Author: Talhah Peerbhai
+# Email: hello@talhah.tech
+
+'''
+Tests for the TabRegistry
+'''
+from tabs import TabRegistry
+
+class Notebook(object):
+    '''
+    Stands in for the ttk notebook, remembers the titles it was given
+    '''
+    def __init__(self):
+        self.titles = dict()
+        self.calls = 0
+
+    def tab(self,index,text):
+        self.titles[index] = text
+        self.calls += 1
+
+def registry():
+    tabs = TabRegistry(Notebook())
+    for name in ("Server","#linux","alice"):
+        tabs.add(name)
+    return tabs
+
+def test_lookup():
+    tabs = registry()
+    assert tabs.lookup("#linux") == "#linux"
+    assert tabs.lookup("*#linux") == "#linux"
+    assert tabs.lookup("*alice") == "alice"
+    assert tabs.lookup("Server") == "Server"
+
+def test_lookup_after_unread():
+    tabs = registry()
+    tabs.mark_unread("#linux")
+    title = tabs.notebook.titles[tabs.tabs["#linux"].index]
+    assert title == "*#linux"
+    assert tabs.lookup(title) == "#linux"
+
+def test_index_kept_when_hidden():
+    tabs = registry()
+    index = tabs.tabs["#linux"].index
+    tabs.close("#linux")
+    assert not tabs.is_open("#linux")
+    assert "#linux" in tabs
+    assert tabs.open_tabs() == ["Server","alice"]
+    assert tabs.add("#linux") is False
+    assert tabs.is_open("#linux")
+    assert tabs.tabs["#linux"].index == index
+    assert tabs.open_tabs() == ["Server","#linux","alice"]
+    # New tabs go after the hidden ones
+    tabs.close("alice")
+    assert tabs.add("bob") is True
+    assert tabs.tabs["bob"].index == 3
+    assert tabs.names() == ["Server","#linux","alice","bob"]
+    assert len(tabs) == 4
+
+def test_unread():
+    tabs = registry()
+    notebook = tabs.notebook
+    index = tabs.tabs["alice"].index
+    tabs.mark_unread("alice")
+    tabs.mark_unread("alice",2)
+    assert tabs.unread("alice") == 3
+    # The title only changes for the first unread message
+    assert notebook.calls == 1
+    assert notebook.titles[index] == "*alice"
+    tabs.mark_read("alice")
+    assert tabs.unread("alice") == 0
+    assert notebook.titles[index] == "alice"
+    tabs.mark_read("alice")
+    assert notebook.calls == 2
+
+def test_closing_marks_read():
+    tabs = registry()
+    tabs.mark_unread("#linux")
+    tabs.close("#linux")
+    assert tabs.unread("#linux") == 0
+    assert tabs.notebook.titles[tabs.tabs["#linux"].index] == "#linux"
+
+def test_unknown_tabs():
+    tabs = TabRegistry()
+    tabs.mark_unread("nobody")
+    tabs.mark_read("nobody")
+    tabs.close("nobody")
+    assert tabs.unread("nobody") == 0
+    assert not tabs.is_open("nobody")
+    # Works without a notebook attached
+    tabs.add("bob")
+    tabs.mark_unread("bob")
+    assert tabs.unread("bob") == 1
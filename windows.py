@@ -3,11 +3,12 @@
 # Email: hello@talhah.tech
 
 '''
-This file contains the functions which create additional windows
+This file contains the functions which create additional windows. These are
+the ones needed at startup, the rest are in dialogs.py which is only imported
+once one of them is opened
 '''
 
 import PySimpleGUI as sg
-import webbrowser
 
 class EmptyValue(Exception):
     def __init__(self):
@@ -94,58 +95,3 @@ def loginWin(serv="",port="",nick="",user="",rname=""):
             errorWin("Please fill out all the fields") 
     loginWin.close()
     return (server,int(port),nick,user,rname,ssl)
-
-def commandsWin():
-    font = ("Courier New",16,"underline")
-    comWinLayout = [[sg.Text("Online guide sheet, click me",enable_events=True,font=font,key="link")],
-        [sg.Button("Okay",bind_return_key=True)]]
-    comWin = sg.Window("Command",comWinLayout,element_justification="c",finalize=True)
-    while True:
-        ev4, vals4 = comWin.read(timeout=10)
-        if ev4 == sg.WIN_CLOSED or ev4 == "Okay":
-            break
-        elif ev4 == "link":
-            webbrowser.open("https://github.com/tvlpirb/slick-irc/blob/master/commands.md")
-            comWin["link"].update("Opening in browser")
-    comWin.close()
-
-def aboutWin():
-    aboutWinLayout = [[sg.Text("Slick IRC is a simple and easy to use Internet Relay Chat client.\n\nIt was developed for my term project, 112@cmuq and \nmost likely will not see any further development.\n\nDeveloped by Talhah Peerbhai (hello@talhah.tech)\n\nVersion: 1.0\n\nLast update: 2021-11-24\n")],
-    [sg.Button("Okay",bind_return_key=True)]]
-    aboutWin = sg.Window("About",aboutWinLayout,element_justification="c",finalize=True)
-    while True:
-        ev5, vals5 = aboutWin.read(timeout=10)
-        if ev5 == sg.WIN_CLOSED or ev5 == "Okay":
-            break
-    aboutWin.close()
-
-def filterWin(flist):
-    filterWinLayout = [[sg.Text("Filter list")],
-    [sg.Listbox(values=flist,key="box",size=(10,10),expand_x=True,expand_y=True,select_mode=sg.SELECT_MODE_EXTENDED)],
-    [sg.Multiline("",size=(10,1),key="item",enter_submits=True,do_not_clear=True)],
-    [sg.Button("Add",bind_return_key=True),sg.Button("Delete"),sg.Button("Exit")]]
-    filterWin = sg.Window("About",filterWinLayout,element_justification="c",finalize=True,resizable=True)
-    while True:
-        ev6, vals6 = filterWin.read(timeout=10)
-        # Add an item to the listbox and the filter list
-        if ev6 == "Add":
-            item = filterWin["item"].get()
-            item.rstrip()
-            item.lstrip()
-            item.strip("\n")
-            if item != "":
-                if item not in flist:
-                    item = item.lower()
-                    flist.append(item)
-                    filterWin["box"].update(values=flist)
-                filterWin["item"].update("")
-        elif ev6 == "Delete":
-            item = filterWin["box"].get()
-            # Otherwise we'll get an index error deleting nothing
-            if len(item) == 1:
-                flist.remove(item[0])
-                filterWin["box"].update(values=flist)
-        if ev6 == sg.WIN_CLOSED or ev6 == "Exit":
-            break
-    filterWin.close()
-    return flist
\ No newline at end of file